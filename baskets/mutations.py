@@ -1,18 +1,21 @@
 import strawberry
 import uuid
+from django.db import transaction
 from django.utils import timezone
 from typing import Optional
 from .models import Basket, BasketItem
 from .types import BasketType, BasketItemType
 from employees.models import Employee
-from products.models import Product
-from events.producer import event_producer
+from products.catalogue import restricted_products
+from plugins.registry import plugin_registry
+from events.outbox import enqueue_event
 from django.conf import settings
 
 
 @strawberry.type
 class BasketMutations:
     @strawberry.mutation
+    @transaction.atomic
     def start_basket(self, employee_id: int, terminal_id: str, customer_identifier: Optional[str] = None) -> BasketType:
         employee = Employee.objects.get(id=employee_id)
         basket = Basket.objects.create(
@@ -22,7 +25,7 @@ class BasketMutations:
         )
         
         # Publish basket started event
-        event_producer.publish(settings.KAFKA_TOPIC, {
+        enqueue_event(settings.KAFKA_TOPIC, {
             'event_type': 'BASKET_STARTED',
             'timestamp': timezone.now().isoformat(),
             'employee_id': employee_id,
@@ -34,6 +37,7 @@ class BasketMutations:
         return basket
     
     @strawberry.mutation
+    @transaction.atomic
     def add_item(
         self, 
         basket_id: str, 
@@ -51,72 +55,63 @@ class BasketMutations:
         logger.info(f"[ADD_ITEM] Received price: {price}")
         logger.info(f"[ADD_ITEM] Received price: {price}")
         
-        # Check if product requires age verification
-        try:
-            product = Product.objects.get(product_id=product_id)
-            logger.info(f"[ADD_ITEM] Product found: {product.name}, age_restricted: {product.age_restricted}")
+        # Check if product requires age verification (in-memory index, no queries)
+        restricted_product = restricted_products.get(product_id)
+        logger.info(f"[ADD_ITEM] Product {product_id} age_restricted: {restricted_product is not None}")
+        
+        if restricted_product:
+            # Check if age verification plugin is enabled (cached plugin snapshot)
+            plugin_enabled = plugin_registry.is_enabled('age_verification')
+            
+            logger.info(f"[ADD_ITEM] Age verification plugin enabled: {plugin_enabled}")
             
-            if product.age_restricted:
-                # Check if age verification plugin is enabled
-                from plugins.models import PluginConfiguration
-                try:
-                    plugin_config = PluginConfiguration.objects.get(name='age_verification')
-                    plugin_enabled = plugin_config.enabled
-                except PluginConfiguration.DoesNotExist:
-                    plugin_enabled = False
+            if plugin_enabled:
+                logger.info(f"[ADD_ITEM] Age-restricted item detected, publishing event")
                 
-                logger.info(f"[ADD_ITEM] Age verification plugin enabled: {plugin_enabled}")
+                # Publish age verification required event
+                enqueue_event(settings.KAFKA_TOPIC, {
+                    'event_type': 'item.added',
+                    'timestamp': timezone.now().isoformat(),
+                    'basket_id': basket_id,
+                    'product_id': product_id,
+                    'product_name': product_name,
+                    'quantity': quantity,
+                    'price': price,
+                    'employee_id': basket.employee_id,
+                    'terminal_id': terminal_id,
+                    'age_restricted': True
+                })
                 
-                if plugin_enabled:
-                    logger.info(f"[ADD_ITEM] Age-restricted item detected, publishing event")
-                    
-                    # Publish age verification required event
-                    event_producer.publish(settings.KAFKA_TOPIC, {
-                        'event_type': 'item.added',
-                        'timestamp': timezone.now().isoformat(),
-                        'basket_id': basket_id,
-                        'product_id': product_id,
-                        'product_name': product_name,
-                        'quantity': quantity,
-                        'price': price,
-                        'employee_id': basket.employee.id,
-                        'terminal_id': terminal_id,
-                        'age_restricted': True
-                    })
-                    
-                    logger.info(f"[ADD_ITEM] Event published for age-restricted item - NOT adding to basket yet")
-                    
-                    # Return None - item will be added after verification
-                    return None
-                else:
-                    logger.info(f"[ADD_ITEM] Age verification plugin disabled - adding age-restricted item directly")
-                    # Plugin disabled, add age-restricted item directly
-                    item = BasketItem.objects.create(
-                        basket=basket,
-                        product_id=product_id,
-                        product_name=product_name,
-                        quantity=quantity,
-                        price=price
-                    )
-                    
-                    # Publish normal item added event
-                    event_producer.publish(settings.KAFKA_TOPIC, {
-                        'event_type': 'item.added',
-                        'timestamp': timezone.now().isoformat(),
-                        'basket_id': basket_id,
-                        'product_id': product_id,
-                        'product_name': product_name,
-                        'quantity': quantity,
-                        'price': price,
-                        'employee_id': basket.employee.id,
-                        'terminal_id': terminal_id,
-                        'age_restricted': False
-                    })
-                    
-                    return item
+                logger.info(f"[ADD_ITEM] Event published for age-restricted item - NOT adding to basket yet")
                 
-        except Product.DoesNotExist:
-            logger.warning(f"[ADD_ITEM] Product {product_id} not found")
+                # Return None - item will be added after verification
+                return None
+            else:
+                logger.info(f"[ADD_ITEM] Age verification plugin disabled - adding age-restricted item directly")
+                # Plugin disabled, add age-restricted item directly
+                item = BasketItem.objects.create(
+                    basket=basket,
+                    product_id=product_id,
+                    product_name=product_name,
+                    quantity=quantity,
+                    price=price
+                )
+                
+                # Publish normal item added event
+                enqueue_event(settings.KAFKA_TOPIC, {
+                    'event_type': 'item.added',
+                    'timestamp': timezone.now().isoformat(),
+                    'basket_id': basket_id,
+                    'product_id': product_id,
+                    'product_name': product_name,
+                    'quantity': quantity,
+                    'price': price,
+                    'employee_id': basket.employee_id,
+                    'terminal_id': terminal_id,
+                    'age_restricted': False
+                })
+                
+                return item
         
         # Add item normally if no age restriction
         logger.info(f"[ADD_ITEM] Adding normal item to database")
@@ -145,7 +140,7 @@ class BasketMutations:
             logger.info(f"[ADD_ITEM] Created new item")
         
         # Publish normal item added event for recommendations
-        event_producer.publish(settings.KAFKA_TOPIC, {
+        enqueue_event(settings.KAFKA_TOPIC, {
             'event_type': 'item.added',
             'timestamp': timezone.now().isoformat(),
             'basket_id': basket_id,
@@ -153,7 +148,7 @@ class BasketMutations:
             'product_name': product_name,
             'quantity': quantity,
             'price': price,
-            'employee_id': basket.employee.id,
+            'employee_id': basket.employee_id,
             'terminal_id': terminal_id,
             'age_restricted': False
         })
@@ -162,13 +157,14 @@ class BasketMutations:
         return item
     
     @strawberry.mutation
+    @transaction.atomic
     def remove_item(self, basket_id: str, item_id: str) -> bool:
         try:
             basket = Basket.objects.get(basket_id=basket_id)
             item = BasketItem.objects.get(id=item_id, basket=basket)
             
             # Publish event before deletion
-            event_producer.publish(settings.KAFKA_TOPIC, {
+            enqueue_event(settings.KAFKA_TOPIC, {
                 'event_type': 'item.removed',
                 'timestamp': timezone.now().isoformat(),
                 'basket_id': basket_id,
@@ -182,6 +178,7 @@ class BasketMutations:
             return False
     
     @strawberry.mutation
+    @transaction.atomic
     def update_quantity(self, basket_id: str, item_id: str, quantity: int) -> BasketItemType:
         basket = Basket.objects.get(basket_id=basket_id)
         item = BasketItem.objects.get(id=item_id, basket=basket)
@@ -189,7 +186,7 @@ class BasketMutations:
         item.save()
         
         # Publish event
-        event_producer.publish(settings.KAFKA_TOPIC, {
+        enqueue_event(settings.KAFKA_TOPIC, {
             'event_type': 'ITEM_QUANTITY_UPDATED',
             'timestamp': timezone.now().isoformat(),
             'basket_id': basket_id,
@@ -200,13 +197,14 @@ class BasketMutations:
         return item
     
     @strawberry.mutation
+    @transaction.atomic
     def finalize_basket(self, basket_id: str) -> BasketType:
         basket = Basket.objects.get(basket_id=basket_id)
         basket.status = 'FINALIZED'
         basket.save()
         
         # Publish event
-        event_producer.publish(settings.KAFKA_TOPIC, {
+        enqueue_event(settings.KAFKA_TOPIC, {
             'event_type': 'BASKET_FINALIZED',
             'timestamp': timezone.now().isoformat(),
             'basket_id': basket_id
@@ -224,22 +222,24 @@ class BasketMutations:
     ) -> bool:
         """Verify customer age for age-restricted items"""
         try:
-            # Publish age verification event
-            event_producer.publish(settings.KAFKA_TOPIC, {
-                'event_type': 'age.verified',
-                'timestamp': timezone.now().isoformat(),
-                'basket_id': basket_id,
-                'verifier_employee_id': verifier_employee_id,
-                'employee_id': verifier_employee_id,
-                'terminal_id': terminal_id,
-                'customer_age': customer_age,
-                'verification_method': verification_method
-            })
+            with transaction.atomic():
+                # Publish age verification event
+                enqueue_event(settings.KAFKA_TOPIC, {
+                    'event_type': 'age.verified',
+                    'timestamp': timezone.now().isoformat(),
+                    'basket_id': basket_id,
+                    'verifier_employee_id': verifier_employee_id,
+                    'employee_id': verifier_employee_id,
+                    'terminal_id': terminal_id,
+                    'customer_age': customer_age,
+                    'verification_method': verification_method
+                })
             return True
         except Exception:
             return False
     
     @strawberry.mutation
+    @transaction.atomic
     def add_verified_item(
         self,
         basket_id: str,
@@ -273,7 +273,7 @@ class BasketMutations:
             )
         
         # Publish verified item added event
-        event_producer.publish(settings.KAFKA_TOPIC, {
+        enqueue_event(settings.KAFKA_TOPIC, {
             'event_type': 'verified.item.added',
             'timestamp': timezone.now().isoformat(),
             'basket_id': basket_id,
@@ -289,14 +289,15 @@ class BasketMutations:
     def cancel_age_verification(self, basket_id: str, employee_id: int) -> bool:
         """Cancel age verification - reject restricted items"""
         try:
-            # Publish age verification cancelled event
-            event_producer.publish(settings.KAFKA_TOPIC, {
-                'event_type': 'age.verification.cancelled',
-                'timestamp': timezone.now().isoformat(),
-                'basket_id': basket_id,
-                'employee_id': employee_id,
-                'reason': 'VERIFICATION_CANCELLED'
-            })
+            with transaction.atomic():
+                # Publish age verification cancelled event
+                enqueue_event(settings.KAFKA_TOPIC, {
+                    'event_type': 'age.verification.cancelled',
+                    'timestamp': timezone.now().isoformat(),
+                    'basket_id': basket_id,
+                    'employee_id': employee_id,
+                    'reason': 'VERIFICATION_CANCELLED'
+                })
             return True
         except Exception:
             return False
@@ -315,27 +316,29 @@ class BasketMutations:
         logger = logging.getLogger(__name__)
         
         try:
-            basket = Basket.objects.get(basket_id=basket_id)
-            
-            # Log payment details (dummy payment - no real processing)
-            logger.info(f"[PAYMENT] Processing payment for basket {basket_id}")
-            logger.info(f"[PAYMENT] Amount: ${total_amount}, Method: {payment_method}")
-            logger.info(f"[PAYMENT] Terminal: {terminal_id}, Employee: {employee_id}")
-            
-            # Update basket status to PAID (completed)
-            basket.status = 'PAID'
-            basket.save()
-            
-            # Publish payment completed event
-            event_producer.publish(settings.KAFKA_TOPIC, {
-                'event_type': 'payment.completed',
-                'timestamp': timezone.now().isoformat(),
-                'basket_id': basket_id,
-                'terminal_id': terminal_id,
-                'employee_id': employee_id,
-                'total_amount': total_amount,
-                'payment_method': payment_method
-            })
+            with transaction.atomic():
+                basket = Basket.objects.get(basket_id=basket_id)
+                
+                # Log payment details (dummy payment - no real processing)
+                logger.info(f"[PAYMENT] Processing payment for basket {basket_id}")
+                logger.info(f"[PAYMENT] Amount: ${total_amount}, Method: {payment_method}")
+                logger.info(f"[PAYMENT] Terminal: {terminal_id}, Employee: {employee_id}")
+                
+                # Update basket status to PAID (completed)
+                basket.status = 'PAID'
+                basket.save()
+                
+                # Publish payment completed event, delivered on commit
+                # rather than on the relay's next poll
+                enqueue_event(settings.KAFKA_TOPIC, {
+                    'event_type': 'payment.completed',
+                    'timestamp': timezone.now().isoformat(),
+                    'basket_id': basket_id,
+                    'terminal_id': terminal_id,
+                    'employee_id': employee_id,
+                    'total_amount': total_amount,
+                    'payment_method': payment_method
+                }, flush=True)
             
             logger.info(f"[PAYMENT] Payment completed successfully for basket {basket_id}")
             return True
@@ -1,7 +1,7 @@
 import strawberry
 import asyncio
 from typing import AsyncGenerator, List, Optional
-from events.consumer import EventConsumer
+from events.hub import event_hub
 from django.conf import settings
 import json
 
@@ -14,12 +14,23 @@ class RestrictedItem:
     category: str
 
 
+@strawberry.type
+class BasketEventItem:
+    product_id: str
+    product_name: Optional[str] = None
+    quantity: int = 1
+    price: float = 0.0
+    item_id: Optional[str] = None
+
+
 @strawberry.type
 class BasketEvent:
     event_type: str
     basket_id: str
     product_id: Optional[str] = None
     message: Optional[str] = None
+    # Set for batch events such as 'verified.items.added'
+    items: List[BasketEventItem] = strawberry.field(default_factory=list)
 
 
 @strawberry.type
@@ -40,55 +51,60 @@ class Subscription:
     @strawberry.subscription
     async def age_verification_events(self, basket_id: str) -> AsyncGenerator[AgeVerificationEvent, None]:
         """Subscribe to age verification events for a specific basket"""
-        consumer = EventConsumer()
-        
-        async for event in consumer.subscribe_to_events([
+        async for event in event_hub.subscribe(basket_id, [
             'age.verification.required',
             'age.verification.completed', 
             'age.verification.failed',
             'age.verification.cancelled'
         ]):
-            if event.get('basket_id') == basket_id:
-                # Parse restricted items from event data
-                restricted_items = []
-                if event.get('restricted_items'):
-                    for item in event.get('restricted_items', []):
-                        restricted_items.append(RestrictedItem(
-                            product_id=item.get('productId', ''),
-                            name=item.get('name', ''),
-                            minimum_age=item.get('minimum_age', 18),
-                            category=item.get('category', '')
-                        ))
-                
-                yield AgeVerificationEvent(
-                    event_type=event.get('event_type', ''),
-                    basket_id=event.get('basket_id', ''),
-                    restricted_items=restricted_items,
-                    minimum_age=event.get('minimum_age', 18),
-                    customer_age=event.get('customer_age'),
-                    verification_method=event.get('verification_method'),
-                    verifier_id=event.get('verifier_id'),
-                    reason=event.get('reason'),
-                    action_required=event.get('action_required')
-                )
+            # Parse restricted items from event data
+            restricted_items = []
+            if event.get('restricted_items'):
+                for item in event.get('restricted_items', []):
+                    restricted_items.append(RestrictedItem(
+                        product_id=item.get('productId', ''),
+                        name=item.get('name', ''),
+                        minimum_age=item.get('minimum_age', 18),
+                        category=item.get('category', '')
+                    ))
+            
+            yield AgeVerificationEvent(
+                event_type=event.get('event_type', ''),
+                basket_id=event.get('basket_id', ''),
+                restricted_items=restricted_items,
+                minimum_age=event.get('minimum_age', 18),
+                customer_age=event.get('customer_age'),
+                verification_method=event.get('verification_method'),
+                verifier_id=event.get('verifier_id'),
+                reason=event.get('reason'),
+                action_required=event.get('action_required')
+            )
     
     @strawberry.subscription
     async def basket_events(self, basket_id: str) -> AsyncGenerator[BasketEvent, None]:
         """Subscribe to all basket-related events"""
-        consumer = EventConsumer()
-        
-        async for event in consumer.subscribe_to_events([
+        async for event in event_hub.subscribe(basket_id, [
             'item.added',
             'item.removed', 
             'verified.item.added',
+            'verified.items.added',
             'age.verification.required',
             'age.verification.completed',
             'age.verification.failed'
         ]):
-            if event.get('basket_id') == basket_id:
-                yield BasketEvent(
-                    event_type=event.get('event_type', ''),
-                    basket_id=event.get('basket_id', ''),
-                    product_id=event.get('product_id'),
-                    message=event.get('message')
-                )
\ No newline at end of file
+            yield BasketEvent(
+                event_type=event.get('event_type', ''),
+                basket_id=event.get('basket_id', ''),
+                product_id=event.get('product_id'),
+                message=event.get('message'),
+                items=[
+                    BasketEventItem(
+                        product_id=item.get('product_id', ''),
+                        product_name=item.get('product_name'),
+                        quantity=item.get('quantity', 1),
+                        price=float(item.get('price') or 0),
+                        item_id=item.get('item_id')
+                    )
+                    for item in event.get('items') or []
+                ]
+            )
\ No newline at end of file
@@ -1,3 +1,145 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
+from decimal import Decimal
+from unittest.mock import patch
+import time
 
-# Create your tests here.
+from baskets.mutations import BasketMutations
+from baskets.models import Basket, BasketItem
+from employees.models import Employee
+from events.control import control_listener
+from events.models import OutboxEvent
+from plugins.models import PluginConfiguration
+from plugins.registry import plugin_registry
+from products.catalogue import restricted_products, PRODUCTS_CHANGED
+from products.models import Product
+from schema import schema
+
+
+class BasketMutationOutboxTest(TestCase):
+
+    def setUp(self):
+        """Set up test data"""
+        self.employee = Employee.objects.create_user(
+            username='testuser',
+            password='testpass123',
+            employee_id='EMP001',
+            first_name='Test',
+            last_name='User',
+            role='CASHIER'
+        )
+        self.basket = Basket.objects.create(
+            basket_id='BASKET-123',
+            employee=self.employee,
+            status='ACTIVE'
+        )
+
+    def test_add_item_writes_outbox_event(self):
+        """Test add_item records its event in the outbox with the item row"""
+        BasketMutations.add_item(None, 'BASKET-123', 'SODA001', 'Soda', 2, 1.99, 'TERM-001')
+
+        self.assertEqual(BasketItem.objects.get(basket=self.basket).quantity, 2)
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.event_type, 'item.added')
+        self.assertEqual(event.payload['basket_id'], 'BASKET-123')
+        self.assertIsNone(event.sent_at)
+
+    def test_add_item_checks_age_restriction_without_queries(self):
+        """Test the restricted product index and plugin flag answer add_item from memory"""
+        beer = Product.objects.create(
+            product_id='BEER001', name='Beer', price=Decimal('4.99'), category='Alcohol',
+            age_restricted=True, minimum_age=21
+        )
+        PluginConfiguration.objects.create(name='age_verification', enabled=True, config={})
+        self.assertEqual(restricted_products.get('BEER001').minimum_age, 21)
+        self.assertTrue(plugin_registry.is_enabled('age_verification'))
+
+        with self.assertNumQueries(4):  # savepoint, basket, outbox insert, release
+            item = BasketMutations.add_item(None, 'BASKET-123', 'BEER001', 'Beer', 1, 4.99, 'TERM-001')
+        self.assertIsNone(item)
+        self.assertTrue(OutboxEvent.objects.filter(event_type='item.added', payload__age_restricted=True).exists())
+
+        # Saving the product refreshes the index
+        beer.age_restricted = False
+        beer.save()
+        self.assertIsNone(restricted_products.get('BEER001'))
+        BasketMutations.add_item(None, 'BASKET-123', 'BEER001', 'Beer', 1, 4.99, 'TERM-001')
+        self.assertTrue(BasketItem.objects.filter(basket=self.basket, product_id='BEER001').exists())
+
+    def test_add_item_sees_changes_made_by_other_processes(self):
+        """Test changes that send no signal in this process still reach add_item"""
+        Product.objects.create(
+            product_id='WINE001', name='Wine', price=Decimal('9.99'), category='Alcohol', age_restricted=False
+        )
+        PluginConfiguration.objects.create(name='age_verification', enabled=False, config={})
+        self.assertIsNone(restricted_products.get('WINE001'))
+        self.assertFalse(plugin_registry.is_enabled('age_verification'))
+
+        # Admin edit on another worker: only its control event arrives here
+        Product.objects.filter(product_id='WINE001').update(age_restricted=True, minimum_age=21)
+        self.assertIsNone(restricted_products.get('WINE001'))
+        control_listener.dispatch({'event_type': PRODUCTS_CHANGED, 'product_id': 'WINE001'})
+        self.assertEqual(restricted_products.get('WINE001').minimum_age, 21)
+
+        # A write nobody broadcast is picked up once the snapshot reaches its max age
+        PluginConfiguration.objects.filter(name='age_verification').update(enabled=True)
+        self.assertFalse(plugin_registry.is_enabled('age_verification'))
+        with patch('plugins.registry.time.monotonic', return_value=time.monotonic() + 60):
+            item = BasketMutations.add_item(None, 'BASKET-123', 'WINE001', 'Wine', 1, 9.99, 'TERM-001')
+
+        self.assertIsNone(item)
+        self.assertFalse(BasketItem.objects.filter(basket=self.basket, product_id='WINE001').exists())
+        self.assertTrue(OutboxEvent.objects.filter(event_type='item.added', payload__age_restricted=True).exists())
+
+
+    def test_only_restriction_changes_are_broadcast(self):
+        """Test product edits that cannot change the restricted index send no control event"""
+        def broadcasts():
+            return OutboxEvent.objects.filter(event_type=PRODUCTS_CHANGED).count()
+
+        soda = Product.objects.create(product_id='SODA001', name='Soda', price=Decimal('1.99'), category='Drinks')
+        soda.price = Decimal('2.49')
+        soda.save()
+        self.assertEqual(broadcasts(), 0)
+
+        soda.age_restricted = True
+        soda.minimum_age = 18
+        soda.save()
+        self.assertEqual(broadcasts(), 1)
+        soda.name = 'Energy Soda'
+        soda.save()
+        self.assertEqual(broadcasts(), 1)
+
+        Product.objects.create(
+            product_id='BEER001', name='Beer', price=Decimal('4.99'), category='Alcohol',
+            age_restricted=True, minimum_age=21
+        )
+        soda.delete()
+        self.assertEqual(broadcasts(), 3)
+
+
+class BasketEventsSubscriptionTest(SimpleTestCase):
+
+    @patch('baskets.subscriptions.event_hub')
+    async def test_batch_event_carries_its_items(self, mock_hub):
+        """Test 'verified.items.added' exposes the items it added"""
+        async def events(basket_id, event_types):
+            yield {
+                'event_type': 'verified.items.added',
+                'basket_id': basket_id,
+                'items': [{'product_id': 'BEER-001', 'product_name': 'Beer', 'quantity': 2,
+                           'price': 4.99, 'item_id': '7'}],
+                'message': '1 verified item(s) added'
+            }
+        mock_hub.subscribe.side_effect = events
+
+        stream = await schema.subscribe(
+            'subscription { basketEvents(basketId: "BASKET-1") '
+            '{ eventType items { productId productName quantity price itemId } } }'
+        )
+        result = await stream.__anext__()
+        await stream.aclose()
+
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['basketEvents']['items'], [
+            {'productId': 'BEER-001', 'productName': 'Beer', 'quantity': 2, 'price': 4.99, 'itemId': '7'}
+        ])
@@ -13,6 +13,10 @@ django_asgi_app = get_asgi_application()
 from strawberry.channels import GraphQLWSConsumer
 from schema import schema
 import events.routing
+from events.control import control_listener
+
+# Follow configuration changes made by other processes
+control_listener.start()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
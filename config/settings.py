@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 import os
 import sys
+import tempfile
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -175,6 +176,92 @@ AUTH_USER_MODEL = 'employees.Employee'
 # Kafka Configuration
 KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'localhost:9092').split(',')
 KAFKA_TOPIC = os.getenv('KAFKA_TOPIC', 'pos-events')
+# Cache invalidation events; every process reads this topic without a consumer group
+KAFKA_CONTROL_TOPIC = os.getenv('KAFKA_CONTROL_TOPIC', 'pos-control')
+
+# Kafka producer batching (events are buffered and sent in batches)
+KAFKA_PRODUCER_ACKS = os.getenv('KAFKA_PRODUCER_ACKS', 'all')
+KAFKA_PRODUCER_LINGER_MS = int(os.getenv('KAFKA_PRODUCER_LINGER_MS', '5'))
+KAFKA_PRODUCER_BATCH_SIZE = int(os.getenv('KAFKA_PRODUCER_BATCH_SIZE', '65536'))
+KAFKA_PRODUCER_BUFFER_MEMORY = int(os.getenv('KAFKA_PRODUCER_BUFFER_MEMORY', str(32 * 1024 * 1024)))
+KAFKA_PRODUCER_MAX_BLOCK_MS = int(os.getenv('KAFKA_PRODUCER_MAX_BLOCK_MS', '2000'))
+KAFKA_PRODUCER_COMPRESSION_TYPE = os.getenv('KAFKA_PRODUCER_COMPRESSION_TYPE') or None
+
+# Partition key fields per event type, first non-empty field wins.
+# Unlisted event types use basket_id, then terminal_id, then employee_id.
+KAFKA_PARTITION_KEY_FIELDS = {
+    'EMPLOYEE_LOGIN': ('employee_id', 'terminal_id'),
+    'EMPLOYEE_LOGOUT': ('employee_id', 'terminal_id'),
+    'SESSION_TERMINATED': ('employee_id', 'terminal_id'),
+}
+
+# Plugin event deduplication ('memory' per process, or 'redis' shared)
+PLUGIN_DEDUP_BACKEND = os.getenv('PLUGIN_DEDUP_BACKEND', 'memory')
+PLUGIN_DEDUP_REDIS_URL = os.getenv('PLUGIN_DEDUP_REDIS_URL', 'redis://127.0.0.1:6379/1')
+PLUGIN_DEDUP_TTL_SECONDS = int(os.getenv('PLUGIN_DEDUP_TTL_SECONDS', '300'))
+PLUGIN_DEDUP_MAX_ENTRIES = int(os.getenv('PLUGIN_DEDUP_MAX_ENTRIES', '100000'))
+
+# Fraud detection state ('memory' per process, or 'redis' shared by all consumers)
+FRAUD_STATE_BACKEND = os.getenv('FRAUD_STATE_BACKEND', 'memory')
+FRAUD_STATE_REDIS_URL = os.getenv('FRAUD_STATE_REDIS_URL', 'redis://127.0.0.1:6379/2')
+# In-memory fraud state is snapshotted here by consume_events and restored on startup
+FRAUD_STATE_SNAPSHOT_PATH = os.getenv(
+    'FRAUD_STATE_SNAPSHOT_PATH', os.path.join(tempfile.gettempdir(), 'pos-fraud-state.json.gz')
+)
+FRAUD_STATE_SNAPSHOT_SECONDS = float(os.getenv('FRAUD_STATE_SNAPSHOT_SECONDS', '60'))
+# Rate hits (e.g. items added per basket) are kept this long; rule time windows
+# longer than this are capped to it.
+FRAUD_RATE_RETENTION_SECONDS = float(os.getenv('FRAUD_RATE_RETENTION_SECONDS', '3600'))
+# Per-employee and per-terminal baselines (EWMA of items per minute, basket
+# value and checkout duration) for rules with config {"mode": "baseline"}:
+# smoothing factor, samples needed before alerting, and default z-score
+# threshold (per-rule "z_threshold", "min_samples" and "scope" override).
+FRAUD_BASELINE_ALPHA = float(os.getenv('FRAUD_BASELINE_ALPHA', '0.05'))
+FRAUD_BASELINE_MIN_SAMPLES = int(os.getenv('FRAUD_BASELINE_MIN_SAMPLES', '20'))
+FRAUD_BASELINE_Z_THRESHOLD = float(os.getenv('FRAUD_BASELINE_Z_THRESHOLD', '3.0'))
+# Fraud alerts are written, pushed and published in batches: a batch is flushed
+# once it holds FRAUD_ALERT_BATCH_SIZE alerts or its oldest alert has waited
+# FRAUD_ALERT_FLUSH_SECONDS (0 flushes after every event). The consumer also
+# flushes before each offset commit (about once a second), so no commit covers
+# an unwritten alert.
+FRAUD_ALERT_BATCH_SIZE = int(os.getenv('FRAUD_ALERT_BATCH_SIZE', '100'))
+FRAUD_ALERT_FLUSH_SECONDS = float(os.getenv('FRAUD_ALERT_FLUSH_SECONDS', '1'))
+
+# Age verification states of active baskets are cached per consumer process
+# (written through to the database); least recently used beyond this are evicted
+AGE_VERIFICATION_CACHE_MAX_BASKETS = int(os.getenv('AGE_VERIFICATION_CACHE_MAX_BASKETS', '10000'))
+
+# The restricted product index (checked by add_item) and the enabled-plugin
+# snapshot are refreshed by signals and control events, and in any case
+# re-read from the database once they are this many seconds old
+RESTRICTED_PRODUCTS_MAX_AGE_SECONDS = float(os.getenv('RESTRICTED_PRODUCTS_MAX_AGE_SECONDS', '5'))
+PLUGIN_SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv('PLUGIN_SNAPSHOT_MAX_AGE_SECONDS', '5'))
+
+# Customer lookup API: keep-alive connections per client (also the number of
+# concurrent lookups); per-plugin "pool_size" and "deadline_seconds" override
+CUSTOMER_API_POOL_SIZE = int(os.getenv('CUSTOMER_API_POOL_SIZE', '10'))
+
+# Plugin execution: plugins run on a shared executor, those handling the same
+# event concurrently, each within a time budget.
+# A plugin's budget can be overridden with "handler_timeout_seconds" in its config.
+PLUGIN_EXECUTOR_WORKERS = int(os.getenv('PLUGIN_EXECUTOR_WORKERS', '8'))
+PLUGIN_HANDLER_TIMEOUT_SECONDS = float(os.getenv('PLUGIN_HANDLER_TIMEOUT_SECONDS', '10'))
+
+# Plugin circuit breakers: consecutive failures (errors or timeouts) before a
+# plugin is shed, and seconds before a probe event tests recovery. Per-plugin
+# overrides: "circuit_failure_threshold", "circuit_recovery_seconds", and
+# "circuit_open_action" ('skip' or 'defer') in the plugin's config. Deferred
+# events wait in memory (oldest dropped beyond PLUGIN_DEFERRED_MAX_EVENTS) and
+# the consumer holds its offset commits back until they have been replayed.
+PLUGIN_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('PLUGIN_CIRCUIT_FAILURE_THRESHOLD', '5'))
+PLUGIN_CIRCUIT_RECOVERY_SECONDS = float(os.getenv('PLUGIN_CIRCUIT_RECOVERY_SECONDS', '30'))
+PLUGIN_DEFERRED_MAX_EVENTS = int(os.getenv('PLUGIN_DEFERRED_MAX_EVENTS', '1000'))
+
+# Plugin metrics: consumer processes export snapshots here every few seconds;
+# the /plugins/metrics/ endpoint and plugin_stats merge the recent ones.
+PLUGIN_METRICS_DIR = os.getenv('PLUGIN_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'pos-plugin-metrics'))
+PLUGIN_METRICS_EXPORT_SECONDS = float(os.getenv('PLUGIN_METRICS_EXPORT_SECONDS', '5'))
+PLUGIN_METRICS_STALE_SECONDS = float(os.getenv('PLUGIN_METRICS_STALE_SECONDS', '300'))
 
 # CORS Configuration
 CORS_ALLOWED_ORIGINS = [
@@ -8,4 +8,5 @@ urlpatterns = [
     path('graphql/', GraphQLView.as_view(schema=schema)),
     path('api/', include('customers.urls')),
     path('events/', include('events.urls')),
+    path('plugins/', include('plugins.urls')),
 ]
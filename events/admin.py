@@ -1,3 +1,10 @@
 from django.contrib import admin
+from .models import OutboxEvent
 
-# Register your models here.
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event_type', 'topic', 'created_at', 'sent_at', 'attempts']
+    list_filter = ['event_type', 'sent_at']
+    search_fields = ['event_type', 'payload']
+    readonly_fields = ['created_at', 'sent_at']
@@ -0,0 +1,81 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from kafka import KafkaConsumer
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ControlListener:
+    """Per-process reader of the control topic.
+
+    Control events (configuration changes that invalidate in-memory caches)
+    are published to ``KAFKA_CONTROL_TOPIC``. This listener reads it without
+    a consumer group, so every process that starts it receives every
+    control event, and calls the callbacks registered for its type on a
+    background thread.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._callbacks = defaultdict(list)  # event_type -> callbacks
+            cls._instance._lock = threading.Lock()
+            cls._instance._thread = None
+            cls._instance.reconnect_delay = 5
+        return cls._instance
+
+    def register(self, event_type, callback):
+        """Call ``callback(event_data)`` for each control event of this type"""
+        with self._lock:
+            self._callbacks[event_type].append(callback)
+
+    def start(self):
+        """Start the listener thread (idempotent)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='control-listener', daemon=True)
+                self._thread.start()
+
+    def dispatch(self, event):
+        """Run the callbacks of one control event"""
+        event_type = event.get('event_type')
+        with self._lock:
+            callbacks = tuple(self._callbacks.get(event_type, ()))
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"Control event {event_type} callback failed: {e}")
+        if callbacks:
+            logger.info(f"Applied control event {event_type}")
+
+    def _run(self):
+        while True:
+            consumer = None
+            try:
+                consumer = KafkaConsumer(
+                    settings.KAFKA_CONTROL_TOPIC,
+                    bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+                    value_deserializer=lambda x: json.loads(x.decode('utf-8')),
+                    group_id=None,
+                    auto_offset_reset='latest',
+                    enable_auto_commit=False
+                )
+                logger.info("Control listener started")
+                for message in consumer:
+                    self.dispatch(message.value)
+            except Exception as e:
+                logger.error(f"Control listener error, reconnecting: {e}")
+                time.sleep(self.reconnect_delay)
+            finally:
+                if consumer:
+                    consumer.close()
+
+
+# Singleton instance
+control_listener = ControlListener()
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from kafka import KafkaConsumer
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class _Subscriber:
+    """One open subscription: an event-type filter and its asyncio queue"""
+
+    def __init__(self, basket_id, event_types, loop, maxsize):
+        self.basket_id = basket_id
+        self.event_types = frozenset(event_types)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def deliver(self, event):
+        """Runs on the subscriber's event loop"""
+        if self.queue.full():
+            # Slow client: drop the oldest event rather than stall the hub
+            self.queue.get_nowait()
+            logger.warning(f"Subscriber queue full for basket {self.basket_id}, dropped oldest event")
+        self.queue.put_nowait(event)
+
+
+class EventHub:
+    """Process-wide Kafka fan-out for GraphQL subscriptions.
+
+    A single consumer thread reads the topic, decodes each message once and
+    hands it to the asyncio queues of the subscribers registered for the
+    event's basket. The thread starts with the first subscription.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._subscribers = {}  # basket_id -> set of _Subscriber
+            cls._instance._lock = threading.Lock()
+            cls._instance._thread = None
+            cls._instance.queue_size = 100
+            cls._instance.reconnect_delay = 5
+        return cls._instance
+
+    async def subscribe(self, basket_id, event_types):
+        """Yield events of the given types for one basket until the client disconnects"""
+        subscriber = _Subscriber(basket_id, event_types, asyncio.get_running_loop(), self.queue_size)
+        self._register(subscriber)
+        try:
+            while True:
+                yield await subscriber.queue.get()
+        finally:
+            self._unregister(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def _register(self, subscriber):
+        with self._lock:
+            self._subscribers.setdefault(subscriber.basket_id, set()).add(subscriber)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='event-hub', daemon=True)
+                self._thread.start()
+        logger.info(f"Subscribed to basket {subscriber.basket_id}: {sorted(subscriber.event_types)}")
+
+    def _unregister(self, subscriber):
+        with self._lock:
+            subs = self._subscribers.get(subscriber.basket_id)
+            if subs:
+                subs.discard(subscriber)
+                if not subs:
+                    del self._subscribers[subscriber.basket_id]
+        logger.info(f"Unsubscribed from basket {subscriber.basket_id}")
+
+    def dispatch(self, event):
+        """Hand an event to every matching subscriber (thread-safe)"""
+        basket_id = event.get('basket_id')
+        if basket_id is None:
+            return
+        with self._lock:
+            subs = tuple(self._subscribers.get(basket_id, ()))
+        event_type = event.get('event_type')
+        for subscriber in subs:
+            if event_type in subscriber.event_types:
+                try:
+                    subscriber.loop.call_soon_threadsafe(subscriber.deliver, event)
+                except RuntimeError:
+                    # Event loop already closed; the finally block unregisters it
+                    pass
+
+    def _run(self):
+        """Consumer thread: read the topic and dispatch each event"""
+        while True:
+            consumer = None
+            try:
+                consumer = KafkaConsumer(
+                    settings.KAFKA_TOPIC,
+                    bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+                    value_deserializer=lambda x: json.loads(x.decode('utf-8')),
+                    auto_offset_reset='latest',
+                    enable_auto_commit=False
+                )
+                logger.info("Event hub consumer started")
+                for message in consumer:
+                    try:
+                        self.dispatch(message.value)
+                    except Exception as e:
+                        logger.error(f"Event hub dispatch error: {e}")
+            except Exception as e:
+                logger.error(f"Event hub consumer error, reconnecting: {e}")
+                time.sleep(self.reconnect_delay)
+            finally:
+                if consumer:
+                    consumer.close()
+
+
+# Singleton instance
+event_hub = EventHub()
@@ -0,0 +1,94 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import connection, transaction
+from events.hub import event_hub
+from events.outbox import enqueue_event, relay_pending
+from plugins.metrics import percentile
+from asgiref.sync import sync_to_async
+import asyncio
+import threading
+import time
+import uuid
+
+
+class Command(BaseCommand):
+    help = 'Measure time from a mutation committing an event to GraphQL subscription delivery'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=200,
+                            help='Number of events to publish')
+        parser.add_argument('--interval', type=float, default=0.01,
+                            help='Seconds between published events')
+        parser.add_argument('--warmup', type=float, default=3.0,
+                            help='Seconds to wait for the hub consumer to join the topic')
+        parser.add_argument('--relay-poll-interval', type=float, default=0.2,
+                            help='Sleep of the in-process outbox relay when the outbox is empty '
+                                 '(same default as relay_outbox)')
+        parser.add_argument('--external-relay', action='store_true',
+                            help='Leave publishing to a running relay_outbox instead of relaying in-process')
+
+    def handle(self, *args, **options):
+        stop_relay = threading.Event()
+        if not options['external_relay']:
+            threading.Thread(
+                target=self._relay, args=(options['relay_poll_interval'], stop_relay), daemon=True
+            ).start()
+        try:
+            latencies = asyncio.run(self._run(options))
+        finally:
+            stop_relay.set()
+
+        if not latencies:
+            self.stdout.write(self.style.ERROR('No events were delivered'))
+            return
+
+        latencies.sort()
+        self.stdout.write(self.style.SUCCESS(
+            f"Delivered {len(latencies)}/{options['events']} events"
+        ))
+        self.stdout.write(f"p50: {percentile(latencies, 50):.2f} ms")
+        self.stdout.write(f"p99: {percentile(latencies, 99):.2f} ms")
+        self.stdout.write(f"max: {latencies[-1]:.2f} ms")
+
+    async def _run(self, options):
+        basket_id = f"bench_{uuid.uuid4().hex[:8]}"
+        total = options['events']
+        latencies = []
+
+        async def receive():
+            async for event in event_hub.subscribe(basket_id, ['item.added']):
+                latencies.append((time.time() - event['bench_sent_at']) * 1000)
+                if len(latencies) >= total:
+                    break
+
+        receiver = asyncio.ensure_future(receive())
+        await asyncio.sleep(options['warmup'])
+
+        for i in range(total):
+            await sync_to_async(self._enqueue)({
+                'event_type': 'item.added',
+                'basket_id': basket_id,
+                'product_id': f'BENCH-{i}',
+                'bench_sent_at': time.time()
+            })
+            await asyncio.sleep(options['interval'])
+
+        try:
+            await asyncio.wait_for(receiver, timeout=10)
+        except asyncio.TimeoutError:
+            self.stdout.write(self.style.WARNING('Timed out waiting for remaining events'))
+        return latencies
+
+    def _enqueue(self, event):
+        # What a basket mutation does: the event commits with the state change
+        with transaction.atomic():
+            enqueue_event(settings.KAFKA_TOPIC, event)
+
+    def _relay(self, poll_interval, stop):
+        """Same loop as relay_outbox, until the benchmark finishes"""
+        try:
+            while not stop.is_set():
+                if not relay_pending():
+                    stop.wait(poll_interval)
+        finally:
+            connection.close()
@@ -1,12 +1,22 @@
 from django.core.management.base import BaseCommand
-from kafka import KafkaConsumer
+from kafka import KafkaConsumer, ConsumerRebalanceListener, TopicPartition
+from kafka.structs import OffsetAndMetadata
 from django.conf import settings
+from plugins.fraud_detection.snapshot import StateReplayer, StateSnapshotter
+from plugins.metrics import plugin_metrics
 from plugins.registry import plugin_registry
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from asgiref.sync import async_to_sync, sync_to_async
+from events.control import control_listener
+from events.producer import partition_key
+from events.runtime import AsyncEventRuntime
+from events.worker_pool import KeyedWorkerPool, PartitionOffsetTracker
+from functools import partial
+import asyncio
 import json
 import logging
 import sys
+import time
 
 # Configure logging to display INFO level messages
 logging.basicConfig(
@@ -21,6 +31,18 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = 'Consume events from Kafka and route to plugins'
     
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker threads; events of one basket stay on one worker')
+        parser.add_argument('--worker-queue-size', type=int, default=1000,
+                            help='Maximum queued events per worker before polling pauses')
+        parser.add_argument('--async', action='store_true', dest='use_async',
+                            help='Use the asyncio runtime: async plugins are awaited, sync plugins run in an executor')
+        parser.add_argument('--max-in-flight', type=int, default=200,
+                            help='Maximum events processed concurrently by the asyncio runtime')
+        parser.add_argument('--fraud-snapshot', default=settings.FRAUD_STATE_SNAPSHOT_PATH,
+                            help='Fraud state snapshot file (use a distinct path per consumer process; empty disables)')
+    
     def handle(self, *args, **options):
         # Register plugins (lazy import to avoid circular dependency)
         from plugins.employee_time_tracker.plugin import EmployeeTimeTrackerPlugin
@@ -35,74 +57,285 @@ class Command(BaseCommand):
         plugin_registry.register(FraudDetectionPlugin)
         plugin_registry.register(AgeVerificationPlugin)
         
+        # Follow configuration changes made by other processes
+        control_listener.start()
+        
         # Get channel layer for WebSocket communication
-        channel_layer = get_channel_layer()
+        self.channel_layer = get_channel_layer()
+        
+        # Publish plugin timings for the metrics endpoint and plugin_stats
+        plugin_metrics.enable_export()
         
-        # Create Kafka consumer
+        workers = options['workers']
+        
+        # Create Kafka consumer; offsets are committed manually once every
+        # earlier message of the partition has been processed
         consumer = KafkaConsumer(
-            settings.KAFKA_TOPIC,
             bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
             value_deserializer=lambda m: json.loads(m.decode('utf-8')),
             group_id='pos-consumer-group-1',
             auto_offset_reset='latest',
-            enable_auto_commit=True,
-            auto_commit_interval_ms=1000,
+            enable_auto_commit=False,
             session_timeout_ms=30000,
             heartbeat_interval_ms=10000
         )
         
-        self.stdout.write(self.style.SUCCESS('Kafka consumer started...'))
+        # Warm fraud detection state from the last snapshot plus the events after it
+        self.snapshotter = StateSnapshotter(options['fraud_snapshot'], settings.FRAUD_STATE_SNAPSHOT_SECONDS)
+        self._restore_fraud_state(consumer)
         
         try:
-            for message in consumer:
-                event_data = message.value
-                event_type = event_data.get('event_type')
-                employee_id = event_data.get('employee_id', 'N/A')
-                terminal_id = event_data.get('terminal_id', 'N/A')
-                
-                self.stdout.write(f"\n{'='*60}")
-                self.stdout.write(f"Event: {event_type}")
-                self.stdout.write(f"Employee ID: {employee_id} | Terminal ID: {terminal_id}")
-                self.stdout.write(f"{'='*60}")
-                
-                # Route event to plugins
-                plugin_registry.route_event(event_type, event_data)
-                
-                # Handle recommendation events for real-time updates
-                if event_type == 'RECOMMENDATION_SUGGESTED':
-                    basket_id = event_data.get('basket_id')
-                    if basket_id and channel_layer:
-                        # Get fresh recommendations from database
-                        from plugins.purchase_recommender.models import Recommendation
-                        recommendations = list(Recommendation.objects.filter(
-                            basket_id=basket_id,
-                            status='PENDING'
-                        ).values(
-                            'id', 'recommended_product_id', 'recommended_product_name',
-                            'recommended_price', 'reason', 'status'
-                        ))
-                        
-                        # Send to WebSocket group
-                        formatted_recommendations = [{
-                            'id': rec['id'],
-                            'recommendedProductId': rec['recommended_product_id'],
-                            'recommendedProductName': rec['recommended_product_name'],
-                            'recommendedPrice': float(rec['recommended_price']),
-                            'reason': rec['reason'],
-                            'status': rec['status']
-                        } for rec in recommendations]
-                        
-                        async_to_sync(channel_layer.group_send)(
-                            f'recommendations_{basket_id}',
-                            {
-                                'type': 'recommendation_message',
-                                'recommendations': formatted_recommendations
-                            }
-                        )
-                        
-                        self.stdout.write(f"Sent {len(recommendations)} recommendations to WebSocket group")
+            if options['use_async']:
+                self.stdout.write(self.style.SUCCESS('Kafka consumer started (asyncio runtime)...'))
+                runtime = AsyncEventRuntime(
+                    consumer, settings.KAFKA_TOPIC, self.aprocess_event,
+                    max_in_flight=options['max_in_flight'], before_commit=self._ready_to_commit,
+                    flush=plugin_registry.flush, on_assigned=plugin_registry.partitions_assigned,
+                    checkpoint=self.snapshotter
+                )
+                asyncio.run(runtime.run())
+            elif workers > 1:
+                self._consume_with_workers(consumer, workers, options['worker_queue_size'])
+            else:
+                self._consume(consumer)
                 
         except KeyboardInterrupt:
             self.stdout.write(self.style.WARNING('Shutting down consumer...'))
         finally:
+            plugin_registry.flush()
             consumer.close()
+            plugin_metrics.export()
+    
+    def _ready_to_commit(self):
+        """Hold offsets back while plugins have deferred events, so a restart redelivers them"""
+        return not plugin_registry.has_deferred()
+    
+    def _consume(self, consumer):
+        """Handle messages one at a time, committing about once a second"""
+        offsets = {}
+        last_commit = time.monotonic()
+        
+        def commit():
+            # Buffered work (queued fraud alerts) is written before its events are committed
+            if offsets and self._ready_to_commit() and plugin_registry.flush():
+                consumer.commit({
+                    tp: OffsetAndMetadata(offset, '', -1) for tp, offset in offsets.items()
+                })
+                # Every event before these offsets has been applied, and no other
+                self.snapshotter.maybe_save(offsets)
+        
+        class CommitOnRevoke(ConsumerRebalanceListener):
+            def on_partitions_revoked(self, revoked):
+                commit()
+                for tp in revoked:
+                    offsets.pop(tp, None)
+            
+            def on_partitions_assigned(self, assigned):
+                for tp in assigned:
+                    committed = consumer.committed(tp)
+                    if committed is not None:
+                        offsets.setdefault(tp, committed)
+                plugin_registry.partitions_assigned()
+        
+        consumer.subscribe([settings.KAFKA_TOPIC], listener=CommitOnRevoke())
+        self.stdout.write(self.style.SUCCESS('Kafka consumer started...'))
+        
+        try:
+            while True:
+                batch = consumer.poll(timeout_ms=500)
+                for tp, messages in batch.items():
+                    for message in messages:
+                        self.process_event(message.value)
+                        offsets[tp] = message.offset + 1
+                if time.monotonic() - last_commit >= 1:
+                    commit()
+                    last_commit = time.monotonic()
+        finally:
+            commit()
+    
+    def _consume_with_workers(self, consumer, workers, queue_size):
+        """Fan messages out to a worker pool keyed by basket.
+        
+        Workers finish events out of offset order, so the fraud state is
+        only snapshotted after the pool has drained and everything polled
+        is committed: it then covers exactly the events before the
+        committed offsets of every assigned partition.
+        """
+        tracker = PartitionOffsetTracker()
+        pool = KeyedWorkerPool(workers, queue_size=queue_size)
+        committed = {}  # TopicPartition -> committed offset, for every assigned partition
+        uncommitted = {}  # TopicPartition -> offset done but not yet committed
+        
+        def commit():
+            if not self._ready_to_commit():
+                return
+            uncommitted.update(tracker.committable())
+            # Buffered work (queued fraud alerts) of the done events is written first
+            if not uncommitted or not plugin_registry.flush():
+                return
+            consumer.commit({
+                tp: OffsetAndMetadata(offset, '', -1) for tp, offset in uncommitted.items()
+            })
+            committed.update(uncommitted)
+            uncommitted.clear()
+        
+        def checkpoint():
+            pool.join()
+            commit()
+            # A held-back commit leaves offsets pending; try again next cycle
+            if not tracker.pending_count() and not uncommitted:
+                self.snapshotter.maybe_save(committed)
+        
+        class CommitOnRevoke(ConsumerRebalanceListener):
+            def on_partitions_revoked(self, revoked):
+                commit()
+                tracker.forget(revoked)
+                for tp in revoked:
+                    committed.pop(tp, None)
+                    uncommitted.pop(tp, None)
+            
+            def on_partitions_assigned(self, assigned):
+                for tp in assigned:
+                    offset = consumer.committed(tp)
+                    if offset is not None:
+                        committed[tp] = offset
+                plugin_registry.partitions_assigned()
+        
+        consumer.subscribe([settings.KAFKA_TOPIC], listener=CommitOnRevoke())
+        self.stdout.write(self.style.SUCCESS(f'Kafka consumer started with {workers} workers...'))
+        
+        try:
+            while True:
+                batch = consumer.poll(timeout_ms=500)
+                for tp, messages in batch.items():
+                    for message in messages:
+                        event_data = message.value
+                        key = event_data.get('basket_id') or partition_key(event_data) or tp.partition
+                        tracker.track(tp, message.offset)
+                        pool.submit(
+                            key, self.process_event, event_data,
+                            on_done=partial(tracker.mark_done, tp, message.offset)
+                        )
+                commit()
+                if self.snapshotter.due():
+                    checkpoint()
+        finally:
+            pool.shutdown()
+            commit()
+    
+    def _restore_fraud_state(self, consumer):
+        """Load the fraud state snapshot and replay the events consumed since it was taken.
+        
+        Replay stops at the group's committed offsets, where normal
+        consumption resumes, so no event is applied twice.
+        """
+        offsets = self.snapshotter.restore()
+        if not offsets:
+            return
+        
+        partitions = [TopicPartition(topic, partition) for topic, partition in offsets]
+        replayer = KafkaConsumer(
+            bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+            value_deserializer=lambda m: json.loads(m.decode('utf-8')),
+            enable_auto_commit=False
+        )
+        try:
+            latest = replayer.end_offsets(partitions)
+            stop_at = {}
+            for tp in partitions:
+                committed = consumer.committed(tp)
+                stop_at[tp] = committed if committed is not None else latest[tp]
+            
+            replayer.assign(partitions)
+            for tp in partitions:
+                replayer.seek(tp, offsets[(tp.topic, tp.partition)])
+            
+            state = StateReplayer()
+            remaining = {tp for tp in partitions if replayer.position(tp) < stop_at[tp]}
+            replayed = 0
+            idle_polls = 0
+            while remaining and idle_polls < 5:
+                batch = replayer.poll(timeout_ms=1000)
+                idle_polls = 0 if batch else idle_polls + 1
+                for tp, messages in batch.items():
+                    for message in messages:
+                        if message.offset >= stop_at[tp]:
+                            break
+                        state.replay(message.value)
+                        replayed += 1
+                    if replayer.position(tp) >= stop_at[tp]:
+                        remaining.discard(tp)
+                        replayer.pause(tp)
+            self.stdout.write(self.style.SUCCESS(f'Replayed {replayed} events into fraud state'))
+        except Exception as e:
+            logger.error(f"Fraud state replay failed, continuing with the snapshot only: {e}")
+        finally:
+            replayer.close()
+    
+    def _log_event(self, event_data):
+        event_type = event_data.get('event_type')
+        employee_id = event_data.get('employee_id', 'N/A')
+        terminal_id = event_data.get('terminal_id', 'N/A')
+        
+        self.stdout.write(f"\n{'='*60}")
+        self.stdout.write(f"Event: {event_type}")
+        self.stdout.write(f"Employee ID: {employee_id} | Terminal ID: {terminal_id}")
+        self.stdout.write(f"{'='*60}")
+    
+    def process_event(self, event_data):
+        """Route one event to the plugins and push real-time updates"""
+        self._log_event(event_data)
+        event_type = event_data.get('event_type')
+        
+        # Route event to plugins
+        plugin_registry.route_event(event_type, event_data)
+        
+        # Handle recommendation events for real-time updates
+        if event_type == 'RECOMMENDATION_SUGGESTED':
+            basket_id = event_data.get('basket_id')
+            if basket_id and self.channel_layer:
+                message = self._recommendation_message(basket_id)
+                async_to_sync(self.channel_layer.group_send)(f'recommendations_{basket_id}', message)
+                self.stdout.write(f"Sent {len(message['recommendations'])} recommendations to WebSocket group")
+    
+    async def aprocess_event(self, event_data):
+        """Asyncio variant of process_event"""
+        self._log_event(event_data)
+        event_type = event_data.get('event_type')
+        
+        # Route event to plugins
+        await plugin_registry.aroute_event(event_type, event_data)
+        
+        # Handle recommendation events for real-time updates
+        if event_type == 'RECOMMENDATION_SUGGESTED':
+            basket_id = event_data.get('basket_id')
+            if basket_id and self.channel_layer:
+                message = await sync_to_async(self._recommendation_message)(basket_id)
+                await self.channel_layer.group_send(f'recommendations_{basket_id}', message)
+                self.stdout.write(f"Sent {len(message['recommendations'])} recommendations to WebSocket group")
+    
+    def _recommendation_message(self, basket_id):
+        """Build the WebSocket message with the basket's pending recommendations"""
+        # Get fresh recommendations from database
+        from plugins.purchase_recommender.models import Recommendation
+        recommendations = list(Recommendation.objects.filter(
+            basket_id=basket_id,
+            status='PENDING'
+        ).values(
+            'id', 'recommended_product_id', 'recommended_product_name',
+            'recommended_price', 'reason', 'status'
+        ))
+        
+        formatted_recommendations = [{
+            'id': rec['id'],
+            'recommendedProductId': rec['recommended_product_id'],
+            'recommendedProductName': rec['recommended_product_name'],
+            'recommendedPrice': float(rec['recommended_price']),
+            'reason': rec['reason'],
+            'status': rec['status']
+        } for rec in recommendations]
+        
+        return {
+            'type': 'recommendation_message',
+            'recommendations': formatted_recommendations
+        }
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from events.outbox import relay_pending
+from events.producer import event_producer
+import logging
+import sys
+import time
+
+# Configure logging to display INFO level messages
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Publish pending outbox events to Kafka in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Maximum events claimed per batch')
+        parser.add_argument('--poll-interval', type=float, default=0.2,
+                            help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the outbox once and exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        poll_interval = options['poll_interval']
+
+        self.stdout.write(self.style.SUCCESS('Outbox relay started...'))
+
+        try:
+            while True:
+                relayed = relay_pending(batch_size)
+                if relayed:
+                    logger.info(f"Relayed {relayed} outbox events")
+                    continue
+                if options['once']:
+                    break
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Shutting down outbox relay...'))
+        finally:
+            event_producer.close()
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.27 on 2026-10-17 08:19
+
+from django.db import migrations, models
+
+
+def key_pending_events(apps, schema_editor):
+    from events.producer import partition_key
+
+    OutboxEvent = apps.get_model('events', 'OutboxEvent')
+    pending = list(OutboxEvent.objects.filter(sent_at__isnull=True))
+    for event in pending:
+        event.partition_key = partition_key(event.payload) or ''
+    OutboxEvent.objects.bulk_update(pending, ['partition_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='partition_key',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(fields=['partition_key', 'id'], name='event_outbox_key_idx'),
+        ),
+        migrations.RunPython(key_pending_events, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,29 @@
 from django.db import models
 
-# Create your models here.
+
+class OutboxEvent(models.Model):
+    """Event written in the same transaction as the state change it describes.
+
+    Rows are published to Kafka by the ``relay_outbox`` command and then
+    stamped with ``sent_at``. Rows sharing a ``partition_key`` are
+    published in ``id`` order.
+    """
+    topic = models.CharField(max_length=200)
+    event_type = models.CharField(max_length=100)
+    partition_key = models.CharField(max_length=200, blank=True)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        db_table = 'event_outbox'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['sent_at', 'id'], name='event_outbox_pending_idx'),
+            models.Index(fields=['partition_key', 'id'], name='event_outbox_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} ({'sent' if self.sent_at else 'pending'})"
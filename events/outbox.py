@@ -0,0 +1,118 @@
+from django.db import transaction
+from django.utils import timezone
+from .models import OutboxEvent
+from .producer import event_producer, partition_key
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_event(topic, event_data, flush=False):
+    """Record an event in the outbox.
+
+    Call inside the ``transaction.atomic()`` block that performs the state
+    change so the event is committed (or rolled back) together with it.
+    With ``flush=True`` the pending events of the same partition key are
+    relayed and acknowledged as soon as the transaction commits, instead
+    of waiting for the ``relay_outbox`` poll.
+    """
+    event = OutboxEvent.objects.create(
+        topic=topic,
+        event_type=event_data.get('event_type', ''),
+        partition_key=partition_key(event_data) or '',
+        payload=event_data
+    )
+    if flush:
+        transaction.on_commit(lambda: _relay_now(event.partition_key))
+    return event
+
+
+def _relay_now(key):
+    try:
+        relay_pending(key=key or None)
+    except Exception as e:
+        # Still pending in the outbox, so relay_outbox will pick it up
+        logger.error(f"Immediate relay of outbox events for {key or 'unkeyed'} failed: {e}")
+
+
+def claim_pending(batch_size, key=None):
+    """Lock and return the oldest unsent events that may be published now.
+
+    Must run inside a transaction. ``SKIP LOCKED`` lets several relay
+    workers claim disjoint batches concurrently. Rows of a partition key
+    are only returned as an unbroken run from that key's oldest pending
+    row: if another worker holds an earlier row of the key, the key is
+    left to that worker so its events cannot overtake each other.
+    """
+    pending = OutboxEvent.objects.select_for_update(skip_locked=True).filter(sent_at__isnull=True)
+    if key is not None:
+        pending = pending.filter(partition_key=key)
+    claimed = list(pending.order_by('id')[:batch_size])
+
+    keys = {event.partition_key for event in claimed if event.partition_key}
+    if not keys:
+        return claimed
+
+    # Pending rows of the claimed keys, including ones locked by other workers
+    claimed_ids = {event.id for event in claimed}
+    runnable, blocked = set(), set()
+    for event_key, event_id in (
+        OutboxEvent.objects.filter(sent_at__isnull=True, partition_key__in=keys, id__lte=claimed[-1].id)
+        .order_by('id').values_list('partition_key', 'id')
+    ):
+        if event_key in blocked:
+            continue
+        if event_id in claimed_ids:
+            runnable.add(event_id)
+        else:
+            blocked.add(event_key)
+
+    return [event for event in claimed if not event.partition_key or event.id in runnable]
+
+
+def relay_pending(batch_size=500, key=None):
+    """Claim, publish and mark one batch of outbox events; returns the number sent.
+
+    Every claimed event is handed to the producer in id order, which keeps
+    the order of each partition key's events, and the batch is flushed
+    once. A key's events are only marked sent up to its first failed one:
+    that event and the key's later ones stay pending, so retries publish
+    them after it (any of the later ones that did reach the broker are then
+    delivered again, and dropped as duplicates by the consumers).
+    """
+    with transaction.atomic():
+        pending = claim_pending(batch_size, key)
+        if not pending:
+            return 0
+
+        futures = [
+            (event, event_producer.publish(event.topic, event.payload, key=event.partition_key or None))
+            for event in pending
+        ]
+        # Wait for the broker to acknowledge the batch while the rows are
+        # still locked, so no other worker can pick them up
+        event_producer.flush()
+
+        sent_ids, failed, held = [], [], 0
+        stopped = set()  # keys with a failed event
+        for event, future in futures:
+            if event.partition_key and event.partition_key in stopped:
+                held += 1
+            elif future.succeeded():
+                sent_ids.append(event.id)
+            else:
+                event.attempts += 1
+                event.last_error = str(future.exception)
+                failed.append(event)
+                if event.partition_key:
+                    stopped.add(event.partition_key)
+
+        OutboxEvent.objects.filter(id__in=sent_ids).update(sent_at=timezone.now())
+        if failed:
+            OutboxEvent.objects.bulk_update(failed, ['attempts', 'last_error'])
+            logger.error(
+                f"Failed to relay {len(failed)} outbox events, will retry "
+                f"({held} later events of the same keys held back)"
+            )
+
+    return len(sent_ids)
@@ -1,45 +1,126 @@
 from kafka import KafkaProducer
+from kafka.errors import KafkaTimeoutError
 from django.conf import settings
+import atexit
 import json
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PARTITION_KEY_FIELDS = ('basket_id', 'terminal_id', 'employee_id')
+
+
+def partition_key(event_data):
+    """Derive the Kafka partition key for an event.
+
+    Fields are tried in order and the first non-empty one wins, so every
+    event of a basket lands on the same partition and keeps its order.
+    ``KAFKA_PARTITION_KEY_FIELDS`` overrides the field order per event type.
+    """
+    fields = settings.KAFKA_PARTITION_KEY_FIELDS.get(
+        event_data.get('event_type'), DEFAULT_PARTITION_KEY_FIELDS
+    )
+    for field in fields:
+        value = event_data.get(field)
+        if value not in (None, ''):
+            return str(value)
+    return None
+
 
 class EventProducer:
+    """Batched, non-blocking Kafka publisher.
+
+    ``publish()`` hands the event to the Kafka client's in-memory buffer and
+    returns immediately; the client ships it in batches governed by
+    ``KAFKA_PRODUCER_LINGER_MS`` and ``KAFKA_PRODUCER_BATCH_SIZE``. The buffer
+    is bounded by ``KAFKA_PRODUCER_BUFFER_MEMORY``: when it is full ``send()``
+    blocks for at most ``KAFKA_PRODUCER_MAX_BLOCK_MS`` (backpressure) and then
+    raises. Pass ``flush=True`` when the caller needs the event on the broker
+    before continuing.
+    """
     _instance = None
-    
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance.producer = None
+            cls._instance._lock = threading.Lock()
+            cls._instance.delivered_count = 0
+            cls._instance.failed_count = 0
         return cls._instance
-    
+
     def _get_producer(self):
         """Lazy initialization of Kafka producer"""
         if self.producer is None:
-            self.producer = KafkaProducer(
-                bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
-                value_serializer=lambda v: json.dumps(v).encode('utf-8')
-            )
+            with self._lock:
+                if self.producer is None:
+                    self.producer = KafkaProducer(
+                        bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+                        value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+                        key_serializer=lambda k: k.encode('utf-8') if k is not None else None,
+                        acks=settings.KAFKA_PRODUCER_ACKS,
+                        linger_ms=settings.KAFKA_PRODUCER_LINGER_MS,
+                        batch_size=settings.KAFKA_PRODUCER_BATCH_SIZE,
+                        buffer_memory=settings.KAFKA_PRODUCER_BUFFER_MEMORY,
+                        max_block_ms=settings.KAFKA_PRODUCER_MAX_BLOCK_MS,
+                        compression_type=settings.KAFKA_PRODUCER_COMPRESSION_TYPE,
+                    )
+                    atexit.register(self.close)
         return self.producer
-    
-    def publish(self, topic, event_data):
-        """Publish event to Kafka topic"""
+
+    def publish(self, topic, event_data, flush=False, key=None):
+        """Publish event to Kafka topic.
+
+        The event is queued for batched delivery; delivery success or failure
+        is reported through callbacks. Set ``flush=True`` to block until this
+        and every previously queued event has been acknowledged. ``key``
+        defaults to ``partition_key(event_data)``.
+        """
         try:
             producer = self._get_producer()
-            future = producer.send(topic, event_data)
-            producer.flush()
-            logger.info(f"Published event to {topic}: {event_data}")
+            if key is None:
+                key = partition_key(event_data)
+            future = producer.send(topic, event_data, key=key)
+            future.add_callback(self._on_delivery, event_data.get('event_type'))
+            future.add_errback(self._on_delivery_error, topic, event_data.get('event_type'))
+            if flush:
+                producer.flush()
+            logger.debug(f"Queued event for {topic}: {event_data.get('event_type')}")
             return future
+        except KafkaTimeoutError as e:
+            logger.error(f"Publish buffer full, event dropped after backpressure timeout: {e}")
+            raise
         except Exception as e:
             logger.error(f"Failed to publish event: {e}")
             raise
-    
+
+    def _on_delivery(self, event_type, record_metadata):
+        """Delivery callback for acknowledged events"""
+        self.delivered_count += 1
+        logger.debug(
+            f"Delivered {event_type} to {record_metadata.topic}"
+            f"[{record_metadata.partition}]@{record_metadata.offset}"
+        )
+
+    def _on_delivery_error(self, topic, event_type, exc):
+        """Delivery callback for events the broker did not acknowledge"""
+        self.failed_count += 1
+        logger.error(f"Failed to deliver {event_type} to {topic}: {exc}")
+
+    def flush(self, timeout=None):
+        """Block until all queued events have been delivered"""
+        if self.producer:
+            self.producer.flush(timeout=timeout)
+
     def close(self):
-        """Close producer connection"""
+        """Flush pending events and close producer connection"""
         if self.producer:
-            self.producer.close()
+            try:
+                self.producer.flush()
+            finally:
+                self.producer.close()
+                self.producer = None
 
 
 # Singleton instance
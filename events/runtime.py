@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from kafka import ConsumerRebalanceListener
+from kafka.structs import OffsetAndMetadata
+from events.producer import partition_key
+from events.worker_pool import PartitionOffsetTracker
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEventRuntime:
+    """Asyncio-driven consumer loop.
+
+    Every message becomes a task; tasks with the same basket are chained so
+    they run in order, while different baskets run concurrently up to
+    ``max_in_flight``. The blocking KafkaConsumer is only touched from one
+    dedicated thread (poll, commit, close), and offsets are committed once
+    every earlier message of the partition is done. ``before_commit`` is
+    called first, on the consumer thread; if it returns False the commit is
+    held back until a later cycle. ``flush`` is called with offsets ready
+    to commit, to write out work buffered by the events before them; if it
+    returns False those offsets are kept for a later cycle.
+
+    ``on_assigned`` is called on the consumer thread after every
+    rebalance, once the new partitions are assigned.
+
+    ``checkpoint`` (e.g. a StateSnapshotter) is asked ``due()`` after each
+    commit; when it is, the runtime stops scheduling, waits for every event
+    in flight, commits, and passes ``checkpoint.maybe_save`` the committed
+    offset of every assigned partition, so the saved state covers exactly
+    the events before those offsets.
+    """
+
+    def __init__(self, consumer, topic, handler, max_in_flight=200, poll_timeout_ms=500, before_commit=None,
+                 flush=None, on_assigned=None, checkpoint=None):
+        self.consumer = consumer
+        self.topic = topic
+        self.handler = handler
+        self.max_in_flight = max_in_flight
+        self.poll_timeout_ms = poll_timeout_ms
+        self.before_commit = before_commit
+        self.flush = flush
+        self.on_assigned = on_assigned
+        self.checkpoint = checkpoint
+        self.tracker = PartitionOffsetTracker()
+        self.committed = {}  # TopicPartition -> committed offset, for every assigned partition
+        self._uncommitted = {}  # TopicPartition -> offset done but not yet committed
+        self._kafka_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='kafka-consumer')
+        self._tails = {}  # key -> last scheduled task for that key
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        runtime = self
+
+        class CommitOnRevoke(ConsumerRebalanceListener):
+            # Called from inside poll(), i.e. on the consumer thread
+            def on_partitions_revoked(self, revoked):
+                runtime._commit()
+                runtime.tracker.forget(revoked)
+                for tp in revoked:
+                    runtime.committed.pop(tp, None)
+                    runtime._uncommitted.pop(tp, None)
+
+            def on_partitions_assigned(self, assigned):
+                for tp in assigned:
+                    offset = runtime.consumer.committed(tp)
+                    if offset is not None:
+                        runtime.committed[tp] = offset
+                if runtime.on_assigned:
+                    runtime.on_assigned()
+
+        await loop.run_in_executor(
+            self._kafka_thread, partial(self.consumer.subscribe, [self.topic], listener=CommitOnRevoke())
+        )
+        poll = partial(self.consumer.poll, timeout_ms=self.poll_timeout_ms)
+
+        try:
+            while True:
+                batch = await loop.run_in_executor(self._kafka_thread, poll)
+                for tp, messages in batch.items():
+                    for message in messages:
+                        await semaphore.acquire()
+                        self._schedule(tp, message, semaphore)
+                await loop.run_in_executor(self._kafka_thread, self._commit)
+                if self.checkpoint is not None and self.checkpoint.due():
+                    await self._checkpoint()
+        finally:
+            await self._drain()
+            await loop.run_in_executor(self._kafka_thread, self._commit)
+            self._kafka_thread.shutdown(wait=True)
+
+    async def _drain(self):
+        """Wait for every scheduled event; the last task of each key finishes after the others"""
+        pending = [task for task in self._tails.values() if not task.done()]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _checkpoint(self):
+        loop = asyncio.get_running_loop()
+        await self._drain()
+        await loop.run_in_executor(self._kafka_thread, self._commit)
+        # A held-back commit leaves offsets pending; try again next cycle
+        if not self.tracker.pending_count() and not self._uncommitted:
+            await loop.run_in_executor(self._kafka_thread, self.checkpoint.maybe_save, dict(self.committed))
+
+    def _schedule(self, tp, message, semaphore):
+        event_data = message.value
+        key = event_data.get('basket_id') or partition_key(event_data) or tp.partition
+        self.tracker.track(tp, message.offset)
+
+        previous = self._tails.get(key)
+        task = asyncio.ensure_future(self._process(previous, event_data, tp, message.offset, semaphore))
+        self._tails[key] = task
+        task.add_done_callback(partial(self._release_tail, key))
+
+    def _release_tail(self, key, task):
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    async def _process(self, previous, event_data, tp, offset, semaphore):
+        try:
+            if previous is not None:
+                # Keep per-basket order: wait for the basket's previous event
+                await asyncio.wait([previous])
+            await self.handler(event_data)
+        except Exception as e:
+            logger.error(f"Event handling failed: {e}")
+        finally:
+            self.tracker.mark_done(tp, offset)
+            semaphore.release()
+
+    def _commit(self):
+        if self.before_commit and not self.before_commit():
+            return
+        self._uncommitted.update(self.tracker.committable())
+        if not self._uncommitted or (self.flush and not self.flush()):
+            return
+        offsets, self._uncommitted = self._uncommitted, {}
+        self.consumer.commit({
+            tp: OffsetAndMetadata(offset, '', -1) for tp, offset in offsets.items()
+        })
+        self.committed.update(offsets)
@@ -1,3 +1,333 @@
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase
+from unittest.mock import patch, Mock
+from io import StringIO
+from kafka import TopicPartition
+import asyncio
+import threading
+
+from events.control import ControlListener
+from events.hub import EventHub
+from events.models import OutboxEvent
+from events.outbox import enqueue_event, relay_pending
+from events.producer import EventProducer, partition_key
+from events.runtime import AsyncEventRuntime
+from events.worker_pool import KeyedWorkerPool, PartitionOffsetTracker
+
+
+class EventProducerTest(TestCase):
+
+    def setUp(self):
+        """Give each test a fresh mocked Kafka client"""
+        self.producer = EventProducer()
+        self.producer.producer = None
+        patcher = patch('events.producer.KafkaProducer')
+        self.mock_kafka = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, self.producer, 'producer', None)
+        self.kafka_instance = self.mock_kafka.return_value
+
+    def test_publish_does_not_flush_by_default(self):
+        """Test publish queues the event without a broker round-trip"""
+        self.producer.publish('pos-events', {'event_type': 'item.added'})
+
+        self.kafka_instance.send.assert_called_once()
+        self.kafka_instance.flush.assert_not_called()
+
+    def test_publish_flushes_when_requested(self):
+        """Test strict durability per call flushes the producer"""
+        self.producer.publish('pos-events', {'event_type': 'payment.completed'}, flush=True)
+
+        self.kafka_instance.flush.assert_called_once()
+
+    def test_delivery_callbacks_registered(self):
+        """Test delivery callbacks are attached to the send future"""
+        future = Mock()
+        self.kafka_instance.send.return_value = future
+
+        self.producer.publish('pos-events', {'event_type': 'item.added'})
+
+        future.add_callback.assert_called_once()
+        future.add_errback.assert_called_once()
+
+    def test_producer_configured_for_batching(self):
+        """Test the Kafka client is built with linger and buffer limits"""
+        self.producer.publish('pos-events', {'event_type': 'item.added'})
+
+        kwargs = self.mock_kafka.call_args.kwargs
+        self.assertIn('linger_ms', kwargs)
+        self.assertIn('batch_size', kwargs)
+        self.assertIn('buffer_memory', kwargs)
+        self.assertIn('max_block_ms', kwargs)
+
+    def test_publish_keys_by_basket(self):
+        """Test events are sent with the derived partition key"""
+        self.producer.publish('pos-events', {'event_type': 'item.added', 'basket_id': 'BASKET-1', 'terminal_id': 'TERM-1'})
+
+        self.assertEqual(self.kafka_instance.send.call_args.kwargs['key'], 'BASKET-1')
+
+
+class PartitionKeyTest(TestCase):
+
+    def test_basket_then_terminal_then_employee(self):
+        """Test default key falls back from basket to terminal to employee"""
+        self.assertEqual(partition_key({'event_type': 'item.added', 'basket_id': 'B1', 'terminal_id': 'T1'}), 'B1')
+        self.assertEqual(partition_key({'event_type': 'fraud.alert', 'terminal_id': 'T1', 'employee_id': 7}), 'T1')
+        self.assertEqual(partition_key({'event_type': 'fraud.alert', 'employee_id': 7}), '7')
+        self.assertIsNone(partition_key({'event_type': 'fraud.alert'}))
+
+    def test_per_event_type_override(self):
+        """Test employee session events are keyed by employee"""
+        event = {'event_type': 'EMPLOYEE_LOGIN', 'employee_id': 7, 'terminal_id': 'T1'}
+        self.assertEqual(partition_key(event), '7')
+
+
+class OutboxTest(TestCase):
+
+    def test_enqueue_rolls_back_with_transaction(self):
+        """Test outbox rows share the fate of the surrounding transaction"""
+        try:
+            with transaction.atomic():
+                enqueue_event('pos-events', {'event_type': 'item.added', 'basket_id': 'BASKET-1'})
+                raise RuntimeError('mutation failed')
+        except RuntimeError:
+            pass
+
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @patch('events.outbox.event_producer')
+    def test_relay_publishes_and_marks_sent(self, mock_producer):
+        """Test relay_outbox publishes pending rows in order and stamps them"""
+        with transaction.atomic():
+            enqueue_event('pos-events', {'event_type': 'BASKET_STARTED', 'basket_id': 'BASKET-1'})
+            enqueue_event('pos-events', {'event_type': 'item.added', 'basket_id': 'BASKET-1'})
+        mock_producer.publish.return_value.succeeded.return_value = True
+
+        call_command('relay_outbox', '--once', stdout=StringIO())
+
+        published = [c.args[1]['event_type'] for c in mock_producer.publish.call_args_list]
+        self.assertEqual(published, ['BASKET_STARTED', 'item.added'])
+        mock_producer.flush.assert_called()
+        self.assertFalse(OutboxEvent.objects.filter(sent_at__isnull=True).exists())
+
+    @patch('events.outbox.event_producer')
+    def test_relay_keeps_failed_rows_pending(self, mock_producer):
+        """Test rows the broker rejected stay pending with the error recorded"""
+        enqueue_event('pos-events', {'event_type': 'item.added', 'basket_id': 'BASKET-1'})
+        future = mock_producer.publish.return_value
+        future.succeeded.return_value = False
+        future.exception = Exception('broker unavailable')
+
+        call_command('relay_outbox', '--once', stdout=StringIO())
+
+        event = OutboxEvent.objects.get()
+        self.assertIsNone(event.sent_at)
+        self.assertEqual(event.attempts, 1)
+        self.assertIn('broker unavailable', event.last_error)
+
+
+    @patch('events.outbox.event_producer')
+    def test_relay_holds_later_rows_behind_failed_one(self, mock_producer):
+        """Test a batch is flushed once and a failed row keeps later rows of its key pending"""
+        enqueue_event('pos-events', {'event_type': 'BASKET_STARTED', 'basket_id': 'BASKET-1'})
+        enqueue_event('pos-events', {'event_type': 'item.added', 'basket_id': 'BASKET-1'})
+        enqueue_event('pos-events', {'event_type': 'BASKET_STARTED', 'basket_id': 'BASKET-2'})
+        enqueue_event('pos-events', {'event_type': 'item.added', 'basket_id': 'BASKET-2'})
+
+        def publish(topic, payload, key=None):
+            future = Mock()
+            future.succeeded.return_value = not (key == 'BASKET-1' and payload['event_type'] == 'BASKET_STARTED')
+            future.exception = Exception('broker unavailable')
+            return future
+        mock_producer.publish.side_effect = publish
+
+        self.assertEqual(relay_pending(), 2)
+
+        published = [(c.kwargs['key'], c.args[1]['event_type']) for c in mock_producer.publish.call_args_list]
+        self.assertEqual(published, [
+            ('BASKET-1', 'BASKET_STARTED'), ('BASKET-1', 'item.added'),
+            ('BASKET-2', 'BASKET_STARTED'), ('BASKET-2', 'item.added')
+        ])
+        mock_producer.flush.assert_called_once()
+        self.assertEqual(
+            list(OutboxEvent.objects.filter(sent_at__isnull=True).values_list('event_type', 'attempts')),
+            [('BASKET_STARTED', 1), ('item.added', 0)]
+        )
+
+    @patch('events.outbox.event_producer')
+    def test_flush_relays_key_on_commit(self, mock_producer):
+        """Test flush=True publishes the key's pending events once the transaction commits"""
+        mock_producer.publish.return_value.succeeded.return_value = True
+        enqueue_event('pos-events', {'event_type': 'BASKET_STARTED', 'basket_id': 'BASKET-1'})
+        enqueue_event('pos-events', {'event_type': 'BASKET_STARTED', 'basket_id': 'BASKET-2'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                enqueue_event('pos-events', {'event_type': 'payment.completed', 'basket_id': 'BASKET-1'}, flush=True)
+            mock_producer.publish.assert_not_called()
+
+        published = [c.args[1]['event_type'] for c in mock_producer.publish.call_args_list]
+        self.assertEqual(published, ['BASKET_STARTED', 'payment.completed'])
+        self.assertEqual(
+            list(OutboxEvent.objects.filter(sent_at__isnull=True).values_list('partition_key', flat=True)),
+            ['BASKET-2']
+        )
+
+
+class PartitionOffsetTrackerTest(TestCase):
+
+    def test_commit_waits_for_earlier_offsets(self):
+        """Test an offset is committable only after all earlier ones finish"""
+        tracker = PartitionOffsetTracker()
+        for offset in (10, 11, 12):
+            tracker.track('tp0', offset)
+
+        tracker.mark_done('tp0', 12)
+        tracker.mark_done('tp0', 11)
+        self.assertEqual(tracker.committable(), {})
+
+        tracker.mark_done('tp0', 10)
+        self.assertEqual(tracker.committable(), {'tp0': 13})
+        self.assertEqual(tracker.pending_count(), 0)
+
+
+class KeyedWorkerPoolTest(TestCase):
+
+    def test_same_key_runs_in_order(self):
+        """Test tasks for one key keep submission order across workers"""
+        pool = KeyedWorkerPool(4)
+        seen = {'BASKET-1': [], 'BASKET-2': []}
+        lock = threading.Lock()
+
+        def record(key, value):
+            with lock:
+                seen[key].append(value)
+
+        for i in range(50):
+            pool.submit('BASKET-1', record, 'BASKET-1', i)
+            pool.submit('BASKET-2', record, 'BASKET-2', i)
+        pool.shutdown()
+
+        self.assertEqual(seen['BASKET-1'], list(range(50)))
+        self.assertEqual(seen['BASKET-2'], list(range(50)))
+
+
+class StopConsuming(Exception):
+    pass
+
+
+class FakeConsumer:
+    """Serves fixed poll batches, then stops the runtime"""
+
+    def __init__(self, committed, batches):
+        self._committed = committed
+        self._batches = list(batches)
+        self.commits = []
+
+    def subscribe(self, topics, listener=None):
+        listener.on_partitions_assigned(list(self._committed))
+
+    def committed(self, tp):
+        return self._committed[tp]
+
+    def poll(self, timeout_ms=0):
+        if not self._batches:
+            raise StopConsuming()
+        return self._batches.pop(0)
+
+    def commit(self, offsets):
+        self.commits.append({tp: meta.offset for tp, meta in offsets.items()})
+
+
+class AsyncEventRuntimeTest(SimpleTestCase):
+
+    def test_checkpoint_waits_for_in_flight_events(self):
+        """Test the checkpoint sees every polled event done and every assigned partition's offset"""
+        busy, idle = TopicPartition('pos-events', 0), TopicPartition('pos-events', 1)
+        consumer = FakeConsumer({busy: 5, idle: 40}, [{busy: [
+            Mock(offset=5, value={'basket_id': 'BASKET-1', 'delay': 0.05}),
+            Mock(offset=6, value={'basket_id': 'BASKET-2', 'delay': 0}),
+        ]}])
+        handled = []
+        saved = []
+
+        async def handler(event_data):
+            await asyncio.sleep(event_data['delay'])
+            handled.append(event_data['basket_id'])
+
+        checkpoint = Mock()
+        checkpoint.due.return_value = True
+        checkpoint.maybe_save.side_effect = lambda offsets: saved.append((list(handled), offsets))
+        runtime = AsyncEventRuntime(consumer, 'pos-events', handler, checkpoint=checkpoint)
+
+        with self.assertRaises(StopConsuming):
+            asyncio.run(runtime.run())
+
+        self.assertEqual(saved, [(['BASKET-2', 'BASKET-1'], {busy: 7, idle: 40})])
+        self.assertEqual(consumer.commits, [{busy: 7}])
+
+
+    def test_offsets_wait_for_a_successful_flush(self):
+        """Test offsets are only committed once buffered work has been flushed"""
+        tp = TopicPartition('pos-events', 0)
+        consumer = FakeConsumer({tp: 0}, [
+            {tp: [Mock(offset=0, value={'basket_id': 'BASKET-1'})]},
+            {},
+        ])
+        flush = Mock(side_effect=[False, True])
+
+        async def handler(event_data):
+            pass
+
+        runtime = AsyncEventRuntime(consumer, 'pos-events', handler, flush=flush)
+
+        with self.assertRaises(StopConsuming):
+            asyncio.run(runtime.run())
+
+        self.assertEqual(flush.call_count, 2)
+        self.assertEqual(consumer.commits, [{tp: 1}])
+
+
+class EventHubTest(SimpleTestCase):
+
+    @patch.object(EventHub, '_run')
+    async def test_dispatch_routes_by_basket_and_type(self, mock_run):
+        """Test events reach only subscribers of their basket and type"""
+        hub = EventHub()
+        stream = hub.subscribe('BASKET-1', ['item.added'])
+        first = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0)
+
+        hub.dispatch({'event_type': 'item.added', 'basket_id': 'BASKET-2'})
+        hub.dispatch({'event_type': 'item.removed', 'basket_id': 'BASKET-1'})
+        threading.Thread(
+            target=hub.dispatch, args=({'event_type': 'item.added', 'basket_id': 'BASKET-1'},)
+        ).start()
+
+        event = await asyncio.wait_for(first, timeout=1)
+        self.assertEqual(event['basket_id'], 'BASKET-1')
+        self.assertEqual(event['event_type'], 'item.added')
+
+        await stream.aclose()
+        self.assertEqual(hub.subscriber_count(), 0)
+
+
+class ControlListenerTest(SimpleTestCase):
+
+    def test_reads_control_topic_without_consumer_group(self):
+        """Test every process gets every control event and runs its callbacks"""
+        listener = ControlListener()
+        received = []
+        listener.register('TEST_CONTROL_CHANGED', received.append)
+        self.addCleanup(listener._callbacks.pop, 'TEST_CONTROL_CHANGED', None)
+        event = {'event_type': 'TEST_CONTROL_CHANGED', 'name': 'x'}
+
+        with patch('events.control.KafkaConsumer') as mock_kafka:
+            mock_kafka.return_value.__iter__.side_effect = [iter([Mock(value=event)]), KeyboardInterrupt]
+            with self.assertRaises(KeyboardInterrupt):
+                listener._run()
+
+        self.assertIsNone(mock_kafka.call_args.kwargs['group_id'])
+        self.assertEqual(received, [event])
 
-# Create your tests here.
@@ -0,0 +1,111 @@
+from collections import deque
+from django.db import close_old_connections
+import logging
+import queue
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class PartitionOffsetTracker:
+    """Tracks in-flight offsets per partition.
+
+    Messages of one partition may finish out of order when they are handled
+    by different workers. An offset only becomes committable once it and
+    every earlier offset of the partition are done.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}  # TopicPartition -> deque of offsets in arrival order
+        self._done = {}  # TopicPartition -> set of finished offsets
+
+    def track(self, tp, offset):
+        with self._lock:
+            self._in_flight.setdefault(tp, deque()).append(offset)
+            self._done.setdefault(tp, set())
+
+    def mark_done(self, tp, offset):
+        with self._lock:
+            if tp in self._done:
+                self._done[tp].add(offset)
+
+    def committable(self):
+        """Return {tp: next_offset} for partitions whose done prefix advanced"""
+        result = {}
+        with self._lock:
+            for tp, offsets in self._in_flight.items():
+                done = self._done[tp]
+                last = None
+                while offsets and offsets[0] in done:
+                    last = offsets.popleft()
+                    done.discard(last)
+                if last is not None:
+                    result[tp] = last + 1
+        return result
+
+    def pending_count(self):
+        with self._lock:
+            return sum(len(offsets) for offsets in self._in_flight.values())
+
+    def forget(self, partitions):
+        """Drop state for partitions that were revoked in a rebalance"""
+        with self._lock:
+            for tp in partitions:
+                self._in_flight.pop(tp, None)
+                self._done.pop(tp, None)
+
+
+class KeyedWorkerPool:
+    """Fixed pool of worker threads with one FIFO queue per worker.
+
+    Tasks with the same key always go to the same worker, so they run in
+    submission order while tasks for other keys run concurrently. Queues are
+    bounded: ``submit`` blocks when the target worker is ``queue_size``
+    tasks behind.
+    """
+
+    def __init__(self, workers, queue_size=1000, name='event-worker'):
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._run, args=(q,), name=f'{name}-{i}', daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _worker_for(self, key):
+        return zlib.crc32(str(key).encode('utf-8')) % len(self._queues)
+
+    def submit(self, key, fn, *args, on_done=None):
+        """Queue ``fn(*args)`` on the worker owning ``key``"""
+        self._queues[self._worker_for(key)].put((fn, args, on_done))
+
+    def _run(self, task_queue):
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            fn, args, on_done = task
+            close_old_connections()
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(f"Worker task failed: {e}")
+            finally:
+                if on_done:
+                    on_done()
+                task_queue.task_done()
+
+    def join(self):
+        """Wait until every queued task has finished"""
+        for task_queue in self._queues:
+            task_queue.join()
+
+    def shutdown(self):
+        """Finish queued tasks and stop the worker threads"""
+        for task_queue in self._queues:
+            task_queue.put(None)
+        for thread in self._threads:
+            thread.join()
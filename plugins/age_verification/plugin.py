@@ -3,10 +3,12 @@ from .models import AgeVerificationViolation
 from .state_manager import state_manager
 from events.producer import event_producer
 from employees.models import Employee
-from products.models import Product
+from products.catalogue import restricted_products
 from django.conf import settings
+from django.db import transaction
 from datetime import datetime
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +17,11 @@ class AgeVerificationPlugin(BasePlugin):
     name = "age_verification"
     description = "Enforces age verification for restricted products"
     
+    def __init__(self, config=None):
+        super().__init__(config)
+        # Per-event context; the registry shares one instance across worker threads
+        self._event_context = threading.local()
+    
     def get_supported_events(self):
         return [
             "basket.started", "item.added", "item.removed", 
@@ -22,6 +29,10 @@ class AgeVerificationPlugin(BasePlugin):
             "payment.initiated", "payment.completed"
         ]
     
+    def on_partitions_assigned(self):
+        """Cached basket states may be stale once partitions have moved between processes"""
+        state_manager.clear_cache()
+    
     def handle_event(self, event_type, event_data):
         """Handle age verification events"""
         try:
@@ -30,8 +41,8 @@ class AgeVerificationPlugin(BasePlugin):
             terminal_id = event_data.get('terminal_id')
             
             # Store terminal_id and employee_id for use in published events
-            self._current_terminal_id = terminal_id
-            self._current_employee_id = employee_id
+            self._event_context.terminal_id = terminal_id
+            self._event_context.employee_id = employee_id
             
             logger.info(f"[AGE VERIFICATION] Processing event: {event_type} for basket {basket_id}")
             
@@ -80,39 +91,38 @@ class AgeVerificationPlugin(BasePlugin):
             logger.info(f"[AGE VERIFICATION] Skipping - not age restricted")
             return
         
-        try:
-            product = Product.objects.get(product_id=product_id)
-            logger.info(f"[AGE VERIFICATION] Found product: {product.name}, age_restricted: {product.age_restricted}")
-            
-            if product.age_restricted:
-                # Get current state
-                current_state = state_manager.get_basket_state(basket_id)
-                restricted_items = current_state['restricted_items'] if current_state else []
-                
-                # Add new restricted item
-                restricted_item = {
-                    'productId': product.product_id,
-                    'name': product.name,
-                    'minimum_age': product.minimum_age,
-                    'category': product.age_restriction_category or product.category,
-                    'quantity': event_data.get('quantity', 1),
-                    'price': event_data.get('price', float(product.price))
-                }
-                
-                # Avoid duplicates
-                if not any(item['productId'] == product_id for item in restricted_items):
-                    restricted_items.append(restricted_item)
-                
-                # Update state
-                state_manager.update_verification_requirement(basket_id, restricted_items)
-                
-                # Publish verification required event - this will trigger frontend subscription
-                self._publish_verification_required(basket_id, restricted_items)
-                
-                logger.info(f"[AGE VERIFICATION] Published verification required event for {product.name}")
-                
-        except Product.DoesNotExist:
-            logger.warning(f"[AGE VERIFICATION] Product {product_id} not found")
+        product = restricted_products.get(product_id)
+        if product is None:
+            logger.warning(f"[AGE VERIFICATION] Product {product_id} not found or not age restricted")
+            return
+        
+        logger.info(f"[AGE VERIFICATION] Found restricted product: {product.name}")
+        
+        # Get current state
+        current_state = state_manager.get_basket_state(basket_id)
+        restricted_items = current_state['restricted_items'] if current_state else []
+        
+        # Add new restricted item
+        restricted_item = {
+            'productId': product.product_id,
+            'name': product.name,
+            'minimum_age': product.minimum_age,
+            'category': product.category,
+            'quantity': event_data.get('quantity', 1),
+            'price': event_data.get('price', product.price)
+        }
+        
+        # Avoid duplicates
+        if not any(item['productId'] == product_id for item in restricted_items):
+            restricted_items.append(restricted_item)
+        
+        # Update state
+        state_manager.update_verification_requirement(basket_id, restricted_items)
+        
+        # Publish verification required event - this will trigger frontend subscription
+        self._publish_verification_required(basket_id, restricted_items)
+        
+        logger.info(f"[AGE VERIFICATION] Published verification required event for {product.name}")
     
     def _handle_item_removed(self, event_data, basket_id):
         """Recalculate verification requirements after item removal"""
@@ -149,11 +159,8 @@ class AgeVerificationPlugin(BasePlugin):
             logger.info(f"[AGE VERIFICATION] Verification already completed for basket {basket_id}, skipping")
             return
         
-        # Complete verification in state
-        state_manager.complete_verification(basket_id, verifier_id, customer_age, verification_method)
-        
-        # Get pending restricted items
-        current_state = state_manager.get_basket_state(basket_id)
+        # Complete verification in state; returns the updated state with the pending restricted items
+        current_state = state_manager.complete_verification(basket_id, verifier_id, customer_age, verification_method)
         if current_state and current_state['restricted_items']:
             # Check if customer meets age requirement
             max_required_age = max(item['minimum_age'] for item in current_state['restricted_items'])
@@ -203,8 +210,8 @@ class AgeVerificationPlugin(BasePlugin):
             'basket_id': basket_id,
             'restricted_items': restricted_items,
             'minimum_age': max(item['minimum_age'] for item in restricted_items) if restricted_items else 18,
-            'employee_id': getattr(self, '_current_employee_id', None),
-            'terminal_id': getattr(self, '_current_terminal_id', None),
+            'employee_id': getattr(self._event_context, 'employee_id', None),
+            'terminal_id': getattr(self._event_context, 'terminal_id', None),
             'message': f"Age verification required for {len(restricted_items)} item(s)"
         }
         event_producer.publish(settings.KAFKA_TOPIC, event)
@@ -219,7 +226,7 @@ class AgeVerificationPlugin(BasePlugin):
             'verification_method': verification_method,
             'verifier_id': verifier_id,
             'employee_id': verifier_id,
-            'terminal_id': getattr(self, '_current_terminal_id', None),
+            'terminal_id': getattr(self._event_context, 'terminal_id', None),
             'message': 'Age verification completed successfully'
         }
         event_producer.publish(settings.KAFKA_TOPIC, event)
@@ -284,52 +291,58 @@ class AgeVerificationPlugin(BasePlugin):
                 logger.info(f"[AGE VERIFICATION] Items already added to basket {basket_id}, skipping")
                 return
             
-            for item in restricted_items:
-                product_id = item.get('productId')
-                product_name = item.get('name')
-                quantity = item.get('quantity', 1)
-                price = item.get('price', 0.0)
-                
-                logger.info(f"[AGE VERIFICATION] Adding item {product_id} with price {price}")
-                
-                # Check if item already exists in basket
-                existing_item = BasketItem.objects.filter(
-                    basket=basket,
-                    product_id=product_id
-                ).first()
-                
-                if existing_item:
-                    # Don't increment - just ensure correct quantity (age-restricted items should only be added once after verification)
-                    existing_item.quantity = quantity
-                    existing_item.save()
-                    basket_item = existing_item
-                    logger.info(f"[AGE VERIFICATION] Set existing item quantity to {existing_item.quantity}")
-                else:
-                    # Create new basket item
-                    basket_item = BasketItem.objects.create(
-                        basket=basket,
-                        product_id=product_id,
-                        product_name=product_name,
-                        quantity=quantity,
-                        price=price
-                    )
-                    logger.info(f"[AGE VERIFICATION] Created new basket item")
-                
-                # Publish verified item added event
-                event_producer.publish(settings.KAFKA_TOPIC, {
-                    'event_type': 'verified.item.added',
-                    'timestamp': datetime.now().isoformat(),
-                    'basket_id': basket_id,
-                    'product_id': product_id,
-                    'product_name': product_name,
-                    'quantity': quantity,
-                    'price': price,
-                    'item_id': str(basket_item.id),
-                    'employee_id': basket.employee.id,
-                    'terminal_id': getattr(self, '_current_terminal_id', None)
-                })
-                
-                logger.info(f"[AGE VERIFICATION] Successfully added {product_name} with price ${price}")
+            # One row per product; age-restricted items are only added once after verification
+            wanted = {item.get('productId'): item for item in restricted_items}
+            
+            with transaction.atomic():
+                existing = {
+                    basket_item.product_id: basket_item
+                    for basket_item in BasketItem.objects.filter(basket=basket, product_id__in=list(wanted))
+                }
+                to_update = []
+                to_create = []
+                for product_id, item in wanted.items():
+                    basket_item = existing.get(product_id)
+                    if basket_item:
+                        # Don't increment - just ensure correct quantity
+                        basket_item.quantity = item.get('quantity', 1)
+                        to_update.append(basket_item)
+                    else:
+                        basket_item = BasketItem(
+                            basket=basket,
+                            product_id=product_id,
+                            product_name=item.get('name'),
+                            quantity=item.get('quantity', 1),
+                            price=item.get('price', 0.0)
+                        )
+                        to_create.append(basket_item)
+                    existing[product_id] = basket_item
+                BasketItem.objects.bulk_update(to_update, ['quantity'])
+                BasketItem.objects.bulk_create(to_create)
+            
+            logger.info(
+                f"[AGE VERIFICATION] Created {len(to_create)} and updated {len(to_update)} basket items for {basket_id}"
+            )
+            
+            # Publish one event for the whole batch of verified items
+            event_producer.publish(settings.KAFKA_TOPIC, {
+                'event_type': 'verified.items.added',
+                'timestamp': datetime.now().isoformat(),
+                'basket_id': basket_id,
+                'items': [
+                    {
+                        'product_id': product_id,
+                        'product_name': item.get('name'),
+                        'quantity': item.get('quantity', 1),
+                        'price': item.get('price', 0.0),
+                        'item_id': str(existing[product_id].id)
+                    }
+                    for product_id, item in wanted.items()
+                ],
+                'employee_id': basket.employee_id,
+                'terminal_id': getattr(self._event_context, 'terminal_id', None),
+                'message': f"{len(wanted)} verified item(s) added"
+            })
             
             # Mark items as added to prevent duplicate processing
             state_manager.mark_items_added_to_basket(basket_id)
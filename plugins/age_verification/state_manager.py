@@ -1,101 +1,171 @@
-from datetime import datetime
+from collections import OrderedDict
+from django.conf import settings
 from django.utils import timezone
 from .models import AgeVerificationState
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+# Columns of AgeVerificationState mirrored in the cache
+STATE_FIELDS = (
+    'requires_verification', 'verification_completed', 'restricted_items',
+    'verified_at', 'verifier_employee_id', 'customer_age', 'verification_method'
+)
+
+# Cached marker for a basket known to have no verification state
+_MISSING = object()
+
 
 class AgeVerificationStateManager:
-    def __init__(self):
-        self._basket_states = {}
+    """Age verification state per basket, cached in process and written through to the database.
+    
+    While this process owns a basket's partition it is the only one handling
+    the basket's events, so its cached state is authoritative: reads are
+    served from memory (the database is read once for a basket this process
+    has not seen) and each state change is a single INSERT, UPDATE or
+    DELETE. A rebalance can move the partition away and back, with another
+    process changing the state in between, so the consumer clears the cache
+    whenever partitions are assigned. States are dropped from the cache on
+    payment or cancellation; abandoned baskets are evicted least recently
+    used beyond AGE_VERIFICATION_CACHE_MAX_BASKETS.
+    """
+    
+    def __init__(self, max_baskets=None):
+        self._basket_states = OrderedDict()  # basket_id -> {field: value} or _MISSING
+        self._lock = threading.Lock()
+        self.max_baskets = max_baskets
+    
+    def _cached(self, basket_id):
+        """Cached fields of a basket, loading them on a miss; None if it has no state"""
+        with self._lock:
+            fields = self._basket_states.get(basket_id)
+            if fields is not None:
+                self._basket_states.move_to_end(basket_id)
+                return None if fields is _MISSING else fields
     
-    def get_basket_state(self, basket_id):
-        """Get basket verification state"""
         try:
             state = AgeVerificationState.objects.get(basket_id=basket_id)
-            restricted_items = state.restricted_items
-            items_added_to_basket = False
-            
-            # Handle both old format (list) and new format (dict with flag)
-            if isinstance(restricted_items, dict):
-                items_added_to_basket = restricted_items.get('items_added_to_basket', False)
-                restricted_items = restricted_items.get('items', [])
-            elif not isinstance(restricted_items, list):
-                restricted_items = []
-            
-            return {
-                'basket_id': state.basket_id,
-                'requires_verification': state.requires_verification,
-                'verification_completed': state.verification_completed,
-                'restricted_items': restricted_items,
-                'items_added_to_basket': items_added_to_basket,
-                'verified_at': state.verified_at,
-                'verifier_employee_id': state.verifier_employee_id,
-                'customer_age': state.customer_age,
-                'verification_method': state.verification_method
-            }
+            fields = {field: getattr(state, field) for field in STATE_FIELDS}
         except AgeVerificationState.DoesNotExist:
+            fields = None
+        self._remember(basket_id, fields)
+        return fields
+    
+    def _remember(self, basket_id, fields):
+        max_baskets = self.max_baskets or settings.AGE_VERIFICATION_CACHE_MAX_BASKETS
+        with self._lock:
+            self._basket_states[basket_id] = _MISSING if fields is None else fields
+            self._basket_states.move_to_end(basket_id)
+            while len(self._basket_states) > max_baskets:
+                self._basket_states.popitem(last=False)
+    
+    def _write(self, basket_id, fields, **changes):
+        """Apply changes to the cached fields and persist them with one query"""
+        if fields is None:
+            fields = {'requires_verification': False, 'verification_completed': False, 'restricted_items': [],
+                      'verified_at': None, 'verifier_employee_id': None, 'customer_age': None,
+                      'verification_method': None}
+            fields.update(changes)
+            AgeVerificationState.objects.create(basket_id=basket_id, **fields)
+        else:
+            fields = {**fields, **changes}
+            AgeVerificationState.objects.filter(basket_id=basket_id).update(updated_at=timezone.now(), **changes)
+        self._remember(basket_id, fields)
+        return fields
+    
+    def clear_cache(self):
+        """Forget every cached state (the database is unaffected)"""
+        with self._lock:
+            self._basket_states.clear()
+    
+    def get_basket_state(self, basket_id):
+        """Get basket verification state"""
+        fields = self._cached(basket_id)
+        if fields is None:
             return None
     
+        restricted_items = fields['restricted_items']
+        items_added_to_basket = False
+    
+        # Handle both old format (list) and new format (dict with flag)
+        if isinstance(restricted_items, dict):
+            items_added_to_basket = restricted_items.get('items_added_to_basket', False)
+            restricted_items = restricted_items.get('items', [])
+        elif not isinstance(restricted_items, list):
+            restricted_items = []
+    
+        return {
+            'basket_id': basket_id,
+            'requires_verification': fields['requires_verification'],
+            'verification_completed': fields['verification_completed'],
+            # Copy so callers can edit the list without touching the cache
+            'restricted_items': list(restricted_items),
+            'items_added_to_basket': items_added_to_basket,
+            'verified_at': fields['verified_at'],
+            'verifier_employee_id': fields['verifier_employee_id'],
+            'customer_age': fields['customer_age'],
+            'verification_method': fields['verification_method']
+        }
+    
     def create_basket_state(self, basket_id):
         """Create new basket verification state"""
-        state, created = AgeVerificationState.objects.get_or_create(
-            basket_id=basket_id,
-            defaults={'requires_verification': False}
-        )
-        return state
+        if self._cached(basket_id) is None:
+            self._write(basket_id, None)
+        return self.get_basket_state(basket_id)
     
     def update_verification_requirement(self, basket_id, restricted_items):
         """Update basket verification requirements"""
-        state, created = AgeVerificationState.objects.get_or_create(
-            basket_id=basket_id,
-            defaults={'requires_verification': False}
-        )
-        
-        state.requires_verification = len(restricted_items) > 0
+        requires_verification = len(restricted_items) > 0
         # Store as list format initially, will be converted to dict format when items are added
-        state.restricted_items = restricted_items
-        state.save()
-        
-        logger.info(f"Updated verification requirement for {basket_id}: {state.requires_verification}")
-        return state
+        self._write(
+            basket_id, self._cached(basket_id),
+            requires_verification=requires_verification, restricted_items=list(restricted_items)
+        )
+    
+        logger.info(f"Updated verification requirement for {basket_id}: {requires_verification}")
+        return self.get_basket_state(basket_id)
     
     def complete_verification(self, basket_id, verifier_employee_id, customer_age, verification_method):
         """Mark verification as completed"""
-        try:
-            state = AgeVerificationState.objects.get(basket_id=basket_id)
-            state.verification_completed = True
-            state.verified_at = timezone.now()
-            state.verifier_employee_id = verifier_employee_id
-            state.customer_age = customer_age
-            state.verification_method = verification_method
-            state.save()
-            
-            logger.info(f"Verification completed for {basket_id}")
-            return state
-        except AgeVerificationState.DoesNotExist:
+        fields = self._cached(basket_id)
+        if fields is None:
             logger.error(f"No verification state found for basket {basket_id}")
             return None
     
+        self._write(
+            basket_id, fields,
+            verification_completed=True,
+            verified_at=timezone.now(),
+            verifier_employee_id=verifier_employee_id,
+            customer_age=customer_age,
+            verification_method=verification_method
+        )
+    
+        logger.info(f"Verification completed for {basket_id}")
+        return self.get_basket_state(basket_id)
+    
     def mark_items_added_to_basket(self, basket_id):
         """Mark that items have been added to basket to prevent duplicates"""
-        try:
-            state = AgeVerificationState.objects.get(basket_id=basket_id)
-            # Use a simple flag in the restricted_items data to track if items were added
-            if isinstance(state.restricted_items, list) and state.restricted_items:
-                # Add a flag to indicate items have been processed
-                state.restricted_items = {
-                    'items': state.restricted_items,
-                    'items_added_to_basket': True
-                }
-                state.save()
-                logger.info(f"Marked items as added to basket for {basket_id}")
-        except AgeVerificationState.DoesNotExist:
+        fields = self._cached(basket_id)
+        if fields is None:
             logger.error(f"No verification state found for basket {basket_id}")
+            return
+    
+        # Use a simple flag in the restricted_items data to track if items were added
+        restricted_items = fields['restricted_items']
+        if isinstance(restricted_items, list) and restricted_items:
+            # Add a flag to indicate items have been processed
+            self._write(basket_id, fields, restricted_items={
+                'items': restricted_items,
+                'items_added_to_basket': True
+            })
+            logger.info(f"Marked items as added to basket for {basket_id}")
     
     def clear_basket_state(self, basket_id):
-        """Clear basket state after payment completion"""
+        """Clear basket state after payment completion or cancellation"""
+        with self._lock:
+            self._basket_states.pop(basket_id, None)
         try:
             AgeVerificationState.objects.filter(basket_id=basket_id).delete()
             logger.info(f"Cleared verification state for {basket_id}")
@@ -104,14 +174,14 @@ class AgeVerificationStateManager:
     
     def is_verification_required(self, basket_id):
         """Check if verification is required for basket"""
-        state = self.get_basket_state(basket_id)
-        return state and state['requires_verification']
+        fields = self._cached(basket_id)
+        return bool(fields) and fields['requires_verification']
     
     def is_verification_completed(self, basket_id):
         """Check if verification is completed for basket"""
-        state = self.get_basket_state(basket_id)
-        return state and state['verification_completed']
+        fields = self._cached(basket_id)
+        return bool(fields) and fields['verification_completed']
 
 
 # Singleton instance
-state_manager = AgeVerificationStateManager()
\ No newline at end of file
+state_manager = AgeVerificationStateManager()
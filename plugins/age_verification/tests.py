@@ -7,6 +7,7 @@ from plugins.models import PluginConfiguration
 from plugins.age_verification.plugin import AgeVerificationPlugin
 from plugins.age_verification.models import AgeVerificationState, AgeVerificationViolation
 from plugins.age_verification.state_manager import state_manager
+from plugins.registry import plugin_registry
 from products.models import Product
 from baskets.models import Basket, BasketItem
 from employees.models import Employee
@@ -72,6 +73,7 @@ class AgeVerificationPluginTest(TestCase):
         
         # Clear any existing state
         AgeVerificationState.objects.all().delete()
+        state_manager.clear_cache()
     
     def test_plugin_processes_events_when_enabled(self):
         """Test plugin processes age verification events when enabled"""
@@ -294,20 +296,37 @@ class AgeVerificationPluginTest(TestCase):
         self.assertEqual(basket_item.quantity, 2)
         self.assertEqual(basket_item.price, Decimal('4.99'))
         
-        # Should publish verified item added event (check the first call which is verified.item.added)
-        mock_producer.publish.assert_called()
-        # Get all calls to find the verified.item.added event
+        # Should publish one verified items added event for the batch
         calls = mock_producer.publish.call_args_list
-        verified_item_call = None
-        for call in calls:
-            if call[0][1]['event_type'] == 'verified.item.added':
-                verified_item_call = call
-                break
-        
-        self.assertIsNotNone(verified_item_call, "verified.item.added event should be published")
-        published_data = verified_item_call[0][1]
-        self.assertEqual(published_data['event_type'], 'verified.item.added')
-        self.assertEqual(published_data['product_id'], 'BEER001')
+        batch_events = [call[0][1] for call in calls if call[0][1]['event_type'] == 'verified.items.added']
+        self.assertEqual(len(batch_events), 1, "verified.items.added event should be published once")
+        published_items = batch_events[0]['items']
+        self.assertEqual([item['product_id'] for item in published_items], ['BEER001'])
+        self.assertEqual(published_items[0]['item_id'], str(basket_item.id))
+        self.assertEqual(published_items[0]['quantity'], 2)
+    
+    @patch('plugins.age_verification.plugin.event_producer')
+    def test_verified_items_are_added_in_bulk(self, mock_producer):
+        """Test verified items are written with bulk queries and published as one event"""
+        BasketItem.objects.create(basket=self.basket, product_id='BEER001', product_name='Beer', quantity=1, price=4.99)
+        restricted_items = [
+            {'productId': 'BEER001', 'name': 'Beer', 'minimum_age': 21, 'quantity': 6, 'price': 4.99},
+            {'productId': 'CIG001', 'name': 'Cigarettes', 'minimum_age': 21, 'quantity': 1, 'price': 8.99},
+            {'productId': 'WINE001', 'name': 'Wine', 'minimum_age': 21, 'quantity': 2, 'price': 12.99},
+        ]
+        state_manager.update_verification_requirement('BASKET-123', restricted_items)
+        
+        # basket, savepoint, existing rows, bulk update, bulk insert, release, state update
+        with self.assertNumQueries(7):
+            self.plugin._add_verified_items_to_basket('BASKET-123', restricted_items)
+        
+        quantities = dict(BasketItem.objects.filter(basket=self.basket).values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {'BEER001': 6, 'CIG001': 1, 'WINE001': 2})
+        mock_producer.publish.assert_called_once()
+        event = mock_producer.publish.call_args[0][1]
+        self.assertEqual(event['event_type'], 'verified.items.added')
+        self.assertEqual([item['product_id'] for item in event['items']], ['BEER001', 'CIG001', 'WINE001'])
+        self.assertTrue(state_manager.get_basket_state('BASKET-123')['items_added_to_basket'])
     
     def test_payment_completed_clears_state(self):
         """Test payment completion clears verification state"""
@@ -323,6 +342,56 @@ class AgeVerificationPluginTest(TestCase):
         # Should clear state
         self.assertFalse(AgeVerificationState.objects.filter(basket_id='BASKET-123').exists())
     
+    @patch('plugins.age_verification.plugin.event_producer')
+    def test_state_is_cached_and_written_through(self, mock_producer):
+        """Test each state change is one write and the payment path reads from the cache"""
+        with self.assertNumQueries(2):  # existence check + INSERT
+            self.plugin.handle_event('basket.started', {'basket_id': 'BASKET-123'})
+        with self.assertNumQueries(2):  # first load of the restricted product index + one UPDATE
+            self.plugin.handle_event('item.added', {
+                'basket_id': 'BASKET-123',
+                'product_id': 'BEER001',
+                'age_restricted': True
+            })
+        self.assertTrue(AgeVerificationState.objects.get(basket_id='BASKET-123').requires_verification)
+        
+        payment = {'basket_id': 'BASKET-123', 'employee_id': self.employee.id, 'terminal_id': 'TERM-001'}
+        self.plugin.handle_event('age.verified', {
+            'basket_id': 'BASKET-123',
+            'verifier_employee_id': self.employee.id,
+            'customer_age': 25,
+            'verification_method': 'ID_CHECK'
+        })
+        with self.assertNumQueries(0):
+            self.plugin.handle_event('payment.initiated', payment)
+        
+        # A process that has not seen the basket loads it once
+        state_manager.clear_cache()
+        with self.assertNumQueries(1):
+            self.assertTrue(state_manager.is_verification_completed('BASKET-123'))
+            self.assertTrue(state_manager.is_verification_required('BASKET-123'))
+        
+        self.plugin.handle_event('payment.completed', {'basket_id': 'BASKET-123'})
+        self.assertFalse(AgeVerificationState.objects.filter(basket_id='BASKET-123').exists())
+        self.assertIsNone(state_manager.get_basket_state('BASKET-123'))
+    
+    def test_rebalance_drops_cached_state(self):
+        """Test state changed by another consumer while the partition was away is not served from cache"""
+        plugin_registry.register(AgeVerificationPlugin)
+        self.addCleanup(plugin_registry.invalidate)
+        self.addCleanup(plugin_registry._plugins.pop, 'age_verification', None)
+        
+        state_manager.update_verification_requirement('BASKET-123', ['Beer'])
+        self.assertFalse(state_manager.is_verification_completed('BASKET-123'))
+        
+        # The partition moved to another consumer, which completed the verification
+        AgeVerificationState.objects.filter(basket_id='BASKET-123').update(verification_completed=True)
+        self.assertFalse(state_manager.is_verification_completed('BASKET-123'))
+        
+        plugin_registry.partitions_assigned()
+        
+        self.assertTrue(state_manager.is_verification_completed('BASKET-123'))
+    
     @patch('plugins.age_verification.plugin.event_producer')
     def test_complete_age_verification_workflow(self, mock_producer):
         """Test complete age verification workflow"""
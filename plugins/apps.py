@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PluginsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'plugins'
+    
+    def ready(self):
+        from . import signals
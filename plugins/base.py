@@ -23,3 +23,41 @@ class BasePlugin(ABC):
     def handle_event(self, event_type, event_data):
         """Handle the event"""
         pass
+    
+    def flush(self):
+        """Write out anything the plugin has buffered.
+        
+        Called before the consumer commits offsets and on shutdown; raise
+        to hold the commit back.
+        """
+        pass
+    
+    def on_partitions_assigned(self):
+        """Called after a consumer rebalance.
+        
+        Baskets of the newly assigned partitions may have been handled by
+        another process meanwhile, so per-basket caches must be dropped.
+        """
+        pass
+    
+    def close(self):
+        """Release resources held by this instance (connection pools, threads).
+        
+        Called by the registry when the instance is replaced by a new plugin
+        snapshot; calls still running on it may finish.
+        """
+        pass
+
+
+class AsyncBasePlugin(BasePlugin):
+    """Base class for plugins whose handler is a coroutine.
+    
+    Use for I/O-bound plugins (HTTP calls, channel layer pushes). The asyncio
+    consumer runtime awaits these directly and concurrently; the synchronous
+    registry path drives them with async_to_sync.
+    """
+    
+    @abstractmethod
+    async def handle_event(self, event_type, event_data):
+        """Handle the event"""
+        pass
@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Per-plugin circuit breaker.
+
+    Closed: every event is handled; ``failure_threshold`` consecutive
+    failures (errors or timeouts) open the circuit. Open: events are shed
+    until ``recovery_seconds`` have passed. Half-open: a single probe event
+    is let through; success closes the circuit, failure reopens it.
+    """
+
+    def __init__(self, name, failure_threshold=5, recovery_seconds=30.0, on_change=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.on_change = on_change
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def configure(self, failure_threshold, recovery_seconds):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+
+    def allow(self, now=None):
+        """Return True if the plugin should handle the next event"""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.state == OPEN and now - self.opened_at >= self.recovery_seconds:
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return self.state == CLOSED
+
+    def record_success(self):
+        """Return True if this success closed a previously open circuit"""
+        if self.state == CLOSED and not self.consecutive_failures:
+            return False
+        with self._lock:
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+                return True
+            return False
+
+    def record_failure(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.opened_at = now
+                self._transition(OPEN)
+
+    def _transition(self, state):
+        logger.warning(f"Circuit for plugin {self.name}: {self.state} -> {state}")
+        self.state = state
+        if self.on_change:
+            self.on_change(self.name, state)
@@ -1,27 +1,64 @@
+import asyncio
 import requests
 import logging
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from typing import Optional, Dict
 
 logger = logging.getLogger(__name__)
 
+# Server errors worth retrying; anything else is returned or given up on at once
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
 
 class CustomerAPIClient:
-    """Client for fetching customer data from external API"""
-    
-    def __init__(self, base_url: str, timeout: int = 5, retry_attempts: int = 2):
+    """Client for fetching customer data from external API.
+
+    Long-lived: requests go through one Session whose pool keeps up to
+    ``pool_size`` keep-alive connections to the API, and callers beyond
+    that wait for a free connection instead of opening more. Failed
+    attempts are retried with full-jitter exponential backoff, all within
+    an overall ``deadline_seconds`` per lookup.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 5, retry_attempts: int = 2,
+                 pool_size: int = 10, deadline_seconds: Optional[float] = None,
+                 backoff_base: float = 0.1, backoff_max: float = 2.0):
         self.base_url = base_url.rstrip('/')
         self.timeout = timeout
         self.retry_attempts = retry_attempts
-    
+        self.pool_size = pool_size
+        self.deadline_seconds = deadline_seconds if deadline_seconds is not None else timeout * retry_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _backoff(self, attempt, remaining):
+        """Full-jitter delay before the next attempt, never past the deadline"""
+        return min(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)), remaining)
+
     def fetch_customer(self, identifier: str) -> Optional[Dict]:
         """Fetch customer data from external API with retry logic"""
         url = f"{self.base_url}/{identifier}/"
-        
+        deadline = time.monotonic() + self.deadline_seconds
+
         for attempt in range(self.retry_attempts):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.error(f"[API] Deadline of {self.deadline_seconds}s exceeded for {identifier}")
+                break
             try:
                 logger.info(f"[API] Fetching customer: {identifier} (attempt {attempt + 1}/{self.retry_attempts})")
-                response = requests.get(url, timeout=self.timeout)
-                
+                response = self.session.get(url, timeout=min(self.timeout, remaining))
+
                 if response.status_code == 200:
                     data = response.json()
                     logger.info(f"[API] Success: {data.get('customer_id', 'N/A')}")
@@ -31,10 +68,57 @@ class CustomerAPIClient:
                     return None
                 else:
                     logger.error(f"[API] Error {response.status_code}: {response.text}")
-                    
+                    if response.status_code not in RETRYABLE_STATUS:
+                        return None
+
             except requests.Timeout:
                 logger.error(f"[API] Timeout on attempt {attempt + 1}")
             except requests.RequestException as e:
                 logger.error(f"[API] Request failed: {e}")
-        
+
+            if attempt + 1 < self.retry_attempts:
+                time.sleep(self._backoff(attempt, deadline - time.monotonic()))
+
         return None
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncCustomerAPIClient:
+    """Awaitable customer lookups for asyncio code.
+
+    Runs lookups of a pooled CustomerAPIClient on a dedicated thread pool
+    sized to its connection pool, with a semaphore bounding how many are in
+    flight, so the event loop is never blocked and connections are reused.
+    Usable from several event loops (e.g. async_to_sync callers): each loop
+    gets its own semaphore.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 5, retry_attempts: int = 2,
+                 max_concurrency: int = 10, **kwargs):
+        self.client = CustomerAPIClient(base_url, timeout, retry_attempts, pool_size=max_concurrency, **kwargs)
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='customer-api')
+        self._semaphores = weakref.WeakKeyDictionary()  # event loop -> semaphore
+        self._semaphore_lock = threading.Lock()
+
+    def _get_semaphore(self):
+        # asyncio primitives belong to one loop, so keep one per loop
+        loop = asyncio.get_running_loop()
+        with self._semaphore_lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def fetch_customer(self, identifier: str) -> Optional[Dict]:
+        """Fetch customer data without blocking the event loop"""
+        async with self._get_semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self.client.fetch_customer, identifier)
+
+    def close(self):
+        # Lookups already running finish; their connections are discarded
+        self._executor.shutdown(wait=False)
+        self.client.close()
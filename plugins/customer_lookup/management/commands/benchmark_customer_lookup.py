@@ -0,0 +1,124 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from concurrent.futures import ThreadPoolExecutor
+from customers.views import MockCustomerLookupView
+from plugins.customer_lookup.api_client import AsyncCustomerAPIClient, CustomerAPIClient
+from plugins.metrics import percentile
+import asyncio
+import itertools
+import logging
+import requests
+import threading
+import time
+
+MODES = ('naive', 'pooled', 'async')
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Measure customer lookups per second against the mock customer API under concurrency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=None,
+                            help='Customer API base URL (default: serve MockCustomerLookupView in-process)')
+        parser.add_argument('--lookups', type=int, default=1000,
+                            help='Lookups per mode')
+        parser.add_argument('--concurrency', type=int, default=20,
+                            help='Lookups in flight at once (and pool size)')
+        parser.add_argument('--mode', action='append', choices=MODES, dest='modes',
+                            help='Client to measure (repeatable, default: all). naive is a fresh '
+                                 'connection per lookup, as before pooling')
+
+    def handle(self, *args, **options):
+        server = None
+        base_url = options['url']
+        if base_url is None:
+            server = self._serve_mock_api()
+            base_url = f'http://127.0.0.1:{server.server_port}/api/mock-customer-lookup/'
+            self.stdout.write(f'Serving MockCustomerLookupView at {base_url}')
+
+        # Per-request INFO logs would dominate the measurement
+        logging.getLogger('plugins.customer_lookup.api_client').setLevel(logging.WARNING)
+
+        identifiers = list(itertools.islice(
+            itertools.cycle(MockCustomerLookupView.MOCK_CUSTOMERS), options['lookups']
+        ))
+        try:
+            for mode in options['modes'] or MODES:
+                run = getattr(self, f'_run_{mode}')
+                started = time.monotonic()
+                latencies, failures = run(base_url, identifiers, options['concurrency'])
+                elapsed = time.monotonic() - started
+                self._report(mode, latencies, failures, elapsed)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+    def _serve_mock_api(self):
+        try:
+            server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+        except OSError as e:
+            raise CommandError(f'Could not start the mock API server: {e}')
+        server.set_app(get_internal_wsgi_application())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def _timed(self, lookup, identifier):
+        started = time.perf_counter()
+        result = lookup(identifier)
+        return (time.perf_counter() - started) * 1000, result is not None
+
+    def _run_threads(self, lookup, identifiers, concurrency):
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda identifier: self._timed(lookup, identifier), identifiers))
+        return [latency for latency, _ in results], sum(1 for _, ok in results if not ok)
+
+    def _run_naive(self, base_url, identifiers, concurrency):
+        def lookup(identifier):
+            response = requests.get(f"{base_url.rstrip('/')}/{identifier}/", timeout=5)
+            return response.json() if response.status_code == 200 else None
+        return self._run_threads(lookup, identifiers, concurrency)
+
+    def _run_pooled(self, base_url, identifiers, concurrency):
+        client = CustomerAPIClient(base_url, pool_size=concurrency)
+        try:
+            return self._run_threads(client.fetch_customer, identifiers, concurrency)
+        finally:
+            client.close()
+
+    def _run_async(self, base_url, identifiers, concurrency):
+        client = AsyncCustomerAPIClient(base_url, max_concurrency=concurrency)
+
+        async def run():
+            # Time each lookup from when it gets a slot, like the thread pool modes
+            slots = asyncio.Semaphore(concurrency)
+
+            async def timed(identifier):
+                async with slots:
+                    started = time.perf_counter()
+                    result = await client.fetch_customer(identifier)
+                    return (time.perf_counter() - started) * 1000, result is not None
+
+            return await asyncio.gather(*(timed(identifier) for identifier in identifiers))
+
+        try:
+            results = asyncio.run(run())
+        finally:
+            client.close()
+        return [latency for latency, _ in results], sum(1 for _, ok in results if not ok)
+
+    def _report(self, mode, latencies, failures, elapsed):
+        latencies.sort()
+        rate = len(latencies) / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f'{mode}: {len(latencies)} lookups in {elapsed:.2f}s ({rate:,.0f} lookups/s), {failures} failed'
+        ))
+        self.stdout.write(
+            f'  p50: {percentile(latencies, 50):.2f} ms  p99: {percentile(latencies, 99):.2f} ms  '
+            f'max: {latencies[-1] if latencies else 0.0:.2f} ms'
+        )
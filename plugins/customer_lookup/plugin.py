@@ -1,32 +1,46 @@
-from plugins.base import BasePlugin
+from plugins.base import AsyncBasePlugin
 from customers.models import Customer, CustomerLookupLog
 from baskets.models import Basket
-from .api_client import CustomerAPIClient
+from .api_client import AsyncCustomerAPIClient
 from events.producer import event_producer
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.utils import timezone
 from dateutil import parser
 import logging
+import threading
 import time
 
 logger = logging.getLogger(__name__)
 
 
-class CustomerLookupPlugin(BasePlugin):
+class CustomerLookupPlugin(AsyncBasePlugin):
+    """Looks up the customer of a new basket, from the local cache or the external API.
+    
+    Async: the API call is awaited on the pooled async client, so the
+    asyncio consumer runtime keeps handling other events while it waits;
+    database work runs through sync_to_async.
+    """
     name = "customer_lookup"
     description = "Fetches customer data from external system and caches locally"
     
+    def __init__(self, config=None):
+        super().__init__(config)
+        # One pooled client per plugin instance; the registry rebuilds instances on config changes
+        self._api_client = None
+        self._api_client_lock = threading.Lock()
+    
     def get_supported_events(self):
         return ["BASKET_STARTED"]
     
-    def handle_event(self, event_type, event_data):
+    async def handle_event(self, event_type, event_data):
         """Handle basket started event with customer identifier"""
         if event_type == "BASKET_STARTED":
             customer_identifier = event_data.get('customer_identifier')
             if customer_identifier:
-                self._handle_customer_lookup(event_data)
+                await self._handle_customer_lookup(event_data)
     
-    def _handle_customer_lookup(self, event_data):
+    async def _handle_customer_lookup(self, event_data):
         """Process customer lookup and fetch data from external API"""
         try:
             basket_id = event_data.get('basket_id')
@@ -37,19 +51,16 @@ class CustomerLookupPlugin(BasePlugin):
             start_time = time.time()
             
             # Check cache first
-            customer = self._check_cache(customer_identifier)
+            customer = await sync_to_async(self._fresh_cached_customer)(basket_id, customer_identifier, start_time)
             
-            if customer and self._is_cache_fresh(customer):
-                logger.info(f"[CUSTOMER LOOKUP] Cache hit for {customer_identifier}")
-                self._log_lookup(basket_id, customer_identifier, 'SUCCESS', None, int((time.time() - start_time) * 1000))
-            else:
+            if customer is None:
                 # Fetch from external API
                 logger.info(f"[CUSTOMER LOOKUP] Cache miss, calling external API")
-                customer = self._fetch_from_api(basket_id, customer_identifier, start_time)
+                customer = await self._fetch_from_api(basket_id, customer_identifier, start_time)
             
             if customer:
                 # Update basket with customer
-                self._update_basket(basket_id, customer.customer_id)
+                await sync_to_async(self._update_basket)(basket_id, customer.customer_id)
                 
                 # Publish customer data fetched event
                 self._publish_customer_data(basket_id, customer)
@@ -61,6 +72,15 @@ class CustomerLookupPlugin(BasePlugin):
         except Exception as e:
             logger.error(f"[CUSTOMER LOOKUP] Error processing customer lookup: {e}")
     
+    def _fresh_cached_customer(self, basket_id, identifier, start_time):
+        """Return the cached customer if its data is still fresh, logging the cache hit"""
+        customer = self._check_cache(identifier)
+        if customer and self._is_cache_fresh(customer):
+            logger.info(f"[CUSTOMER LOOKUP] Cache hit for {identifier}")
+            self._log_lookup(basket_id, identifier, 'SUCCESS', None, int((time.time() - start_time) * 1000))
+            return customer
+        return None
+    
     def _check_cache(self, identifier):
         """Check if customer exists in local cache"""
         try:
@@ -74,40 +94,60 @@ class CustomerLookupPlugin(BasePlugin):
         age = (timezone.now() - customer.updated_at).total_seconds()
         return age < cache_ttl
     
-    def _fetch_from_api(self, basket_id, identifier, start_time):
+    async def _fetch_from_api(self, basket_id, identifier, start_time):
         """Fetch customer data from external API"""
-        api_endpoint = self.config.get('api_endpoint', 'http://localhost:8000/api/mock-customer-lookup/')
-        timeout = self.config.get('timeout_seconds', 5)
-        retry_attempts = self.config.get('retry_attempts', 2)
-        
-        api_client = CustomerAPIClient(api_endpoint, timeout, retry_attempts)
+        api_client = self._get_api_client()
         
         try:
-            customer_data = api_client.fetch_customer(identifier)
-            
-            if customer_data:
-                # Save or update customer
-                customer = self._save_customer(customer_data)
-                
-                duration_ms = int((time.time() - start_time) * 1000)
-                self._log_lookup(basket_id, identifier, 'SUCCESS', customer_data, duration_ms)
-                
-                return customer
-            else:
-                duration_ms = int((time.time() - start_time) * 1000)
-                self._log_lookup(basket_id, identifier, 'FAILED', None, duration_ms, 'Customer not found')
-                return None
-                
+            customer_data = await api_client.fetch_customer(identifier)
+            return await sync_to_async(self._store_api_result)(basket_id, identifier, start_time, customer_data)
         except Exception as e:
-            duration_ms = int((time.time() - start_time) * 1000)
-            self._log_lookup(basket_id, identifier, 'FAILED', None, duration_ms, str(e))
-            
-            # Fallback to cache on error if configured
-            if self.config.get('fallback_to_cache_on_error', True):
-                logger.info(f"[CUSTOMER LOOKUP] Falling back to cache")
-                return self._check_cache(identifier)
-            
-            return None
+            return await sync_to_async(self._api_failed)(basket_id, identifier, start_time, e)
+    
+    def _store_api_result(self, basket_id, identifier, start_time, customer_data):
+        """Save the fetched customer and log the lookup"""
+        duration_ms = int((time.time() - start_time) * 1000)
+        if customer_data:
+            # Save or update customer
+            customer = self._save_customer(customer_data)
+            self._log_lookup(basket_id, identifier, 'SUCCESS', customer_data, duration_ms)
+            return customer
+        
+        self._log_lookup(basket_id, identifier, 'FAILED', None, duration_ms, 'Customer not found')
+        return None
+    
+    def _api_failed(self, basket_id, identifier, start_time, error):
+        """Log a failed lookup and fall back to the cache if configured"""
+        duration_ms = int((time.time() - start_time) * 1000)
+        self._log_lookup(basket_id, identifier, 'FAILED', None, duration_ms, str(error))
+        
+        # Fallback to cache on error if configured
+        if self.config.get('fallback_to_cache_on_error', True):
+            logger.info(f"[CUSTOMER LOOKUP] Falling back to cache")
+            return self._check_cache(identifier)
+        
+        return None
+    
+    def _get_api_client(self):
+        """Return the long-lived pooled API client, creating it on first use"""
+        if self._api_client is None:
+            with self._api_client_lock:
+                if self._api_client is None:
+                    self._api_client = AsyncCustomerAPIClient(
+                        self.config.get('api_endpoint', 'http://localhost:8000/api/mock-customer-lookup/'),
+                        self.config.get('timeout_seconds', 5),
+                        self.config.get('retry_attempts', 2),
+                        max_concurrency=self.config.get('pool_size', settings.CUSTOMER_API_POOL_SIZE),
+                        deadline_seconds=self.config.get('deadline_seconds')
+                    )
+        return self._api_client
+    
+    def close(self):
+        """Close the API client's connection pool and threads"""
+        with self._api_client_lock:
+            api_client, self._api_client = self._api_client, None
+        if api_client is not None:
+            api_client.close()
     
     def _save_customer(self, customer_data):
         """Save or update customer in database"""
@@ -1,10 +1,12 @@
-from django.test import TestCase
-from unittest.mock import patch, Mock
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, TestCase
+from unittest.mock import patch, AsyncMock, Mock
 from decimal import Decimal
 from django.utils import timezone
 from datetime import timedelta
 
 from plugins.models import PluginConfiguration
+from plugins.customer_lookup.api_client import CustomerAPIClient
 from plugins.customer_lookup.plugin import CustomerLookupPlugin
 from customers.models import Customer, CustomerLookupLog
 from baskets.models import Basket
@@ -56,7 +58,7 @@ class CustomerLookupPluginTest(TestCase):
         self.assertIn('basket.started', supported_events)
         
         with patch.object(self.plugin, '_handle_customer_lookup') as mock_handle:
-            self.plugin.handle_event('basket.started', self.event_data)
+            async_to_sync(self.plugin.handle_event)('basket.started', self.event_data)
             mock_handle.assert_called_once_with(self.event_data)
     
     def test_plugin_ignores_events_when_disabled(self):
@@ -71,7 +73,7 @@ class CustomerLookupPluginTest(TestCase):
         plugin_names = [p.name for p in enabled_plugins]
         self.assertNotIn('customer_lookup', plugin_names)
     
-    @patch('plugins.customer_lookup.plugin.CustomerAPIClient')
+    @patch('plugins.customer_lookup.plugin.AsyncCustomerAPIClient')
     @patch('plugins.customer_lookup.plugin.event_producer')
     def test_cache_hit_skips_api_call(self, mock_producer, mock_api_client):
         """Test cache hit skips external API call"""
@@ -87,7 +89,7 @@ class CustomerLookupPluginTest(TestCase):
             tier='SILVER'
         )
         
-        self.plugin.handle_event('basket.started', self.event_data)
+        async_to_sync(self.plugin.handle_event)('basket.started', self.event_data)
         
         # API client should not be called
         mock_api_client.assert_not_called()
@@ -100,7 +102,7 @@ class CustomerLookupPluginTest(TestCase):
         log = CustomerLookupLog.objects.get(basket_id='BASKET-123')
         self.assertEqual(log.status, 'SUCCESS')
     
-    @patch('plugins.customer_lookup.plugin.CustomerAPIClient')
+    @patch('plugins.customer_lookup.plugin.AsyncCustomerAPIClient')
     @patch('plugins.customer_lookup.plugin.event_producer')
     def test_api_call_creates_customer(self, mock_producer, mock_api_client):
         """Test API call creates new customer"""
@@ -119,10 +121,10 @@ class CustomerLookupPluginTest(TestCase):
         }
         
         mock_client_instance = Mock()
-        mock_client_instance.fetch_customer.return_value = api_data
+        mock_client_instance.fetch_customer = AsyncMock(return_value=api_data)
         mock_api_client.return_value = mock_client_instance
         
-        self.plugin.handle_event('basket.started', self.event_data)
+        async_to_sync(self.plugin.handle_event)('basket.started', self.event_data)
         
         # Customer should be created
         customer = Customer.objects.get(customer_id='CUST-002')
@@ -138,7 +140,7 @@ class CustomerLookupPluginTest(TestCase):
         # Event should be published
         mock_producer.publish.assert_called_once()
     
-    @patch('plugins.customer_lookup.plugin.CustomerAPIClient')
+    @patch('plugins.customer_lookup.plugin.AsyncCustomerAPIClient')
     @patch('plugins.customer_lookup.plugin.event_producer')
     def test_api_failure_with_cache_fallback(self, mock_producer, mock_api_client):
         """Test API failure falls back to cache when configured"""
@@ -155,10 +157,10 @@ class CustomerLookupPluginTest(TestCase):
         
         # Mock API failure
         mock_client_instance = Mock()
-        mock_client_instance.fetch_customer.side_effect = Exception('API Error')
+        mock_client_instance.fetch_customer = AsyncMock(side_effect=Exception('API Error'))
         mock_api_client.return_value = mock_client_instance
         
-        self.plugin.handle_event('basket.started', self.event_data)
+        async_to_sync(self.plugin.handle_event)('basket.started', self.event_data)
         
         # Should fall back to cached customer
         self.basket.refresh_from_db()
@@ -169,7 +171,7 @@ class CustomerLookupPluginTest(TestCase):
         self.assertTrue(logs.exists())
         # The plugin logs the API failure but then uses cache, so overall it's a success
     
-    @patch('plugins.customer_lookup.plugin.CustomerAPIClient')
+    @patch('plugins.customer_lookup.plugin.AsyncCustomerAPIClient')
     @patch('plugins.customer_lookup.plugin.event_producer')
     def test_complete_lookup_workflow(self, mock_producer, mock_api_client):
         """Test complete customer lookup workflow"""
@@ -187,7 +189,7 @@ class CustomerLookupPluginTest(TestCase):
         }
         
         mock_client_instance = Mock()
-        mock_client_instance.fetch_customer.return_value = api_data
+        mock_client_instance.fetch_customer = AsyncMock(return_value=api_data)
         mock_api_client.return_value = mock_client_instance
         
         event_data = {
@@ -196,7 +198,7 @@ class CustomerLookupPluginTest(TestCase):
         }
         
         with patch('plugins.customer_lookup.plugin.event_producer') as mock_producer:
-            self.plugin.handle_event('basket.started', event_data)
+            async_to_sync(self.plugin.handle_event)('basket.started', event_data)
         
         # Verify customer created
         customer = Customer.objects.get(customer_id='CUST-004')
@@ -221,4 +223,39 @@ class CustomerLookupPluginTest(TestCase):
         mock_producer.publish.assert_called_once()
         published_data = mock_producer.publish.call_args[0][1]
         self.assertEqual(published_data['event_type'], 'CUSTOMER_DATA_FETCHED')
-        self.assertEqual(published_data['customer_id'], 'CUST-004')
\ No newline at end of file
+        self.assertEqual(published_data['customer_id'], 'CUST-004')
+
+
+class CustomerAPIClientTest(SimpleTestCase):
+    
+    def setUp(self):
+        self.client = CustomerAPIClient('http://customers.test/lookup/', timeout=1, retry_attempts=3)
+        self.client.session = Mock()
+    
+    @patch('plugins.customer_lookup.api_client.time.sleep')
+    def test_server_errors_are_retried_with_backoff(self, mock_sleep):
+        """Test a 503 is retried on the pooled session after a jittered delay"""
+        self.client.session.get.side_effect = [
+            Mock(status_code=503, text='busy'),
+            Mock(status_code=200, json=Mock(return_value={'customer_id': 'CUST-001'}))
+        ]
+        
+        self.assertEqual(self.client.fetch_customer('+1234567890'), {'customer_id': 'CUST-001'})
+        self.assertEqual(self.client.session.get.call_count, 2)
+        self.client.session.get.assert_called_with('http://customers.test/lookup/+1234567890/', timeout=1)
+        mock_sleep.assert_called_once()
+        self.assertLessEqual(mock_sleep.call_args[0][0], self.client.backoff_base)
+    
+    def test_not_found_is_not_retried(self):
+        """Test a 404 returns None without further attempts"""
+        self.client.session.get.return_value = Mock(status_code=404)
+        
+        self.assertIsNone(self.client.fetch_customer('unknown'))
+        self.assertEqual(self.client.session.get.call_count, 1)
+    
+    def test_deadline_bounds_all_attempts(self):
+        """Test no attempt starts once the overall deadline has passed"""
+        self.client.deadline_seconds = 0
+        
+        self.assertIsNone(self.client.fetch_customer('+1234567890'))
+        self.client.session.get.assert_not_called()
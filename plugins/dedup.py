@@ -0,0 +1,114 @@
+from collections import OrderedDict
+from django.conf import settings
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Extra fields that distinguish otherwise identical events of a type
+EVENT_KEY_FIELDS = {
+    'age.verified': ('customer_age', 'verifier_employee_id'),
+    'item.added': ('product_id', 'quantity'),
+}
+
+
+def event_key(event_type, event_data):
+    """Fixed-size (16 byte) deduplication key for an event"""
+    parts = [
+        event_type,
+        event_data.get('timestamp'),
+        event_data.get('basket_id'),
+        event_data.get('employee_id'),
+        event_data.get('terminal_id'),
+    ]
+    for field in EVENT_KEY_FIELDS.get(event_type, ()):
+        parts.append(event_data.get(field))
+    raw = '\x1f'.join('' if part is None else str(part) for part in parts)
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).digest()
+
+
+class InMemoryDedupStore:
+    """Per-process dedup store with a sliding TTL and a memory cap.
+
+    Every key gets the same TTL, so insertion order is expiry order: expired
+    keys are popped from the front of an OrderedDict a few at a time on
+    each check instead of clearing everything at once.
+    """
+    blocking = False  # seen() and mark() never wait on I/O
+
+    def __init__(self, ttl_seconds=300, max_entries=100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> expiry (monotonic seconds)
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        entries = self._entries
+        while entries:
+            oldest_key, expires_at = next(iter(entries.items()))
+            if expires_at > now:
+                break
+            entries.popitem(last=False)
+
+    def seen(self, key):
+        """Return True if ``key`` was marked and has not expired"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            return key in self._entries
+
+    def mark(self, key):
+        """Record ``key`` as handled for the next ttl_seconds"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entries = self._entries
+            entries.pop(key, None)
+            entries[key] = now + self.ttl_seconds
+            if len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisDedupStore:
+    """Dedup store shared by several consumer processes through Redis.
+
+    ``seen`` is an ``EXISTS`` and ``mark`` a ``SET key 1 EX ttl``, each one
+    round-trip, with expiry handled by the server.
+    """
+    blocking = True  # seen() and mark() are network round-trips
+
+    def __init__(self, url, ttl_seconds=300, prefix='pos:dedup:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix.encode('utf-8')
+
+    def seen(self, key):
+        return bool(self.client.exists(self.prefix + key))
+
+    def mark(self, key):
+        self.client.set(self.prefix + key, 1, ex=self.ttl_seconds)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + b'*'):
+            self.client.delete(key)
+
+
+def get_dedup_store():
+    """Build the dedup store selected by PLUGIN_DEDUP_BACKEND"""
+    ttl = settings.PLUGIN_DEDUP_TTL_SECONDS
+    if settings.PLUGIN_DEDUP_BACKEND == 'redis':
+        try:
+            return RedisDedupStore(settings.PLUGIN_DEDUP_REDIS_URL, ttl_seconds=ttl)
+        except ImportError:
+            logger.warning("redis package not installed, falling back to in-memory dedup")
+    return InMemoryDedupStore(ttl_seconds=ttl, max_entries=settings.PLUGIN_DEDUP_MAX_ENTRIES)
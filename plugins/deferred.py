@@ -0,0 +1,85 @@
+from collections import OrderedDict, deque
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class DeferredEvents:
+    """Events shed while a plugin's circuit was open, queued per key.
+
+    Events of one key (basket, or partition key) are replayed in arrival
+    order and by one thread at a time: ``claim`` hands the key's queue to
+    the caller and makes other callers for that key wait until
+    ``release``. At most ``max_events`` are held; beyond that the oldest
+    event is dropped and counted in ``dropped``.
+    """
+
+    def __init__(self, plugin_name, max_events=1000):
+        self.plugin_name = plugin_name
+        self.max_events = max_events
+        self.dropped = 0
+        self._queues = OrderedDict()  # key -> deque of (event_type, event_data), oldest key first
+        self._count = 0
+        self._claimed = set()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return self._count
+
+    def idle(self):
+        """True if nothing is queued or being replayed"""
+        with self._cond:
+            return not self._count and not self._claimed
+
+    def keys(self):
+        with self._cond:
+            return list(self._queues)
+
+    def add(self, key, event_type, event_data):
+        with self._cond:
+            self._queues.setdefault(key, deque()).append((event_type, event_data))
+            self._count += 1
+            if self._count > self.max_events:
+                self._drop_oldest()
+
+    def _drop_oldest(self):
+        key, queue = next(iter(self._queues.items()))
+        event_type, _ = queue.popleft()
+        if not queue:
+            del self._queues[key]
+        self._count -= 1
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 100 == 0:
+            logger.error(
+                f"Deferred queue of plugin {self.plugin_name} is full, dropped {event_type} "
+                f"for {key} ({self.dropped} dropped so far)"
+            )
+
+    def claim(self, key):
+        """Take the queued events of ``key``, waiting while another thread replays it.
+
+        Returns None if nothing is queued for the key; otherwise the caller
+        must hand the events it did not handle back with ``release``.
+        """
+        with self._cond:
+            while key in self._claimed:
+                self._cond.wait()
+            events = self._queues.pop(key, None)
+            if events is None:
+                return None
+            self._count -= len(events)
+            self._claimed.add(key)
+            return events
+
+    def release(self, key, remaining=()):
+        """Give up a claimed key, re-queueing ``remaining`` ahead of events added meanwhile"""
+        with self._cond:
+            if remaining:
+                queue = deque(remaining)
+                queue.extend(self._queues.pop(key, ()))
+                self._queues[key] = queue
+                self._queues.move_to_end(key, last=False)
+                self._count += len(remaining)
+            self._claimed.discard(key)
+            self._cond.notify_all()
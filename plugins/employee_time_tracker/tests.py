@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
 from decimal import Decimal
-from django.test import TestCase
+from django.test import TransactionTestCase
 from django.utils import timezone
 from freezegun import freeze_time
 
@@ -11,8 +11,12 @@ from plugins.employee_time_tracker.plugin import EmployeeTimeTrackerPlugin
 from plugins.employee_time_tracker.models import TimeEntry
 
 
-class EmployeeTimeTrackerPluginTest(TestCase):
-    """Test Employee Time Tracker plugin functionality"""
+class EmployeeTimeTrackerPluginTest(TransactionTestCase):
+    """Test Employee Time Tracker plugin functionality
+
+    Events routed through the registry are handled on the plugin executor,
+    so test data must be committed for its threads to see it.
+    """
     
     def setUp(self):
         """Set up test data"""
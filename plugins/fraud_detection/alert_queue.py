@@ -0,0 +1,77 @@
+from collections import namedtuple
+from django.db import connections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PendingAlert = namedtuple('PendingAlert', ['rule', 'details', 'employee_id', 'terminal_id', 'basket_id'])
+
+
+class AlertQueue:
+    """Fraud alerts waiting to be persisted and fanned out in one batch.
+    
+    Alerts are drained in the order they were raised, and flushes are
+    serialised by ``flush_lock``, so each terminal sees its alerts in order.
+    """
+    
+    def __init__(self):
+        self._pending = []
+        self._oldest = None  # monotonic time the oldest pending alert was queued
+        self._lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self._timer = None
+    
+    def add(self, alert):
+        with self._lock:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append(alert)
+    
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._oldest = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            return pending
+    
+    def requeue(self, alerts):
+        """Put drained alerts back in front of any queued since, e.g. after a failed write"""
+        with self._lock:
+            self._pending[:0] = alerts
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+    
+    def is_due(self, batch_size, max_delay):
+        """True when the batch is full or the oldest alert has waited max_delay seconds"""
+        with self._lock:
+            if not self._pending:
+                return False
+            return len(self._pending) >= batch_size or time.monotonic() - self._oldest >= max_delay
+    
+    def schedule(self, delay, flush):
+        """Make sure ``flush`` runs within ``delay`` seconds even if no further event arrives"""
+        with self._lock:
+            if self._timer is not None and self._timer.is_alive():
+                return
+            self._timer = threading.Timer(delay, self._run_timer, args=(flush,))
+            self._timer.daemon = True
+            self._timer.start()
+    
+    def _run_timer(self, flush):
+        try:
+            flush()
+        except Exception as e:
+            logger.error(f"Scheduled fraud alert flush failed: {e}")
+        finally:
+            connections.close_all()
+    
+    def __len__(self):
+        return len(self._pending)
+
+
+# Global alert queue instance
+alert_queue = AlertQueue()
@@ -9,4 +9,5 @@ class FraudDetectionConfig(AppConfig):
     def ready(self):
         from plugins.registry import plugin_registry
         from .plugin import FraudDetectionPlugin
-        plugin_registry.register(FraudDetectionPlugin)
\ No newline at end of file
+        plugin_registry.register(FraudDetectionPlugin)
+        from . import signals
\ No newline at end of file
@@ -0,0 +1,119 @@
+from .plugin import FraudDetectionPlugin
+from .rule_index import rule_event_types
+from .state_manager import InMemoryStateBackend, StateManager
+from collections import Counter, defaultdict
+from datetime import datetime
+import gzip
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SimulatedClock:
+    """Clock driven by the timestamps of the replayed events"""
+
+    def __init__(self):
+        self.current = None
+
+    def advance(self, moment):
+        # Never go backwards: late events are evaluated at the latest time seen
+        if self.current is None or moment > self.current:
+            self.current = moment
+
+    def __call__(self):
+        return self.current or datetime.now()
+
+
+class StaticRuleIndex:
+    """Fixed rule set indexed like FraudRuleIndex, without the database"""
+
+    def __init__(self, rules):
+        self._by_event_type = defaultdict(list)
+        for rule in rules:
+            if rule.enabled:
+                for event_type in rule_event_types(rule):
+                    self._by_event_type[event_type].append(rule)
+
+    def rules_for(self, event_type):
+        return self._by_event_type.get(event_type, ())
+
+    def invalidate(self):
+        pass
+
+
+class BacktestFraudDetection(FraudDetectionPlugin):
+    """FraudDetectionPlugin with private state, a fixed rule set and recorded alerts.
+
+    The rule checks are the production ones; only alert creation is replaced,
+    so nothing is written to the database, Kafka or WebSockets.
+    """
+
+    def __init__(self, rules, clock):
+        super().__init__()
+        self.state = StateManager(backend=InMemoryStateBackend(), clock=clock)
+        self.rules = StaticRuleIndex(rules)
+        self.alerts = Counter()  # (rule_id, employee_id, terminal_id) -> count
+
+    def _create_alert(self, rule, violation_details, employee_id, terminal_id, basket_id):
+        if not terminal_id and basket_id:
+            basket_state = self.state.get_basket_state(basket_id)
+            if basket_state:
+                terminal_id = basket_state.get('terminal_id')
+        self.alerts[(rule.rule_id, employee_id, terminal_id)] += 1
+
+
+def parse_timestamp(value):
+    """Event timestamp as a naive local datetime, or None"""
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+def read_event_log(path):
+    """Stream events from a JSONL file (optionally .gz); malformed lines are skipped"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping malformed event on line {line_number}")
+                continue
+            # Tolerate exports that wrap the message value
+            if isinstance(event, dict) and isinstance(event.get('value'), dict):
+                event = event['value']
+            if isinstance(event, dict):
+                yield event
+
+
+def run_backtest(events, scenarios):
+    """Stream events once through one engine per scenario.
+
+    ``scenarios`` maps a name to a list of rules. Returns (events processed,
+    {name: Counter of (rule_id, employee_id, terminal_id) -> alerts}).
+    """
+    clock = SimulatedClock()
+    engines = {name: BacktestFraudDetection(rules, clock) for name, rules in scenarios.items()}
+    supported = set(FraudDetectionPlugin().get_supported_events())
+    processed = 0
+    for event in events:
+        event_type = event.get('event_type')
+        if event_type not in supported:
+            continue
+        moment = parse_timestamp(event.get('timestamp'))
+        if moment is not None:
+            clock.advance(moment)
+        for engine in engines.values():
+            engine.handle_event(event_type, event)
+        processed += 1
+    return processed, {name: engine.alerts for name, engine in engines.items()}
@@ -0,0 +1,77 @@
+import math
+
+# Per-basket behaviour tracked for each employee and terminal
+BASELINE_METRICS = ('items_per_minute', 'basket_value', 'checkout_seconds')
+BASELINE_SCOPES = ('employee', 'terminal')
+
+# Metric each rule compares in baseline mode, and which direction is suspicious
+BASELINE_RULE_METRICS = {
+    'rapid_items': ('items_per_minute', 'high'),
+    'high_value_payment': ('basket_value', 'high'),
+    'anonymous_payment': ('basket_value', 'high'),
+    'rapid_checkout': ('checkout_seconds', 'low'),
+}
+
+# Payment events: the POS emits 'payment.completed' with 'total_amount',
+# older producers 'PAYMENT_COMPLETED' with 'amount'
+PAYMENT_EVENT_TYPES = ('PAYMENT_COMPLETED', 'payment.completed')
+
+# Baseline rules are evaluated when a basket is paid, once its metrics are known
+BASELINE_EVENT_TYPES = PAYMENT_EVENT_TYPES
+
+# Lower bound on the standard deviation, relative to the mean, so a perfectly
+# regular history does not turn every small deviation into a huge z-score
+MIN_RELATIVE_STD = 0.05
+
+
+def is_baseline_rule(rule):
+    """True if the rule alerts on deviation from a baseline instead of a fixed threshold"""
+    return (rule.config or {}).get('mode') == 'baseline' and rule.rule_id in BASELINE_RULE_METRICS
+
+
+def new_baseline(now):
+    """Empty baseline record: [samples, EWMA, EW variance] per metric"""
+    record = {'updated_at': now}
+    for metric in BASELINE_METRICS:
+        record[metric] = [0, 0.0, 0.0]
+    return record
+
+
+def update_stat(stat, value, alpha):
+    """Fold one observation into [samples, mean, variance] in O(1).
+
+    Until 1/alpha samples are seen the weight is 1/n, i.e. a plain running
+    mean, so the first observations do not dominate the baseline.
+    """
+    samples, mean, variance = stat
+    weight = max(alpha, 1.0 / (samples + 1))
+    diff = value - mean
+    increment = weight * diff
+    return [samples + 1, mean + increment, (1 - weight) * (variance + diff * increment)]
+
+
+def z_score(stat, value):
+    """Standard score of value against [samples, mean, variance]; None without history"""
+    samples, mean, variance = stat
+    if not samples:
+        return None
+    std = max(math.sqrt(variance), MIN_RELATIVE_STD * abs(mean), 1e-9)
+    return (value - mean) / std
+
+
+def payment_amount(event_data):
+    """Amount paid, from either payment event shape"""
+    amount = event_data.get('total_amount')
+    if amount is None:
+        amount = event_data.get('amount', 0)
+    return amount
+
+
+def basket_observations(basket, amount, now):
+    """Metrics of a paid basket; durations under a second count as one second"""
+    checkout_seconds = max((now - basket['start_time']).total_seconds(), 1.0)
+    return {
+        'items_per_minute': basket['item_count'] * 60.0 / checkout_seconds,
+        'basket_value': float(amount),
+        'checkout_seconds': checkout_seconds,
+    }
@@ -36,6 +36,11 @@ class FraudAlertConsumer(AsyncWebsocketConsumer):
             'timestamp': event['timestamp']
         }))
 
+    async def fraud_alert_batch(self, event):
+        # Alerts flushed together arrive as one message; deliver them in order
+        for alert in event['alerts']:
+            await self.fraud_alert(alert)
+
     @database_sync_to_async
     def acknowledge_alert(self, alert_id):
         try:
@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand, CommandError
+from plugins.fraud_detection.backtest import read_event_log, run_backtest
+from plugins.fraud_detection.models import FraudRule
+from collections import Counter
+import copy
+import json
+import time
+
+OVERRIDABLE_FIELDS = {'threshold': int, 'time_window': int, 'enabled': lambda v: v.lower() in ('1', 'true', 'yes')}
+
+
+class Command(BaseCommand):
+    help = 'Replay a recorded event log through the fraud rules and compare alert counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_log', help='JSONL export of the pos-events topic (.gz supported)')
+        parser.add_argument('--set', action='append', default=[], dest='overrides', metavar='RULE.FIELD=VALUE',
+                            help='Candidate setting, e.g. rapid_items.threshold=8 (repeatable)')
+        parser.add_argument('--top', type=int, default=5,
+                            help='Employees and terminals to list per rule')
+        parser.add_argument('--json', action='store_true', help='Print raw JSON')
+
+    def handle(self, *args, **options):
+        current = list(FraudRule.objects.all())
+        candidate = self._apply_overrides(current, options['overrides'])
+        scenarios = {'current': current}
+        if candidate is not None:
+            scenarios['candidate'] = candidate
+
+        started = time.monotonic()
+        processed, alerts = run_backtest(read_event_log(options['event_log']), scenarios)
+        elapsed = time.monotonic() - started
+
+        report = {
+            'events': processed,
+            'seconds': round(elapsed, 2),
+            'rules': {
+                rule.rule_id: {name: self._summarize(alerts[name], rule.rule_id, options['top']) for name in scenarios}
+                for rule in current
+            }
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2, default=str))
+            return
+
+        rate = processed / elapsed if elapsed else processed
+        self.stdout.write(self.style.SUCCESS(f'Replayed {processed} events in {elapsed:.1f}s ({rate:,.0f} events/s)'))
+        for rule_id, results in report['rules'].items():
+            line = f"\n{rule_id}: current={results['current']['alerts']}"
+            if 'candidate' in results:
+                delta = results['candidate']['alerts'] - results['current']['alerts']
+                line += f" candidate={results['candidate']['alerts']} ({delta:+d})"
+            self.stdout.write(line)
+            for name, summary in results.items():
+                if summary['alerts']:
+                    self.stdout.write(f"  [{name}] top employees: {self._format_top(summary['employees'])}")
+                    self.stdout.write(f"  [{name}] top terminals: {self._format_top(summary['terminals'])}")
+
+    def _apply_overrides(self, rules, overrides):
+        """Copy the rules with RULE.FIELD=VALUE overrides applied; None if there are none"""
+        if not overrides:
+            return None
+        by_id = {rule.rule_id: copy.copy(rule) for rule in rules}
+        for override in overrides:
+            try:
+                target, value = override.split('=', 1)
+                rule_id, field = target.rsplit('.', 1)
+            except ValueError:
+                raise CommandError(f'Invalid --set {override!r}, expected RULE.FIELD=VALUE')
+            if rule_id not in by_id:
+                raise CommandError(f'Unknown fraud rule {rule_id!r}')
+            if field not in OVERRIDABLE_FIELDS:
+                raise CommandError(f'Cannot override {field!r}; choose from {", ".join(OVERRIDABLE_FIELDS)}')
+            try:
+                setattr(by_id[rule_id], field, OVERRIDABLE_FIELDS[field](value))
+            except ValueError:
+                raise CommandError(f'Invalid value for {target}: {value!r}')
+        return list(by_id.values())
+
+    def _summarize(self, alerts, rule_id, top):
+        employees = Counter()
+        terminals = Counter()
+        for (alert_rule_id, employee_id, terminal_id), count in alerts.items():
+            if alert_rule_id == rule_id:
+                employees[employee_id] += count
+                terminals[terminal_id] += count
+        return {
+            'alerts': sum(employees.values()),
+            'employees': employees.most_common(top),
+            'terminals': terminals.most_common(top),
+        }
+
+    def _format_top(self, pairs):
+        return ', '.join(f'{key} ({count})' for key, count in pairs)
@@ -1,12 +1,16 @@
 from plugins.base import BasePlugin
-from .models import FraudRule, FraudAlert
+from .alert_queue import PendingAlert, alert_queue
+from .baselines import BASELINE_RULE_METRICS, is_baseline_rule
+from .models import FraudAlert
+from .rule_index import rule_index
 from .state_manager import state_manager
 from events.producer import event_producer
 from employees.models import Employee
 from django.conf import settings
-from datetime import datetime, timedelta
+from datetime import datetime
+from collections import defaultdict
+import asyncio
 import logging
-import uuid
 
 logger = logging.getLogger(__name__)
 
@@ -15,11 +19,15 @@ class FraudDetectionPlugin(BasePlugin):
     name = "fraud_detection"
     description = "Detects fraudulent activities in POS transactions"
     
+    # Shared state and rule index; the backtest engine substitutes its own
+    state = state_manager
+    rules = rule_index
+    
     def get_supported_events(self):
         return [
             "EMPLOYEE_LOGIN", "EMPLOYEE_LOGOUT", "SESSION_TERMINATED",
             "BASKET_STARTED", "item.added", "CUSTOMER_IDENTIFIED", 
-            "PAYMENT_COMPLETED"
+            "PAYMENT_COMPLETED", "payment.completed"
         ]
     
     def handle_event(self, event_type, event_data):
@@ -35,51 +43,38 @@ class FraudDetectionPlugin(BasePlugin):
             # Evaluate fraud rules
             self._evaluate_rules(event_type, event_data, employee_id, terminal_id, basket_id)
             
+            # Persist and publish the alerts raised so far, if the batch is due;
+            # the consumer also flushes before committing offsets
+            self._flush_alerts_if_due()
+            
         except Exception as e:
             logger.error(f"Fraud detection error: {e}")
     
     def _update_state(self, event_type, event_data, employee_id, terminal_id, basket_id):
         """Update internal state based on event"""
-        if employee_id:
-            state_manager.update_employee_session(employee_id, terminal_id, event_type, event_data)
-        
-        if terminal_id:
-            state_manager.update_terminal_state(terminal_id, employee_id, event_type)
-        
-        if basket_id:
-            state_manager.update_basket_state(basket_id, employee_id, terminal_id, event_type, event_data)
+        self.state.apply_event(event_type, event_data, employee_id, terminal_id, basket_id)
     
     def _evaluate_rules(self, event_type, event_data, employee_id, terminal_id, basket_id):
-        """Evaluate all enabled fraud rules"""
-        rules = FraudRule.objects.filter(enabled=True)
-        
-        for rule in rules:
+        """Evaluate the enabled fraud rules indexed under this event type"""
+        for rule in self.rules.rules_for(event_type):
             try:
-                if self._should_evaluate_rule(rule, event_type):
-                    violation = self._check_rule_violation(rule, event_data, employee_id, terminal_id, basket_id)
-                    if violation:
-                        self._create_alert(rule, violation, employee_id, terminal_id, basket_id)
+                violation = self._check_rule_violation(
+                    rule, event_data, employee_id, terminal_id, basket_id, event_type=event_type
+                )
+                if violation:
+                    self._create_alert(rule, violation, employee_id, terminal_id, basket_id)
             except Exception as e:
                 logger.error(f"Rule evaluation error for {rule.rule_id}: {e}")
     
-    def _should_evaluate_rule(self, rule, event_type):
-        """Check if rule should be evaluated for this event type"""
-        rule_event_mapping = {
-            'multiple_terminals': ['EMPLOYEE_LOGIN'],
-            'rapid_items': ['BASKET_STARTED', 'item.added'],  # Need BASKET_STARTED to initialize state
-            'high_value_payment': ['PAYMENT_COMPLETED'],
-            'anonymous_payment': ['PAYMENT_COMPLETED'],
-            'rapid_checkout': ['PAYMENT_COMPLETED']
-        }
-        return event_type in rule_event_mapping.get(rule.rule_id, [])
-    
-    def _check_rule_violation(self, rule, event_data, employee_id, terminal_id, basket_id):
+    def _check_rule_violation(self, rule, event_data, employee_id, terminal_id, basket_id, event_type=None):
         """Check if specific rule is violated"""
-        if rule.rule_id == 'multiple_terminals':
+        if is_baseline_rule(rule):
+            return self._check_baseline(rule, basket_id)
+        elif rule.rule_id == 'multiple_terminals':
             return self._check_multiple_terminals(rule, employee_id)
         elif rule.rule_id == 'rapid_items':
             # For BASKET_STARTED events, just initialize state (no violation yet)
-            event_type = event_data.get('event_type')
+            event_type = event_type or event_data.get('event_type')
             if event_type == 'BASKET_STARTED':
                 return None  # Just initializing, no violation
             return self._check_rapid_items(rule, basket_id)
@@ -94,7 +89,7 @@ class FraudDetectionPlugin(BasePlugin):
     
     def _check_multiple_terminals(self, rule, employee_id):
         """Check if employee is using multiple terminals"""
-        session = state_manager.get_employee_session(employee_id)
+        session = self.state.get_employee_session(employee_id)
         if session and len(session['terminal_ids']) >= rule.threshold:
             return {
                 'rule_name': rule.name,
@@ -106,32 +101,25 @@ class FraudDetectionPlugin(BasePlugin):
     
     def _check_rapid_items(self, rule, basket_id):
         """Check if items are being added too rapidly"""
-        basket = state_manager.get_basket_state(basket_id)
-        if not basket:
-            return None
-        
-        now = datetime.now()
-        recent_items = [
-            ts for ts in basket['item_velocity']
-            if now - ts <= timedelta(seconds=rule.time_window)
-        ]
+        # Hits are recorded by apply_event, only for baskets with state
+        recent_items = self.state.get_rate('basket', basket_id, rule.time_window)
         
-        if len(recent_items) >= rule.threshold:
+        if recent_items >= rule.threshold:
             return {
                 'rule_name': rule.name,
                 'threshold': rule.threshold,
-                'actual_value': len(recent_items),
+                'actual_value': recent_items,
                 'time_window': rule.time_window
             }
         return None
     
     def _check_high_value_payment(self, rule, event_data, employee_id):
         """Check if payment amount is unusually high for short session"""
-        session = state_manager.get_employee_session(employee_id)
+        session = self.state.get_employee_session(employee_id)
         if not session:
             return None
         
-        session_duration = (datetime.now() - session['login_time']).total_seconds()
+        session_duration = (self.state.now() - session['login_time']).total_seconds()
         payment_amount = event_data.get('amount', 0)
         
         if session_duration <= rule.time_window and payment_amount >= rule.threshold:
@@ -145,7 +133,7 @@ class FraudDetectionPlugin(BasePlugin):
     
     def _check_anonymous_payment(self, rule, event_data, basket_id):
         """Check if high-value payment completed without customer identification"""
-        basket = state_manager.get_basket_state(basket_id)
+        basket = self.state.get_basket_state(basket_id)
         if not basket:
             return None
         
@@ -162,11 +150,11 @@ class FraudDetectionPlugin(BasePlugin):
     
     def _check_rapid_checkout(self, rule, basket_id):
         """Check if basket was started and completed too quickly"""
-        basket = state_manager.get_basket_state(basket_id)
+        basket = self.state.get_basket_state(basket_id)
         if not basket:
             return None
         
-        checkout_duration = (datetime.now() - basket['start_time']).total_seconds()
+        checkout_duration = (self.state.now() - basket['start_time']).total_seconds()
         
         if checkout_duration <= rule.time_window:
             return {
@@ -177,81 +165,156 @@ class FraudDetectionPlugin(BasePlugin):
             }
         return None
     
+    def _check_baseline(self, rule, basket_id):
+        """Check if a paid basket deviates from the employee's (or terminal's) own baseline"""
+        basket = self.state.get_basket_state(basket_id)
+        if not basket or 'baseline_scores' not in basket:
+            return None
+        
+        metric, direction = BASELINE_RULE_METRICS[rule.rule_id]
+        scope = rule.config.get('scope', 'employee')
+        score = basket['baseline_scores'].get(scope, {}).get(metric)
+        min_samples = rule.config.get('min_samples', settings.FRAUD_BASELINE_MIN_SAMPLES)
+        z_threshold = rule.config.get('z_threshold', settings.FRAUD_BASELINE_Z_THRESHOLD)
+        if not score or score['z'] is None or score['samples'] < min_samples:
+            return None
+        
+        deviation = score['z'] if direction == 'high' else -score['z']
+        if deviation < z_threshold:
+            return None
+        if rule.rule_id == 'anonymous_payment' and basket['customer_identified']:
+            return None
+        
+        return {
+            'rule_name': rule.name,
+            'mode': 'baseline',
+            'scope': scope,
+            'metric': metric,
+            'actual_value': round(basket['observations'][metric], 2),
+            'baseline_mean': round(score['mean'], 2),
+            'z_score': round(score['z'], 2),
+            'z_threshold': z_threshold,
+            'samples': score['samples']
+        }
+    
     def _create_alert(self, rule, violation_details, employee_id, terminal_id, basket_id):
-        """Create and publish fraud alert"""
-        try:
-            employee = Employee.objects.get(id=employee_id)
-            
-            # Get terminal_id from basket state if not provided
-            if not terminal_id and basket_id:
-                basket_state = state_manager.get_basket_state(basket_id)
-                if basket_state:
-                    terminal_id = basket_state.get('terminal_id')
-            
-            # Create alert record
-            alert = FraudAlert.objects.create(
-                rule=rule,
+        """Queue a fraud alert; it is persisted and published by the next flush"""
+        # Get terminal_id from basket state if not provided
+        if not terminal_id and basket_id:
+            basket_state = self.state.get_basket_state(basket_id)
+            if basket_state:
+                terminal_id = basket_state.get('terminal_id')
+        
+        alert_queue.add(PendingAlert(rule, violation_details, employee_id, terminal_id, basket_id))
+    
+    def flush(self):
+        """Persist and publish every queued alert.
+        
+        Called by the consumer before it commits offsets; raises if the
+        alerts could not be written, so the commit is held back and they
+        stay queued.
+        """
+        self._flush_alerts()
+    
+    def _flush_alerts_if_due(self):
+        if alert_queue.is_due(settings.FRAUD_ALERT_BATCH_SIZE, settings.FRAUD_ALERT_FLUSH_SECONDS):
+            self._flush_alerts()
+        elif len(alert_queue):
+            alert_queue.schedule(settings.FRAUD_ALERT_FLUSH_SECONDS, self._flush_alerts)
+    
+    def _flush_alerts(self):
+        """Create the queued alerts with one bulk insert, one grouped WebSocket send and batched publishing"""
+        with alert_queue.flush_lock:
+            pending = alert_queue.drain()
+            if not pending:
+                return
+            try:
+                created = self._persist(pending)
+            except Exception as e:
+                alert_queue.requeue(pending)
+                logger.error(f"Failed to create {len(pending)} fraud alerts, keeping them queued: {e}")
+                raise
+            try:
+                self._publish(created)
+            except Exception as e:
+                # The alerts are stored; only the real-time fan-out is lost
+                logger.error(f"Failed to push {len(created)} fraud alerts: {e}")
+    
+    def _persist(self, pending):
+        """Insert the alerts in one query; returns the (pending, alert) pairs created"""
+        employees = {
+            str(pk): employee
+            for pk, employee in Employee.objects.in_bulk({p.employee_id for p in pending}).items()
+        }
+        
+        # Create alert records
+        created = []
+        for p in pending:
+            employee = employees.get(str(p.employee_id))
+            if employee is None:
+                logger.error(f"Failed to create fraud alert: employee {p.employee_id} not found")
+                continue
+            alert = FraudAlert(
+                rule=p.rule,
                 employee=employee,
-                terminal_id=terminal_id,
-                basket_id=basket_id,
-                severity=rule.severity,
-                details=violation_details
+                terminal_id=p.terminal_id,
+                basket_id=p.basket_id,
+                severity=p.rule.severity,
+                details=p.details
             )
-            
-            # Send real-time alert to WebSocket
+            created.append((p, alert))
+        FraudAlert.objects.bulk_create([alert for _, alert in created])
+        return created
+    
+    def _publish(self, created):
+        """Push the created alerts to terminals and publish them as events"""
+        # Group real-time alerts per terminal, keeping the order they were raised in
+        messages = defaultdict(list)
+        for p, alert in created:
+            payload = {
+                'alert_id': str(alert.alert_id),
+                'rule_id': p.rule.rule_id,
+                'severity': p.rule.severity,
+                'details': p.details,
+                'timestamp': alert.timestamp.isoformat()
+            }
+            # For multiple terminals fraud, send alert to all affected terminals
+            if p.rule.rule_id == 'multiple_terminals' and 'terminals' in p.details:
+                for affected_terminal_id in p.details['terminals']:
+                    messages[f'fraud_alerts_{affected_terminal_id}'].append(payload)
+            elif p.terminal_id:
+                messages[f'fraud_alerts_{p.terminal_id}'].append(payload)
+        
+        if messages:
             from channels.layers import get_channel_layer
             from asgiref.sync import async_to_sync
             
-            channel_layer = get_channel_layer()
-            
-            # For multiple terminals fraud, send alert to all affected terminals
-            if rule.rule_id == 'multiple_terminals' and 'terminals' in violation_details:
-                for affected_terminal_id in violation_details['terminals']:
-                    async_to_sync(channel_layer.group_send)(
-                        f'fraud_alerts_{affected_terminal_id}',
-                        {
-                            'type': 'fraud_alert',
-                            'alert_id': str(alert.alert_id),
-                            'rule_id': rule.rule_id,
-                            'severity': rule.severity,
-                            'details': violation_details,
-                            'timestamp': alert.timestamp.isoformat()
-                        }
-                    )
-            else:
-                # Send to current terminal
-                if terminal_id:
-                    async_to_sync(channel_layer.group_send)(
-                        f'fraud_alerts_{terminal_id}',
-                        {
-                            'type': 'fraud_alert',
-                            'alert_id': str(alert.alert_id),
-                            'rule_id': rule.rule_id,
-                            'severity': rule.severity,
-                            'details': violation_details,
-                            'timestamp': alert.timestamp.isoformat()
-                        }
-                    )
-            
-            # Publish fraud alert event
+            async_to_sync(_send_alert_batches)(get_channel_layer(), messages)
+        
+        # Publish fraud alert events; the producer batches them
+        for p, alert in created:
             alert_event = {
                 'event_type': 'fraud.alert',
                 'timestamp': datetime.now().isoformat(),
                 'alert_id': str(alert.alert_id),
-                'rule_id': rule.rule_id,
-                'severity': rule.severity,
-                'employee_id': employee_id,
-                'terminal_id': terminal_id,
-                'basket_id': basket_id,
-                'details': violation_details,
+                'rule_id': p.rule.rule_id,
+                'severity': p.rule.severity,
+                'employee_id': p.employee_id,
+                'terminal_id': p.terminal_id,
+                'basket_id': p.basket_id,
+                'details': p.details,
                 'metadata': {
                     'plugin_version': '1.0.0',
-                    'detection_time': datetime.now().isoformat()
+                    'detection_time': alert.timestamp.isoformat()
                 }
             }
-            
             event_producer.publish(settings.KAFKA_TOPIC, alert_event)
-            logger.warning(f"FRAUD ALERT: {rule.name} - Employee {employee.username} - {violation_details}")
-            
-        except Exception as e:
-            logger.error(f"Failed to create fraud alert: {e}")
\ No newline at end of file
+            logger.warning(f"FRAUD ALERT: {p.rule.name} - Employee {alert.employee.username} - {p.details}")
+
+
+async def _send_alert_batches(channel_layer, messages):
+    """One group_send per terminal group, all groups concurrently"""
+    await asyncio.gather(*(
+        channel_layer.group_send(group, {'type': 'fraud_alert_batch', 'alerts': alerts})
+        for group, alerts in messages.items()
+    ))
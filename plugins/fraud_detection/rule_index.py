@@ -0,0 +1,71 @@
+from collections import defaultdict
+from .baselines import BASELINE_EVENT_TYPES, is_baseline_rule
+from .models import FraudRule
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Control event published on KAFKA_CONTROL_TOPIC when any FraudRule changes,
+# so every process reloads its rule index
+FRAUD_RULES_CHANGED = 'FRAUD_RULES_CHANGED'
+
+# Event types each rule is evaluated on
+RULE_EVENT_MAPPING = {
+    'multiple_terminals': ('EMPLOYEE_LOGIN',),
+    'rapid_items': ('BASKET_STARTED', 'item.added'),  # Need BASKET_STARTED to initialize state
+    'high_value_payment': ('PAYMENT_COMPLETED',),
+    'anonymous_payment': ('PAYMENT_COMPLETED',),
+    'rapid_checkout': ('PAYMENT_COMPLETED',),
+}
+
+
+def rule_event_types(rule):
+    """Event types a rule is evaluated on, depending on its mode"""
+    if is_baseline_rule(rule):
+        return BASELINE_EVENT_TYPES
+    return RULE_EVENT_MAPPING.get(rule.rule_id, ())
+
+
+class FraudRuleIndex:
+    """Enabled fraud rules held in memory, indexed by event type.
+
+    Loaded with one query on first use and dropped by ``invalidate`` when a
+    FraudRule is saved or deleted (or the FRAUD_RULES_CHANGED control event
+    arrives), so evaluating an event is a single dict lookup.
+    """
+    
+    def __init__(self):
+        self._by_event_type = None
+        self._version = 0
+        self._lock = threading.Lock()
+    
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._by_event_type = None
+    
+    def rules_for(self, event_type):
+        """Enabled rules to evaluate for an event type"""
+        index = self._by_event_type
+        if index is None:
+            index = self._load()
+        return index.get(event_type, ())
+    
+    def _load(self):
+        version = self._version
+        by_event_type = defaultdict(list)
+        for rule in FraudRule.objects.filter(enabled=True).order_by('id'):
+            for event_type in rule_event_types(rule):
+                by_event_type[event_type].append(rule)
+        index = {event_type: tuple(rules) for event_type, rules in by_event_type.items()}
+        with self._lock:
+            # Only publish if no invalidation raced with the load
+            if self._version == version:
+                self._by_event_type = index
+        logger.info(f"Loaded fraud rule index: {sum(len(rules) for rules in index.values())} rule/event pairs")
+        return index
+
+
+# Global rule index instance
+rule_index = FraudRuleIndex()
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from events.control import control_listener
+from events.outbox import enqueue_event
+from .models import FraudRule
+from .rule_index import rule_index, FRAUD_RULES_CHANGED
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=FraudRule)
+@receiver(post_delete, sender=FraudRule)
+def fraud_rule_changed(sender, instance, **kwargs):
+    """Reload this process's rule index and tell every other process"""
+    rule_index.invalidate()
+    enqueue_event(settings.KAFKA_CONTROL_TOPIC, {
+        'event_type': FRAUD_RULES_CHANGED,
+        'timestamp': timezone.now().isoformat(),
+        'rule_id': instance.rule_id
+    })
+
+
+def fraud_rule_changed_elsewhere(event_data):
+    rule_index.invalidate()
+    logger.info(f"Fraud rule {event_data.get('rule_id')} changed, rule index invalidated")
+
+
+control_listener.register(FRAUD_RULES_CHANGED, fraud_rule_changed_elsewhere)
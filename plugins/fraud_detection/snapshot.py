@@ -0,0 +1,134 @@
+from .backtest import SimulatedClock, parse_timestamp
+from .state_manager import InMemoryStateBackend, StateManager, _decode_state, _encode_state, state_manager
+import gzip
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+class StateSnapshotter:
+    """Periodic on-disk snapshots of the in-memory fraud state.
+
+    A snapshot is a gzipped JSON document with the employee, terminal and
+    basket records plus, per topic partition, the offset of the first event
+    not reflected in them. On startup the consumer restores the snapshot and
+    replays the topic from those offsets, instead of starting with empty
+    state. Rate counters are not saved: their windows are shorter than a
+    restart. Employee and terminal baselines are saved with the records.
+    The Redis backend already outlives the process, so nothing is
+    snapshotted for it.
+    """
+
+    def __init__(self, path, interval_seconds, manager=None):
+        self.path = path
+        self.interval_seconds = interval_seconds
+        self.manager = manager or state_manager
+        self._last_save = time.monotonic()
+
+    @property
+    def enabled(self):
+        return bool(self.path) and isinstance(self.manager.backend, InMemoryStateBackend)
+
+    def due(self):
+        """True if snapshots are enabled and the interval has elapsed"""
+        return self.enabled and time.monotonic() - self._last_save >= self.interval_seconds
+
+    def maybe_save(self, offsets):
+        """Save if the interval has elapsed; ``offsets`` maps (topic, partition) -> next offset.
+
+        The state must reflect exactly the events before those offsets:
+        callers with events in flight wait for them and commit first.
+        """
+        if not offsets or not self.due():
+            return False
+        self.save(offsets)
+        return True
+
+    def save(self, offsets):
+        """Write the snapshot atomically"""
+        self._last_save = time.monotonic()
+        backend = self.manager.backend
+        document = {
+            'version': SNAPSHOT_VERSION,
+            'saved_at': time.time(),
+            'offsets': [[topic, partition, offset] for (topic, partition), offset in offsets.items()],
+            # dict() copies are atomic, so worker threads can keep updating state
+            'employee': dict(backend.employee_sessions),
+            'terminal': dict(backend.terminal_states),
+            'basket': dict(backend.basket_states),
+            'employee_baseline': dict(backend.employee_baselines),
+            'terminal_baseline': dict(backend.terminal_baselines),
+        }
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump(document, f, default=_encode_state, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, RuntimeError) as e:
+            logger.warning(f"Could not save fraud state snapshot: {e}")
+            return
+        logger.info(
+            f"Saved fraud state snapshot: {len(document['employee'])} sessions, "
+            f"{len(document['terminal'])} terminals, {len(document['basket'])} baskets"
+        )
+
+    def restore(self):
+        """Load the snapshot into the state manager; returns its offsets (empty if none)"""
+        if not self.enabled or not os.path.exists(self.path):
+            return {}
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                document = json.load(f, object_hook=_decode_state)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable fraud state snapshot {self.path}: {e}")
+            return {}
+        if document.get('version') != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring fraud state snapshot with version {document.get('version')}")
+            return {}
+
+        # JSON object keys are strings; employee ids in events are integers
+        records = []
+        for kind in ('employee', 'employee_baseline'):
+            records += [
+                (kind, int(key) if key.isdigit() else key, record) for key, record in document.get(kind, {}).items()
+            ]
+        for kind in ('terminal', 'basket', 'terminal_baseline'):
+            records += [(kind, key, record) for key, record in document.get(kind, {}).items()]
+        self.manager.backend.set_many(records)
+        logger.info(
+            f"Restored fraud state snapshot from {time.time() - document['saved_at']:.0f}s ago: "
+            f"{len(document['employee'])} sessions, {len(document['terminal'])} terminals, "
+            f"{len(document['basket'])} baskets"
+        )
+        return {(topic, partition): offset for topic, partition, offset in document['offsets']}
+
+
+class StateReplayer:
+    """Applies replayed events to the state as of the time they happened.
+
+    Replayed events are applied through a manager that shares the backend
+    but runs on a SimulatedClock advanced to each event's timestamp, so
+    session and basket start times and rate hits are those of the original
+    events, not of the restart. Rules are not evaluated again.
+    """
+
+    def __init__(self, manager=None):
+        self.clock = SimulatedClock()
+        self.manager = StateManager(backend=(manager or state_manager).backend, clock=self.clock)
+
+    def replay(self, event_data):
+        moment = parse_timestamp(event_data.get('timestamp'))
+        if moment is not None:
+            self.clock.advance(moment)
+        self.manager.apply_event(
+            event_data.get('event_type'),
+            event_data,
+            event_data.get('employee_id'),
+            event_data.get('terminal_id'),
+            event_data.get('basket_id')
+        )
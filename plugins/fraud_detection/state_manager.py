@@ -1,128 +1,591 @@
+import heapq
 import time
-from collections import defaultdict
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
 from datetime import datetime, timedelta
+from django.conf import settings
+from plugins.metrics import plugin_metrics
+from .baselines import (
+    BASELINE_METRICS, PAYMENT_EVENT_TYPES, basket_observations, new_baseline, payment_amount, update_stat, z_score
+)
+import json
 import logging
+import math
+import threading
 
 logger = logging.getLogger(__name__)
 
+# Lifetime of each kind of state record, counted from the record's timestamp field
+STATE_TTL = {
+    'employee': timedelta(hours=8),
+    'terminal': timedelta(hours=8),
+    'basket': timedelta(hours=2),
+    'employee_baseline': timedelta(days=30),
+    'terminal_baseline': timedelta(days=30),
+}
+STATE_TIMESTAMP_FIELDS = {
+    'employee': 'login_time',
+    'terminal': 'session_start',
+    'basket': 'start_time',
+    'employee_baseline': 'updated_at',
+    'terminal_baseline': 'updated_at',
+}
 
-class StateManager:
-    def __init__(self):
+
+class SlidingWindowCounter:
+    """Number of hits in the last ``window_seconds``.
+    
+    Hits are appended to a deque in time order and expired from the front,
+    so each hit is added and removed once: add and count are amortised O(1)
+    and memory is bounded by the hits inside the window. Times are epoch
+    seconds.
+    """
+    
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self._hits = deque()
+    
+    def _expire(self, now):
+        cutoff = now - self.window_seconds
+        hits = self._hits
+        while hits and hits[0] <= cutoff:
+            hits.popleft()
+    
+    def add(self, now=None):
+        """Record a hit and return the count inside the window"""
+        now = time.time() if now is None else now
+        self._expire(now)
+        self._hits.append(now)
+        return len(self._hits)
+    
+    def count(self, now=None, window_seconds=None):
+        """Hits in the last ``window_seconds`` (default: the whole window)"""
+        now = time.time() if now is None else now
+        self._expire(now)
+        if window_seconds is None or window_seconds >= self.window_seconds:
+            return len(self._hits)
+        cutoff = now - window_seconds
+        recent = 0
+        for hit in reversed(self._hits):
+            if hit <= cutoff:
+                break
+            recent += 1
+        return recent
+    
+    def __len__(self):
+        return len(self._hits)
+
+
+class StateBackend(ABC):
+    """Storage for fraud detection state.
+    
+    Records are plain dicts addressed by (kind, key), where kind is
+    'employee', 'terminal', 'basket', 'employee_baseline' or
+    'terminal_baseline'. Rates are hit times addressed by (scope, key),
+    kept for FRAUD_RATE_RETENTION_SECONDS and counted over any shorter
+    window.
+    """
+    
+    @abstractmethod
+    def get_many(self, refs):
+        """Return the records for a list of (kind, key), None where missing"""
+        pass
+    
+    @abstractmethod
+    def set_many(self, records):
+        """Store a list of (kind, key, record)"""
+        pass
+    
+    @abstractmethod
+    def delete_many(self, refs):
+        """Delete a list of (kind, key)"""
+        pass
+    
+    @abstractmethod
+    def record_hit(self, scope, key, now=None):
+        """Record a hit"""
+        pass
+    
+    @abstractmethod
+    def get_rate(self, scope, key, window_seconds, now=None):
+        """Return the hits in the last window_seconds"""
+        pass
+    
+    def transaction(self, refs, apply):
+        """Read-modify-write of records that no concurrent transaction can interleave with.
+        
+        ``apply(records, read)`` gets the records of ``refs`` (None where
+        missing) and returns ``(writes, deletes)`` in the shapes taken by
+        set_many and delete_many; ``read(refs)`` fetches further records
+        within the transaction. ``apply`` may run more than once, so it
+        must have no other side effects.
+        """
+        writes, deletes = apply(self.get_many(refs), self.get_many)
+        self.set_many(writes)
+        self.delete_many(deletes)
+    
+    def cleanup(self, now=None):
+        """Drop expired state; backends with server-side expiry need nothing here"""
+        pass
+    
+    def sizes(self):
+        """Gauges: number of live entries per category, where cheap to know"""
+        return {}
+
+
+class InMemoryStateBackend(StateBackend):
+    """Per-process state in dicts.
+    
+    Expiry is driven by min-heaps of deadlines: every call to ``cleanup``
+    pops at most ``max_expirations`` due entries, so no single event pays
+    for a scan of the whole state. Entries are checked lazily, so a record
+    that was replaced or deleted leaves a stale entry that is just skipped.
+    """
+    
+    def __init__(self, max_expirations=100, retention_seconds=None):
+        self._lock = threading.RLock()  # Event workers share the dicts
         self.employee_sessions = {}
         self.terminal_states = {}
         self.basket_states = {}
-        self.cleanup_interval = 300  # 5 minutes
-        self.last_cleanup = time.time()
+        self.employee_baselines = {}
+        self.terminal_baselines = {}
+        self.rate_counters = {}  # (scope, key) -> SlidingWindowCounter
+        self._records = {
+            'employee': self.employee_sessions,
+            'terminal': self.terminal_states,
+            'basket': self.basket_states,
+            'employee_baseline': self.employee_baselines,
+            'terminal_baseline': self.terminal_baselines,
+        }
+        self.max_expirations = max_expirations
+        self.retention_seconds = retention_seconds or settings.FRAUD_RATE_RETENTION_SECONDS
+        self._deadlines = {}  # (kind, key) -> datetime deadline of the live heap entry
+        self._record_heap = []  # (deadline, kind, key)
+        self._counter_heap = []  # (epoch deadline, counter_key)
     
-    def _cleanup_expired_state(self):
-        """Remove expired state objects"""
-        current_time = time.time()
-        if current_time - self.last_cleanup < self.cleanup_interval:
-            return
+    def get_many(self, refs):
+        return [self._records[kind].get(key) for kind, key in refs]
+    
+    def transaction(self, refs, apply):
+        with self._lock:
+            super().transaction(refs, apply)
+    
+    def set_many(self, records):
+        for kind, key, record in records:
+            self._records[kind][key] = record
+            deadline = record[STATE_TIMESTAMP_FIELDS[kind]] + STATE_TTL[kind]
+            if self._deadlines.get((kind, key)) != deadline:
+                self._deadlines[(kind, key)] = deadline
+                heapq.heappush(self._record_heap, (deadline, kind, key))
+    
+    def delete_many(self, refs):
+        for kind, key in refs:
+            self._records[kind].pop(key, None)
+            self._deadlines.pop((kind, key), None)
+    
+    def record_hit(self, scope, key, now=None):
+        counter_key = (scope, key)
+        with self._lock:
+            counter = self.rate_counters.get(counter_key)
+            if counter is None:
+                counter = self.rate_counters[counter_key] = SlidingWindowCounter(self.retention_seconds)
+                started = time.time() if now is None else now
+                heapq.heappush(self._counter_heap, (started + self.retention_seconds, counter_key))
+            counter.add(now)
+    
+    def get_rate(self, scope, key, window_seconds, now=None):
+        counter = self.rate_counters.get((scope, key))
+        return counter.count(now, window_seconds) if counter else 0
+    
+    def cleanup(self, now=None):
+        """Expire at most max_expirations due records and idle rate counters"""
+        with self._lock:
+            self._cleanup(now)
+    
+    def _cleanup(self, now):
+        budget = self.max_expirations
+        now = datetime.now() if now is None else now
+        heap = self._record_heap
+        while budget and heap and heap[0][0] <= now:
+            deadline, kind, key = heapq.heappop(heap)
+            budget -= 1
+            if self._deadlines.get((kind, key)) != deadline:
+                continue  # Superseded by a later deadline or already deleted
+            del self._deadlines[(kind, key)]
+            self._records[kind].pop(key, None)
         
+        epoch_now = now.timestamp()
+        heap = self._counter_heap
+        while budget and heap and heap[0][0] <= epoch_now:
+            _, counter_key = heapq.heappop(heap)
+            budget -= 1
+            counter = self.rate_counters.get(counter_key)
+            if counter is None:
+                continue
+            if counter.count(epoch_now):
+                # Still active: check again when its newest possible hit expires
+                heapq.heappush(heap, (epoch_now + counter.window_seconds, counter_key))
+            else:
+                del self.rate_counters[counter_key]
+    
+    def sizes(self):
+        """Gauges: number of live entries per category"""
+        return {
+            'employee_sessions': len(self.employee_sessions),
+            'terminal_states': len(self.terminal_states),
+            'basket_states': len(self.basket_states),
+            'baselines': len(self.employee_baselines) + len(self.terminal_baselines),
+            'rate_counters': len(self.rate_counters),
+            'expiry_queue': len(self._record_heap) + len(self._counter_heap),
+        }
+
+
+def _encode_state(value):
+    if isinstance(value, set):
+        return {'__set__': list(value)}
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f"Cannot encode {type(value).__name__} in fraud state")
+
+
+def _decode_state(obj):
+    if '__set__' in obj:
+        return set(obj['__set__'])
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+
+class RedisStateBackend(StateBackend):
+    """State shared by every consumer process through Redis.
+    
+    Records are JSON strings with server-side TTLs (STATE_TTL), read and
+    written in pipelines so an event costs one round-trip for its reads and
+    one for its writes. ``transaction`` WATCHes the records it reads and
+    writes them back in a MULTI, retrying if another consumer changed them
+    in between. Rates are sorted sets of hit timestamps trimmed to the
+    retention period in the same MULTI as the hit. Timestamps are
+    wall-clock so that processes agree on them.
+    """
+    
+    def __init__(self, url, prefix='pos:fraud:', retention_seconds=None):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self._watch_error = redis.WatchError
+        self.prefix = prefix
+        self.retention_seconds = retention_seconds or settings.FRAUD_RATE_RETENTION_SECONDS
+        self.max_transaction_attempts = 10
+    
+    def _key(self, kind, key):
+        return f'{self.prefix}{kind}:{key}'
+    
+    def _decode(self, raws):
+        return [json.loads(raw, object_hook=_decode_state) if raw is not None else None for raw in raws]
+    
+    def get_many(self, refs):
+        if not refs:
+            return []
+        return self._decode(self.client.mget([self._key(kind, key) for kind, key in refs]))
+    
+    def transaction(self, refs, apply):
+        for _ in range(self.max_transaction_attempts):
+            with self.client.pipeline(transaction=True) as pipe:
+                def read(more):
+                    if not more:
+                        return []
+                    keys = [self._key(kind, key) for kind, key in more]
+                    pipe.watch(*keys)
+                    return self._decode(pipe.mget(keys))
+                try:
+                    writes, deletes = apply(read(refs), read)
+                    pipe.multi()
+                    self._queue_writes(pipe, writes)
+                    if deletes:
+                        pipe.delete(*(self._key(kind, key) for kind, key in deletes))
+                    pipe.execute()
+                    return
+                except self._watch_error:
+                    continue
+        raise RuntimeError(f"Fraud state transaction on {refs} kept conflicting, gave up")
+    
+    def set_many(self, records):
+        if not records:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        self._queue_writes(pipe, records)
+        pipe.execute()
+    
+    def _queue_writes(self, pipe, records):
         now = datetime.now()
+        for kind, key, record in records:
+            # Expire at the same moment the in-memory sweep would
+            remaining = STATE_TTL[kind] - (now - record[STATE_TIMESTAMP_FIELDS[kind]])
+            pipe.set(
+                self._key(kind, key),
+                json.dumps(record, default=_encode_state),
+                ex=max(1, int(remaining.total_seconds()))
+            )
+    
+    def delete_many(self, refs):
+        if refs:
+            self.client.delete(*(self._key(kind, key) for kind, key in refs))
+    
+    def _rate_key(self, scope, key):
+        return f'{self.prefix}rate:{scope}:{key}'
+    
+    def record_hit(self, scope, key, now=None):
+        now = time.time() if now is None else now
+        rate_key = self._rate_key(scope, key)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zremrangebyscore(rate_key, '-inf', now - self.retention_seconds)
+        pipe.zadd(rate_key, {f'{now:.6f}:{uuid.uuid4().hex[:8]}': now})
+        pipe.expire(rate_key, math.ceil(self.retention_seconds) + 1)
+        pipe.execute()
+    
+    def get_rate(self, scope, key, window_seconds, now=None):
+        now = time.time() if now is None else now
+        return self.client.zcount(self._rate_key(scope, key), f'({now - window_seconds}', '+inf')
+
+
+def get_state_backend():
+    """Build the state backend selected by FRAUD_STATE_BACKEND"""
+    if settings.FRAUD_STATE_BACKEND == 'redis':
+        try:
+            return RedisStateBackend(settings.FRAUD_STATE_REDIS_URL)
+        except ImportError:
+            logger.warning("redis package not installed, falling back to in-memory fraud state")
+    return InMemoryStateBackend()
+
+
+class StateManager:
+    """Fraud detection state on top of a pluggable StateBackend.
+    
+    ``clock`` returns the current datetime; backtests pass a simulated one.
+    """
+    
+    def __init__(self, backend=None, clock=None):
+        self.backend = backend or get_state_backend()
+        self.clock = clock or datetime.now
+    
+    def now(self):
+        return self.clock()
+    
+    # Direct access to the in-memory backend's stores
+    @property
+    def employee_sessions(self):
+        return self.backend.employee_sessions
+    
+    @property
+    def terminal_states(self):
+        return self.backend.terminal_states
+    
+    @property
+    def basket_states(self):
+        return self.backend.basket_states
+    
+    @property
+    def employee_baselines(self):
+        return self.backend.employee_baselines
+    
+    @property
+    def terminal_baselines(self):
+        return self.backend.terminal_baselines
+    
+    @property
+    def rate_counters(self):
+        return self.backend.rate_counters
+    
+    def apply_event(self, event_type, event_data, employee_id, terminal_id, basket_id):
+        """Update employee, terminal and basket state for one event.
         
-        # Cleanup employee sessions (8 hours TTL)
-        expired_sessions = [
-            emp_id for emp_id, session in self.employee_sessions.items()
-            if now - session['login_time'] > timedelta(hours=8)
-        ]
-        for emp_id in expired_sessions:
-            del self.employee_sessions[emp_id]
-        
-        # Cleanup terminal states (8 hours TTL)
-        expired_terminals = [
-            term_id for term_id, state in self.terminal_states.items()
-            if now - state['session_start'] > timedelta(hours=8)
-        ]
-        for term_id in expired_terminals:
-            del self.terminal_states[term_id]
+        The affected records are read in one batch and the changed ones
+        written back in one batch, as one backend transaction: events of an
+        employee are handled by several workers (logins keyed by employee,
+        baskets by basket), and none may overwrite another's update. Items
+        added to a known basket are also recorded as 'basket' hits, which
+        rate rules count over their own windows.
+        """
+        keys = {'employee': employee_id, 'terminal': terminal_id, 'basket': basket_id}
+        if event_type in PAYMENT_EVENT_TYPES:
+            keys['employee_baseline'] = employee_id
+            keys['terminal_baseline'] = terminal_id
+        refs = [(kind, key) for kind, key in keys.items() if key]
+        item_added = False
         
-        # Cleanup basket states (2 hours TTL)
-        expired_baskets = [
-            basket_id for basket_id, state in self.basket_states.items()
-            if now - state['start_time'] > timedelta(hours=2)
-        ]
-        for basket_id in expired_baskets:
-            del self.basket_states[basket_id]
+        def apply(records, read):
+            nonlocal item_added
+            event_keys = dict(keys)
+            loaded = dict(zip((kind for kind, _ in refs), records))
+            session, terminal, basket = loaded.get('employee'), loaded.get('terminal'), loaded.get('basket')
+            writes = {}
+            deletes = []
+            
+            if employee_id:
+                session, changed = self._update_employee_session(session, terminal_id, event_type, event_data)
+                if changed:
+                    if session is None:
+                        deletes.append(('employee', employee_id))
+                    else:
+                        writes['employee'] = session
+            
+            if terminal_id:
+                terminal, changed = self._update_terminal_state(terminal, employee_id, event_type)
+                if changed:
+                    if terminal is None:
+                        deletes.append(('terminal', terminal_id))
+                    else:
+                        writes['terminal'] = terminal
+            
+            if basket_id:
+                basket, changed = self._update_basket_state(basket, employee_id, terminal_id, event_type, event_data)
+                if changed:
+                    writes['basket'] = basket
+                    if event_type == "item.added":
+                        item_added = True
+                    elif event_type == "BASKET_STARTED" and session is not None:
+                        session['active_baskets'].add(basket_id)
+                        writes['employee'] = session
+                    elif event_type in PAYMENT_EVENT_TYPES:
+                        writes.update(self._update_baselines(basket, event_data, event_keys, loaded, read))
+            
+            return [(kind, event_keys[kind], record) for kind, record in writes.items()], deletes
         
-        self.last_cleanup = current_time
-        if expired_sessions or expired_terminals or expired_baskets:
-            logger.info(f"Cleaned up {len(expired_sessions)} sessions, {len(expired_terminals)} terminals, {len(expired_baskets)} baskets")
+        self.backend.cleanup(self.now())
+        self.backend.transaction(refs, apply)
+        if item_added:
+            self.backend.record_hit('basket', basket_id, self.now().timestamp())
     
-    def update_employee_session(self, employee_id, terminal_id, event_type, event_data):
-        """Update employee session state"""
-        self._cleanup_expired_state()
-        
+    def _update_employee_session(self, session, terminal_id, event_type, event_data):
+        """Update employee session state; returns (session, changed)"""
         if event_type == "EMPLOYEE_LOGIN":
-            if employee_id not in self.employee_sessions:
-                self.employee_sessions[employee_id] = {
+            if session is None:
+                session = {
                     'terminal_ids': set(),
-                    'login_time': datetime.now(),
+                    'login_time': self.now(),
                     'active_baskets': set(),
                     'total_payments': 0
                 }
-            self.employee_sessions[employee_id]['terminal_ids'].add(terminal_id)
+            session['terminal_ids'].add(terminal_id)
+            return session, True
         
         elif event_type == "EMPLOYEE_LOGOUT":
-            if employee_id in self.employee_sessions:
-                self.employee_sessions[employee_id]['terminal_ids'].discard(terminal_id)
-                if not self.employee_sessions[employee_id]['terminal_ids']:
-                    del self.employee_sessions[employee_id]
+            if session is not None:
+                session['terminal_ids'].discard(terminal_id)
+                if not session['terminal_ids']:
+                    return None, True
+                return session, True
         
-        elif event_type == "PAYMENT_COMPLETED" and employee_id in self.employee_sessions:
-            amount = event_data.get('amount', 0)
-            self.employee_sessions[employee_id]['total_payments'] += amount
+        elif event_type in PAYMENT_EVENT_TYPES and session is not None:
+            session['total_payments'] += payment_amount(event_data)
+            return session, True
+        
+        return session, False
     
-    def update_terminal_state(self, terminal_id, employee_id, event_type):
-        """Update terminal state"""
+    def _update_terminal_state(self, terminal, employee_id, event_type):
+        """Update terminal state; returns (state, changed)"""
         if event_type == "EMPLOYEE_LOGIN":
-            self.terminal_states[terminal_id] = {
+            return {
                 'current_employee_id': employee_id,
-                'session_start': datetime.now(),
+                'session_start': self.now(),
                 'basket_count': 0
-            }
-        elif event_type == "BASKET_STARTED" and terminal_id in self.terminal_states:
-            self.terminal_states[terminal_id]['basket_count'] += 1
+            }, True
+        elif event_type == "BASKET_STARTED" and terminal is not None:
+            terminal['basket_count'] += 1
+            return terminal, True
         elif event_type == "EMPLOYEE_LOGOUT":
-            self.terminal_states.pop(terminal_id, None)
+            return None, terminal is not None
+        return terminal, False
     
-    def update_basket_state(self, basket_id, employee_id, terminal_id, event_type, event_data):
-        """Update basket state"""
+    def _update_basket_state(self, basket, employee_id, terminal_id, event_type, event_data):
+        """Update basket state; returns (state, changed)"""
         if event_type == "BASKET_STARTED":
-            self.basket_states[basket_id] = {
+            return {
                 'employee_id': employee_id,
                 'terminal_id': terminal_id,
-                'start_time': datetime.now(),
+                'start_time': self.now(),
                 'item_count': 0,
-                'item_velocity': [],
                 'customer_identified': False,
                 'payment_amount': 0
-            }
-            if employee_id in self.employee_sessions:
-                self.employee_sessions[employee_id]['active_baskets'].add(basket_id)
+            }, True
         
-        elif basket_id in self.basket_states:
-            if event_type == "item.added":
-                self.basket_states[basket_id]['item_count'] += 1
-                self.basket_states[basket_id]['item_velocity'].append(datetime.now())
-            elif event_type == "CUSTOMER_IDENTIFIED":
-                self.basket_states[basket_id]['customer_identified'] = True
-            elif event_type == "PAYMENT_COMPLETED":
-                self.basket_states[basket_id]['payment_amount'] = event_data.get('amount', 0)
+        if basket is None:
+            return None, False
+        if event_type == "item.added":
+            basket['item_count'] += 1
+        elif event_type == "CUSTOMER_IDENTIFIED":
+            basket['customer_identified'] = True
+        elif event_type in PAYMENT_EVENT_TYPES:
+            basket['payment_amount'] = payment_amount(event_data)
+        else:
+            return basket, False
+        return basket, True
+    
+    def _update_baselines(self, basket, event_data, keys, loaded, read):
+        """Score a paid basket against the employee and terminal baselines, then fold it in.
+        
+        The scores (against the baselines as they were before this basket)
+        are kept on the basket for baseline-mode rules. Returns the updated
+        baseline records by kind. Runs inside apply_event's transaction, so
+        payments of one employee on several workers or processes each fold
+        into the latest baseline; ``read`` fetches a baseline within it.
+        """
+        now = self.now()
+        observations = basket_observations(basket, payment_amount(event_data), now)
+        alpha = settings.FRAUD_BASELINE_ALPHA
+        scores = {}
+        updated = {}
+        for scope in ('employee', 'terminal'):
+            kind = f'{scope}_baseline'
+            key = keys.get(kind) or basket.get(f'{scope}_id')
+            if not key:
+                continue
+            if not keys.get(kind):
+                # Event without the id: fall back to the basket's, at the cost of a read
+                keys[kind] = key
+                loaded[kind] = read([(kind, key)])[0]
+            baseline = loaded.get(kind) or new_baseline(now)
+            scores[scope] = {}
+            for metric in BASELINE_METRICS:
+                value = observations[metric]
+                stat = baseline[metric]
+                scores[scope][metric] = {'z': z_score(stat, value), 'samples': stat[0], 'mean': stat[1]}
+                baseline[metric] = update_stat(stat, value, alpha)
+            baseline['updated_at'] = now
+            updated[kind] = baseline
+        basket['observations'] = observations
+        basket['baseline_scores'] = scores
+        return updated
+    
+    def record_hit(self, scope, key, now=None):
+        """Record a hit for ``key`` in ``scope`` ('basket', 'employee', 'terminal', ...)"""
+        if now is None:
+            now = self.now().timestamp()
+        self.backend.record_hit(scope, key, now)
+    
+    def get_rate(self, scope, key, window_seconds, now=None):
+        """Number of hits for ``key`` in the last ``window_seconds``"""
+        if now is None:
+            now = self.now().timestamp()
+        return self.backend.get_rate(scope, key, window_seconds, now)
     
     def get_employee_session(self, employee_id):
         """Get employee session state"""
-        return self.employee_sessions.get(employee_id)
+        return self.backend.get_many([('employee', employee_id)])[0]
     
     def get_terminal_state(self, terminal_id):
         """Get terminal state"""
-        return self.terminal_states.get(terminal_id)
+        return self.backend.get_many([('terminal', terminal_id)])[0]
     
     def get_basket_state(self, basket_id):
         """Get basket state"""
-        return self.basket_states.get(basket_id)
+        return self.backend.get_many([('basket', basket_id)])[0]
+    
+    def get_baseline(self, scope, key):
+        """Get the baseline of an employee or terminal ('employee' or 'terminal' scope)"""
+        return self.backend.get_many([(f'{scope}_baseline', key)])[0]
 
 
 # Singleton instance
-state_manager = StateManager()
\ No newline at end of file
+state_manager = StateManager()
+plugin_metrics.register_gauges('fraud_state', lambda: state_manager.backend.sizes())
@@ -1,13 +1,31 @@
-from django.test import TestCase
-from unittest.mock import patch, Mock
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from io import StringIO
+from unittest.mock import patch, MagicMock, Mock
 from decimal import Decimal
 from django.utils import timezone
 from datetime import datetime, timedelta
 
+from baskets.mutations import BasketMutations
+from events.control import control_listener
+from events.models import OutboxEvent
 from plugins.models import PluginConfiguration
+from plugins.fraud_detection.alert_queue import alert_queue
+from plugins.fraud_detection.baselines import update_stat, z_score
 from plugins.fraud_detection.plugin import FraudDetectionPlugin
 from plugins.fraud_detection.models import FraudRule, FraudAlert
-from plugins.fraud_detection.state_manager import state_manager
+from plugins.fraud_detection.rule_index import rule_index, FRAUD_RULES_CHANGED
+from plugins.fraud_detection.state_manager import (
+    InMemoryStateBackend, RedisStateBackend, SlidingWindowCounter, StateManager, _decode_state, _encode_state,
+    state_manager
+)
+from plugins.fraud_detection.snapshot import StateReplayer, StateSnapshotter
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 from employees.models import Employee
 
 
@@ -68,6 +86,8 @@ class FraudDetectionPluginTest(TestCase):
         state_manager.employee_sessions.clear()
         state_manager.terminal_states.clear()
         state_manager.basket_states.clear()
+        state_manager.rate_counters.clear()
+        alert_queue.drain()
     
     def test_plugin_processes_events_when_enabled(self):
         """Test plugin processes fraud detection events when enabled"""
@@ -121,6 +141,9 @@ class FraudDetectionPluginTest(TestCase):
         }
         self.plugin.handle_event('EMPLOYEE_LOGIN', event_data_2)
         
+        # Alerts are written by the next flush, as before an offset commit
+        self.plugin.flush()
+        
         # Should create fraud alert
         alert = FraudAlert.objects.get(rule=self.multiple_terminals_rule)
         self.assertEqual(alert.employee, self.employee)
@@ -156,6 +179,9 @@ class FraudDetectionPluginTest(TestCase):
             }
             self.plugin.handle_event('item.added', item_event)
         
+        # Alerts are written by the next flush, as before an offset commit
+        self.plugin.flush()
+        
         # Should create fraud alert
         alert = FraudAlert.objects.get(rule=self.rapid_items_rule)
         self.assertEqual(alert.employee, self.employee)
@@ -185,6 +211,9 @@ class FraudDetectionPluginTest(TestCase):
         }
         self.plugin.handle_event('PAYMENT_COMPLETED', payment_event)
         
+        # Alerts are written by the next flush, as before an offset commit
+        self.plugin.flush()
+        
         # Should create fraud alert
         alert = FraudAlert.objects.get(rule=self.high_value_rule)
         self.assertEqual(alert.employee, self.employee)
@@ -217,6 +246,233 @@ class FraudDetectionPluginTest(TestCase):
         alerts = FraudAlert.objects.filter(rule=self.multiple_terminals_rule)
         self.assertEqual(alerts.count(), 0)
     
+    @override_settings(FRAUD_ALERT_BATCH_SIZE=2, FRAUD_ALERT_FLUSH_SECONDS=60)
+    @patch('asgiref.sync.async_to_sync')
+    @patch('plugins.fraud_detection.plugin.event_producer')
+    def test_alerts_are_flushed_in_batches(self, mock_producer, mock_async):
+        """Test queued alerts are written, pushed and published together, in order per terminal"""
+        for terminal_id in ('TERM-001', 'TERM-002'):
+            self.plugin.handle_event('EMPLOYEE_LOGIN', {'employee_id': self.employee.id, 'terminal_id': terminal_id})
+        
+        # First alert waits for the batch to fill
+        self.assertEqual(FraudAlert.objects.count(), 0)
+        mock_async.assert_not_called()
+        
+        with self.assertNumQueries(2):  # employee lookup + one bulk insert
+            self.plugin.handle_event('EMPLOYEE_LOGIN', {'employee_id': self.employee.id, 'terminal_id': 'TERM-003'})
+        
+        alerts = list(FraudAlert.objects.order_by('id'))
+        self.assertEqual(len(alerts), 2)
+        self.assertEqual(mock_producer.publish.call_count, 2)
+        
+        # One grouped send per flush; each terminal gets its alerts in order
+        mock_async.assert_called_once()
+        messages = mock_async.return_value.call_args[0][1]
+        self.assertEqual(
+            [alert['alert_id'] for alert in messages['fraud_alerts_TERM-001']],
+            [str(alert.alert_id) for alert in alerts]
+        )
+        self.assertEqual(len(messages['fraud_alerts_TERM-003']), 1)
+        self.assertEqual(len(alert_queue), 0)
+    
+    @patch('asgiref.sync.async_to_sync')
+    @patch('plugins.fraud_detection.plugin.event_producer')
+    def test_alerts_of_several_events_share_one_flush(self, mock_producer, mock_async):
+        """Test with the default settings an alert storm is written with one bulk insert"""
+        for i in range(1, 5):
+            self.plugin.handle_event('EMPLOYEE_LOGIN', {'employee_id': self.employee.id, 'terminal_id': f'TERM-00{i}'})
+        self.assertEqual(len(alert_queue), 3)
+        self.assertEqual(FraudAlert.objects.count(), 0)
+        
+        with self.assertNumQueries(2):  # employee lookup + one bulk insert
+            self.plugin.flush()
+        
+        self.assertEqual(FraudAlert.objects.count(), 3)
+        mock_async.assert_called_once()
+    
+    @override_settings(FRAUD_ALERT_BATCH_SIZE=100, FRAUD_ALERT_FLUSH_SECONDS=60)
+    @patch('asgiref.sync.async_to_sync')
+    @patch('plugins.fraud_detection.plugin.event_producer')
+    def test_failed_flush_keeps_alerts_queued(self, mock_producer, mock_async):
+        """Test alerts that could not be written stay queued and the failure reaches the consumer"""
+        for terminal_id in ('TERM-001', 'TERM-002'):
+            self.plugin.handle_event('EMPLOYEE_LOGIN', {'employee_id': self.employee.id, 'terminal_id': terminal_id})
+        self.assertEqual(len(alert_queue), 1)
+        
+        with patch.object(FraudAlert.objects, 'bulk_create', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                self.plugin.flush()
+        self.assertEqual(len(alert_queue), 1)
+        
+        self.plugin.flush()
+        self.assertEqual(FraudAlert.objects.count(), 1)
+        self.assertEqual(len(alert_queue), 0)
+    
+    def test_rule_index_evaluates_without_queries(self):
+        """Test warm rule evaluation is an index lookup with no database queries"""
+        self.assertEqual(
+            [rule.rule_id for rule in rule_index.rules_for('item.added')], ['rapid_items']
+        )
+        self.assertEqual(rule_index.rules_for('CUSTOMER_IDENTIFIED'), ())
+        
+        with self.assertNumQueries(0):
+            self.plugin.handle_event('item.added', {'terminal_id': 'TERM-001', 'basket_id': 'BASKET-789'})
+    
+    def test_rule_changes_reload_index(self):
+        """Test saving a rule or receiving the control event reloads the index"""
+        self.assertIn(self.high_value_rule, rule_index.rules_for('PAYMENT_COMPLETED'))
+        
+        self.high_value_rule.enabled = False
+        self.high_value_rule.save()
+        self.assertNotIn(self.high_value_rule, rule_index.rules_for('PAYMENT_COMPLETED'))
+        
+        FraudRule.objects.filter(rule_id='high_value_payment').update(enabled=True)
+        self.assertNotIn(self.high_value_rule, rule_index.rules_for('PAYMENT_COMPLETED'))
+        control_listener.dispatch({'event_type': FRAUD_RULES_CHANGED, 'rule_id': 'high_value_payment'})
+        self.assertIn(self.high_value_rule, rule_index.rules_for('PAYMENT_COMPLETED'))
+    
+    def test_backtest_compares_candidate_settings(self):
+        """Test the backtest replays a log with simulated time and compares settings"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        log_path = os.path.join(directory, 'events.jsonl')
+        start = datetime(2026, 1, 5, 9, 0, 0)
+        events = [{'event_type': 'BASKET_STARTED', 'employee_id': 7, 'terminal_id': 'TERM-9',
+                   'basket_id': 'B-1', 'timestamp': start.isoformat()}]
+        events += [
+            {'event_type': 'item.added', 'employee_id': 7, 'basket_id': 'B-1',
+             'timestamp': (start + timedelta(seconds=2 * i)).isoformat()}
+            for i in range(1, 7)
+        ]
+        # Spread out: never 5 items within 30 simulated seconds
+        events += [{'event_type': 'BASKET_STARTED', 'employee_id': 7, 'terminal_id': 'TERM-9',
+                    'basket_id': 'B-2', 'timestamp': (start + timedelta(minutes=5)).isoformat()}]
+        events += [
+            {'event_type': 'item.added', 'employee_id': 7, 'basket_id': 'B-2',
+             'timestamp': (start + timedelta(minutes=5, seconds=10 * i)).isoformat()}
+            for i in range(1, 7)
+        ]
+        with open(log_path, 'w') as f:
+            f.write('\n'.join(json.dumps(event) for event in events))
+        
+        out = StringIO()
+        call_command('backtest_fraud_rules', log_path, '--set', 'rapid_items.threshold=6', '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        
+        self.assertEqual(report['events'], len(events))
+        rapid_items = report['rules']['rapid_items']
+        self.assertEqual(rapid_items['current']['alerts'], 2)
+        self.assertEqual(rapid_items['candidate']['alerts'], 1)
+        self.assertEqual(rapid_items['current']['terminals'], [['TERM-9', 2]])
+        self.assertEqual(FraudAlert.objects.count(), 0)
+    
+    @patch('asgiref.sync.async_to_sync')
+    @patch('plugins.fraud_detection.plugin.event_producer')
+    def test_baseline_mode_alerts_against_own_history(self, mock_producer, mock_async):
+        """Test baseline-mode rules alert on deviation from each employee's own pace"""
+        self.rapid_items_rule.config = {'mode': 'baseline', 'min_samples': 8}
+        self.rapid_items_rule.save()
+        fast_employee = Employee.objects.create_user(
+            username='fastuser', password='testpass123', employee_id='EMP002', role='CASHIER'
+        )
+        now = [datetime(2026, 1, 5, 9, 0, 0)]
+        self.plugin.state = StateManager(backend=InMemoryStateBackend(), clock=lambda: now[0])
+        
+        def checkout(employee, basket_id, items, seconds):
+            ids = {'employee_id': employee.id, 'terminal_id': f'TERM-{employee.id}', 'basket_id': basket_id}
+            self.plugin.handle_event('BASKET_STARTED', ids)
+            for _ in range(items):
+                self.plugin.handle_event('item.added', ids)
+            now[0] += timedelta(seconds=seconds)
+            self.plugin.handle_event('PAYMENT_COMPLETED', {**ids, 'amount': 50})
+            self.plugin.flush()
+            now[0] += timedelta(minutes=2)
+        
+        # About 10 items/minute for one cashier, about 60 for the other
+        for i in range(10):
+            checkout(self.employee, f'SLOW-{i}', 5 + i % 2, 30)
+            checkout(fast_employee, f'FAST-{i}', 29 + i % 3, 30)
+        self.assertEqual(FraudAlert.objects.count(), 0)
+        
+        # 60 items/minute is routine for the fast cashier but not for the slow one
+        checkout(fast_employee, 'FAST-X', 30, 30)
+        self.assertEqual(FraudAlert.objects.count(), 0)
+        checkout(self.employee, 'SLOW-X', 30, 30)
+        
+        alert = FraudAlert.objects.get(rule=self.rapid_items_rule)
+        self.assertEqual(alert.employee, self.employee)
+        self.assertEqual(alert.details['metric'], 'items_per_minute')
+        self.assertEqual(alert.details['samples'], 10)
+        self.assertGreater(alert.details['z_score'], 3)
+        
+        baseline = self.plugin.state.get_baseline('employee', self.employee.id)
+        self.assertEqual(baseline['items_per_minute'][0], 11)
+    
+    @patch('asgiref.sync.async_to_sync')
+    @patch('plugins.fraud_detection.plugin.event_producer')
+    def test_replay_after_restore_keeps_event_times(self, mock_producer, mock_async):
+        """Test events replayed after a restore count at their own time, not at the restart"""
+        FraudRule.objects.create(
+            rule_id='rapid_checkout', name='Rapid Checkout', description='Basket paid too quickly',
+            severity='MEDIUM', time_window=60, threshold=1, enabled=True
+        )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'fraud-state.json.gz')
+        start = datetime.now() - timedelta(minutes=50)
+        ids = {'employee_id': self.employee.id, 'terminal_id': 'TERM-001', 'basket_id': 'BASKET-1'}
+        
+        # Snapshot taken after the login; the basket and its items are replayed
+        manager = StateManager(backend=InMemoryStateBackend())
+        StateReplayer(manager).replay({**ids, 'event_type': 'EMPLOYEE_LOGIN', 'timestamp': start.isoformat()})
+        StateSnapshotter(path, 60, manager=manager).save({('pos-events', 0): 1})
+        
+        restored = StateManager(backend=InMemoryStateBackend())
+        StateSnapshotter(path, 60, manager=restored).restore()
+        replayer = StateReplayer(restored)
+        replayer.replay({**ids, 'event_type': 'BASKET_STARTED',
+                         'timestamp': (start + timedelta(minutes=1)).isoformat()})
+        for i in range(10):
+            replayer.replay({**ids, 'event_type': 'item.added',
+                             'timestamp': (start + timedelta(minutes=2 + 5 * i)).isoformat()})
+        
+        # Live events after the restart see a 50 minute session and basket
+        self.plugin.state = restored
+        self.plugin.handle_event('item.added', ids)
+        self.plugin.handle_event('PAYMENT_COMPLETED', {**ids, 'amount': 1500.00})
+        self.plugin.flush()
+        
+        self.assertEqual(restored.get_basket_state('BASKET-1')['item_count'], 11)
+        self.assertEqual(FraudAlert.objects.count(), 0)
+    
+    @patch('asgiref.sync.async_to_sync')
+    @patch('plugins.fraud_detection.plugin.event_producer')
+    def test_baselines_learn_from_pos_payment_events(self, mock_producer, mock_async):
+        """Test the events the basket mutations emit update the baselines and trigger baseline rules"""
+        self.high_value_rule.config = {'mode': 'baseline', 'min_samples': 5}
+        self.high_value_rule.save()
+        self.plugin.state = StateManager(backend=InMemoryStateBackend())
+        
+        def checkout(amount):
+            OutboxEvent.objects.all().delete()
+            basket = BasketMutations.start_basket(None, self.employee.id, 'TERM-001')
+            BasketMutations.process_payment(None, basket.basket_id, 'TERM-001', self.employee.id, amount, 'card')
+            for event in OutboxEvent.objects.order_by('id'):
+                self.plugin.handle_event(event.event_type, event.payload)
+            self.plugin.flush()
+        
+        for i in range(6):
+            checkout(40.0 + i)
+        self.assertEqual(FraudAlert.objects.count(), 0)
+        baseline = self.plugin.state.get_baseline('employee', self.employee.id)
+        self.assertEqual(baseline['basket_value'][0], 6)
+        self.assertAlmostEqual(baseline['basket_value'][1], 42.5)
+        
+        checkout(900.0)
+        alert = FraudAlert.objects.get(rule=self.high_value_rule)
+        self.assertEqual(alert.details['metric'], 'basket_value')
+        self.assertEqual(alert.details['actual_value'], 900.0)
+    
     def test_state_manager_updates(self):
         """Test state manager properly tracks state"""
         # Test employee session tracking
@@ -274,6 +530,7 @@ class FraudDetectionPluginTest(TestCase):
             'amount': 750.00
         }
         self.plugin.handle_event('PAYMENT_COMPLETED', payment_event)
+        self.plugin.flush()
         
         # Verify alert created
         alert = FraudAlert.objects.get(rule=anonymous_rule)
@@ -294,4 +551,206 @@ class FraudDetectionPluginTest(TestCase):
         self.assertEqual(published_data['employee_id'], self.employee.id)
         
         # Verify WebSocket message sent
-        mock_async.assert_called_once()
\ No newline at end of file
+        mock_async.assert_called_once()
+
+
+class BaselineStatTest(SimpleTestCase):
+    
+    def test_warm_up_matches_running_mean(self):
+        """Test the first 1/alpha samples give the plain mean, then the EWMA tracks drift"""
+        stat = [0, 0.0, 0.0]
+        for value in (10, 12, 14):
+            stat = update_stat(stat, value, alpha=0.1)
+        self.assertEqual(stat[0], 3)
+        self.assertAlmostEqual(stat[1], 12.0)
+        self.assertIsNone(z_score([0, 0.0, 0.0], 5))
+        self.assertGreater(z_score(stat, 30), 3)
+        
+        for _ in range(100):
+            stat = update_stat(stat, 40, alpha=0.1)
+        self.assertAlmostEqual(stat[1], 40.0, places=2)
+
+
+class SlidingWindowCounterTest(SimpleTestCase):
+    
+    def test_hits_expire_from_front(self):
+        """Test only hits inside the window are counted and old ones are dropped"""
+        counter = SlidingWindowCounter(window_seconds=30)
+        for second in range(10):
+            counter.add(now=100.0 + second)
+        
+        self.assertEqual(counter.count(now=109.0), 10)
+        self.assertEqual(counter.count(now=135.0), 4)
+        self.assertEqual(len(counter), 4)
+        self.assertEqual(counter.add(now=200.0), 1)
+    
+    def test_state_manager_rates_are_scoped(self):
+        """Test per-employee and per-terminal rates are tracked independently"""
+        state_manager.rate_counters.clear()
+        self.addCleanup(state_manager.rate_counters.clear)
+        
+        for second in range(3):
+            state_manager.record_hit('employee', 'EMP001', now=float(second))
+        state_manager.record_hit('terminal', 'TERM-001', now=2.0)
+        
+        self.assertEqual(state_manager.get_rate('employee', 'EMP001', 60, now=2.0), 3)
+        self.assertEqual(state_manager.get_rate('terminal', 'TERM-001', 60, now=2.0), 1)
+        self.assertEqual(state_manager.get_rate('employee', 'EMP001', 60, now=61.5), 1)
+        self.assertEqual(state_manager.get_rate('employee', 'EMP002', 60), 0)
+    
+    def test_item_hits_are_recorded_once_and_shared_by_windows(self):
+        """Test apply_event records item hits that rules of any window only read"""
+        manager = StateManager(backend=InMemoryStateBackend())
+        manager.apply_event('BASKET_STARTED', {}, 'EMP001', 'TERM-001', 'BASKET-R')
+        for _ in range(3):
+            manager.apply_event('item.added', {}, 'EMP001', 'TERM-001', 'BASKET-R')
+        manager.apply_event('item.added', {}, 'EMP001', 'TERM-001', 'BASKET-UNKNOWN')
+        
+        plugin = FraudDetectionPlugin()
+        plugin.state = manager
+        short_rule = Mock(threshold=3, time_window=10)
+        long_rule = Mock(threshold=3, time_window=60)
+        for rule in (short_rule, long_rule, short_rule):
+            self.assertEqual(plugin._check_rapid_items(rule, 'BASKET-R')['actual_value'], 3)
+        self.assertEqual(manager.get_rate('basket', 'BASKET-UNKNOWN', 60), 0)
+        self.assertEqual(len(manager.rate_counters), 1)
+
+
+class CountingStateBackend(InMemoryStateBackend):
+    """In-memory backend that counts batch calls"""
+    
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+    
+    def get_many(self, refs):
+        self.calls.append('get_many')
+        return super().get_many(refs)
+    
+    def set_many(self, records):
+        self.calls.append('set_many')
+        super().set_many(records)
+
+
+class StateManagerBackendTest(SimpleTestCase):
+    
+    def test_event_reads_and_writes_in_one_batch_each(self):
+        """Test one event costs a single batched read and a single batched write"""
+        backend = CountingStateBackend()
+        manager = StateManager(backend=backend)
+        manager.apply_event('EMPLOYEE_LOGIN', {}, 1, 'TERM-001', None)
+        backend.calls.clear()
+        
+        manager.apply_event('BASKET_STARTED', {}, 1, 'TERM-001', 'BASKET-1')
+        
+        self.assertEqual(backend.calls, ['get_many', 'set_many'])
+        self.assertEqual(manager.get_employee_session(1)['active_baskets'], {'BASKET-1'})
+        self.assertEqual(manager.get_terminal_state('TERM-001')['basket_count'], 1)
+        self.assertEqual(manager.get_basket_state('BASKET-1')['terminal_id'], 'TERM-001')
+    
+    def test_expiry_is_bounded_per_call(self):
+        """Test expired records leave through the deadline heap a bounded batch at a time"""
+        backend = InMemoryStateBackend(max_expirations=2)
+        stale = datetime.now() - timedelta(hours=3)
+        backend.set_many([('basket', f'BASKET-{i}', {'start_time': stale}) for i in range(3)])
+        backend.set_many([('basket', 'BASKET-LIVE', {'start_time': datetime.now()})])
+        # Restarting a basket supersedes its old deadline
+        backend.set_many([('basket', 'BASKET-0', {'start_time': datetime.now()})])
+        
+        backend.cleanup()
+        self.assertEqual(backend.sizes()['basket_states'], 3)
+        backend.cleanup()
+        
+        self.assertEqual(set(backend.basket_states), {'BASKET-0', 'BASKET-LIVE'})
+        self.assertEqual(backend.sizes()['expiry_queue'], 2)
+    
+    def test_concurrent_payments_all_fold_into_the_baseline(self):
+        """Test payments of one employee on several workers do not overwrite each other's baseline update"""
+        class SlowReadBackend(InMemoryStateBackend):
+            def get_many(self, refs):
+                records = super().get_many(refs)
+                time.sleep(0.001)  # Widen the read-modify-write window
+                return records
+        
+        manager = StateManager(backend=SlowReadBackend())
+        for i in range(40):
+            manager.apply_event('BASKET_STARTED', {}, 'EMP001', f'TERM-{i % 4}', f'BASKET-{i}')
+        
+        def pay(baskets):
+            for i in baskets:
+                manager.apply_event('PAYMENT_COMPLETED', {'amount': 10}, 'EMP001', f'TERM-{i % 4}', f'BASKET-{i}')
+        
+        threads = [threading.Thread(target=pay, args=(range(n, 40, 8),)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(manager.get_baseline('employee', 'EMP001')['basket_value'][0], 40)
+    
+    def test_redis_transaction_retries_when_records_change(self):
+        """Test a session update is recomputed from fresh records when another consumer wrote first"""
+        import redis
+        backend = RedisStateBackend('redis://127.0.0.1:6379/15')
+        backend.client = MagicMock()
+        pipe = backend.client.pipeline.return_value.__enter__.return_value
+        login_time = {'__datetime__': datetime.now().isoformat()}
+        stale = json.dumps({'terminal_ids': {'__set__': ['TERM-001']}, 'login_time': login_time,
+                            'active_baskets': {'__set__': []}, 'total_payments': 0})
+        fresh = json.dumps({'terminal_ids': {'__set__': ['TERM-001', 'TERM-002']}, 'login_time': login_time,
+                            'active_baskets': {'__set__': []}, 'total_payments': 0})
+        pipe.mget.side_effect = [[stale, None, None], [fresh, None, None]]
+        pipe.execute.side_effect = [redis.WatchError(), [True]]
+        
+        StateManager(backend=backend).apply_event('BASKET_STARTED', {}, 1, 'TERM-001', 'BASKET-1')
+        
+        self.assertEqual(pipe.watch.call_count, 2)
+        written = {call.args[0]: json.loads(call.args[1], object_hook=_decode_state) for call in pipe.set.call_args_list}
+        session = written['pos:fraud:employee:1']
+        self.assertEqual(session['terminal_ids'], {'TERM-001', 'TERM-002'})
+        self.assertEqual(session['active_baskets'], {'BASKET-1'})
+    
+    def test_state_survives_serialization(self):
+        """Test records round-trip through the JSON encoding used by the Redis backend"""
+        manager = StateManager(backend=InMemoryStateBackend())
+        manager.apply_event('EMPLOYEE_LOGIN', {}, 1, 'TERM-001', None)
+        session = manager.get_employee_session(1)
+        
+        decoded = json.loads(json.dumps(session, default=_encode_state), object_hook=_decode_state)
+        
+        self.assertEqual(decoded, session)
+
+
+class StateSnapshotterTest(SimpleTestCase):
+    
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'fraud-state.json.gz')
+    
+    def test_snapshot_round_trip_with_offsets(self):
+        """Test a restored snapshot reproduces the state and returns its offsets"""
+        manager = StateManager(backend=InMemoryStateBackend())
+        replayer = StateReplayer(manager)
+        for terminal_id in ('TERM-001', 'TERM-002'):
+            replayer.replay({'event_type': 'EMPLOYEE_LOGIN', 'employee_id': 7, 'terminal_id': terminal_id})
+        replayer.replay({'event_type': 'BASKET_STARTED', 'employee_id': 7, 'terminal_id': 'TERM-001',
+                         'basket_id': 'BASKET-1'})
+        StateSnapshotter(self.path, 60, manager=manager).save({('pos-events', 0): 42})
+        
+        restored = StateManager(backend=InMemoryStateBackend())
+        offsets = StateSnapshotter(self.path, 60, manager=restored).restore()
+        
+        self.assertEqual(offsets, {('pos-events', 0): 42})
+        self.assertEqual(restored.get_employee_session(7)['terminal_ids'], {'TERM-001', 'TERM-002'})
+        self.assertEqual(restored.get_employee_session(7)['login_time'], manager.get_employee_session(7)['login_time'])
+        self.assertEqual(restored.get_basket_state('BASKET-1'), manager.get_basket_state('BASKET-1'))
+    
+    def test_save_respects_interval(self):
+        """Test snapshots are only written once the interval has elapsed"""
+        snapshotter = StateSnapshotter(self.path, 60, manager=StateManager(backend=InMemoryStateBackend()))
+        
+        self.assertFalse(snapshotter.maybe_save({('pos-events', 0): 1}))
+        snapshotter._last_save -= 61
+        self.assertTrue(snapshotter.maybe_save({('pos-events', 0): 2}))
+        self.assertTrue(os.path.exists(self.path))
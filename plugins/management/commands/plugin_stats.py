@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from plugins.metrics import circuit_states, load_snapshots, sum_gauges, summarize
+import json
+
+
+class Command(BaseCommand):
+    help = 'Show per-plugin invocation counts, errors and latency percentiles'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--plugin', help='Only show this plugin')
+        parser.add_argument('--json', action='store_true', help='Print raw JSON')
+    
+    def handle(self, *args, **options):
+        snapshots = load_snapshots()
+        rows = summarize(snapshots)
+        circuits = circuit_states(snapshots)
+        gauges = sum_gauges(snapshots)
+        if options['plugin']:
+            rows = [row for row in rows if row['plugin'] == options['plugin']]
+        
+        if options['json']:
+            self.stdout.write(json.dumps({'processes': len(snapshots), 'plugins': rows, 'circuits': circuits, 'gauges': gauges}, indent=2))
+            return
+        
+        if not rows:
+            self.stdout.write(self.style.WARNING('No plugin metrics recorded yet (is consume_events running?)'))
+            return
+        
+        self.stdout.write(self.style.SUCCESS(f'Plugin metrics from {len(snapshots)} consumer process(es)'))
+        header = f"{'PLUGIN':<24}{'EVENT':<28}{'CALLS':>8}{'ERR':>6}{'T/O':>6}{'P50':>10}{'P95':>10}{'P99':>10}{'MAX':>10}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in rows:
+            latency = row['latency_ms']
+            self.stdout.write(
+                f"{row['plugin']:<24}{row['event_type']:<28}{row['invocations']:>8}"
+                f"{row['errors']:>6}{row['timeouts']:>6}"
+                f"{latency['p50']:>10.2f}{latency['p95']:>10.2f}{latency['p99']:>10.2f}{latency['max']:>10.2f}"
+            )
+        self.stdout.write('(latencies in ms)')
+        
+        for plugin_name, state in sorted(circuits.items()):
+            if state != 'closed':
+                self.stdout.write(self.style.ERROR(f'Circuit {state}: {plugin_name}'))
+        
+        for name, value in gauges.items():
+            self.stdout.write(f'{name}: {value}')
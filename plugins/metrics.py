@@ -0,0 +1,268 @@
+from .circuit_breaker import CLOSED, HALF_OPEN, OPEN
+from bisect import bisect_left
+from django.conf import settings
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds in milliseconds: 0.1 ms to ~2 min, each 25% wider than
+# the previous, so any reported percentile is within 25% of the true value.
+BUCKET_BOUNDS_MS = tuple(0.1 * 1.25 ** i for i in range(64))
+
+METRICS_FILE_PREFIX = 'plugin-metrics-'
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list, for exact samples (benchmarks)"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class LatencyHistogram:
+    """Fixed log-spaced latency buckets; constant memory per series"""
+
+    def __init__(self, counts=None, total_ms=0.0, max_ms=0.0):
+        self.counts = counts or [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.total_ms = total_ms
+        self.max_ms = max_ms
+
+    def record(self, latency_ms):
+        self.counts[bisect_left(BUCKET_BOUNDS_MS, latency_ms)] += 1
+        self.total_ms += latency_ms
+        if latency_ms > self.max_ms:
+            self.max_ms = latency_ms
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th percentile, capped at the max"""
+        total = self.count
+        if not total:
+            return 0.0
+        rank = max(1, int(round(pct / 100 * total)))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                if index < len(BUCKET_BOUNDS_MS):
+                    return min(BUCKET_BOUNDS_MS[index], self.max_ms)
+                return self.max_ms
+        return self.max_ms
+
+
+class PluginMetrics:
+    """Per (plugin, event type) invocation, error and timeout counts plus latency.
+
+    Recording is in-process and cheap. The consumer process calls
+    ``enable_export`` so that a JSON snapshot is written to
+    PLUGIN_METRICS_DIR at most every PLUGIN_METRICS_EXPORT_SECONDS; the
+    metrics endpoint and ``plugin_stats`` merge those files, one per
+    consumer process.
+    """
+
+    def __init__(self):
+        self._series = {}  # (plugin, event_type) -> dict
+        self._circuits = {}  # plugin -> circuit breaker state
+        self._gauges = {}  # prefix -> callable returning {name: value}
+        self._lock = threading.Lock()
+        self._export_dir = None
+        self._last_export = 0.0
+
+    def _get_series(self, plugin_name, event_type):
+        key = (plugin_name, event_type)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = {
+                'invocations': 0, 'errors': 0, 'timeouts': 0, 'latency': LatencyHistogram()
+            }
+        return series
+
+    def record(self, plugin_name, event_type, latency_ms, error=False):
+        """Record one finished plugin invocation"""
+        with self._lock:
+            series = self._get_series(plugin_name, event_type)
+            series['invocations'] += 1
+            if error:
+                series['errors'] += 1
+            series['latency'].record(latency_ms)
+        self._maybe_export()
+
+    def record_timeout(self, plugin_name, event_type):
+        """Record that a plugin exceeded its time budget (its latency is recorded when it finishes)"""
+        with self._lock:
+            self._get_series(plugin_name, event_type)['timeouts'] += 1
+
+    def set_circuit_state(self, plugin_name, state):
+        with self._lock:
+            self._circuits[plugin_name] = state
+        # Breaker transitions are rare and operators want to see them quickly
+        self._last_export = 0.0
+
+    def register_gauges(self, prefix, read):
+        """Add gauges read at snapshot time; ``read`` returns {name: value}"""
+        self._gauges[prefix] = read
+
+    def read_gauges(self):
+        gauges = {}
+        for prefix, read in list(self._gauges.items()):
+            try:
+                for name, value in read().items():
+                    gauges[f'{prefix}.{name}'] = value
+            except Exception as e:
+                logger.warning(f"Could not read gauges {prefix}: {e}")
+        return gauges
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self._circuits.clear()
+
+    def snapshot(self):
+        """JSON-serialisable copy of all series"""
+        gauges = self.read_gauges()
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'generated_at': time.time(),
+                'series': [
+                    {
+                        'plugin': plugin_name,
+                        'event_type': event_type,
+                        'invocations': series['invocations'],
+                        'errors': series['errors'],
+                        'timeouts': series['timeouts'],
+                        'latency_counts': list(series['latency'].counts),
+                        'latency_total_ms': series['latency'].total_ms,
+                        'latency_max_ms': series['latency'].max_ms,
+                    }
+                    for (plugin_name, event_type), series in self._series.items()
+                ],
+                'circuits': dict(self._circuits),
+                'gauges': gauges
+            }
+
+    def enable_export(self, directory=None):
+        """Periodically write this process's snapshot for other processes to read"""
+        self._export_dir = directory or settings.PLUGIN_METRICS_DIR
+        os.makedirs(self._export_dir, exist_ok=True)
+
+    def _maybe_export(self):
+        if self._export_dir is None:
+            return
+        now = time.monotonic()
+        if now - self._last_export < settings.PLUGIN_METRICS_EXPORT_SECONDS:
+            return
+        self._last_export = now
+        self.export()
+
+    def export(self):
+        """Write the snapshot atomically to <dir>/plugin-metrics-<pid>.json"""
+        if self._export_dir is None:
+            return
+        path = os.path.join(self._export_dir, f'{METRICS_FILE_PREFIX}{os.getpid()}.json')
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.warning(f"Could not export plugin metrics: {e}")
+
+
+def load_snapshots(directory=None, max_age_seconds=None):
+    """Read the snapshots exported by consumer processes, skipping stale ones"""
+    directory = directory or settings.PLUGIN_METRICS_DIR
+    if max_age_seconds is None:
+        max_age_seconds = settings.PLUGIN_METRICS_STALE_SECONDS
+    snapshots = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return snapshots
+    now = time.time()
+    for name in names:
+        if not (name.startswith(METRICS_FILE_PREFIX) and name.endswith('.json')):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > max_age_seconds:
+                continue
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable metrics file {name}: {e}")
+    return snapshots
+
+
+def circuit_states(snapshots):
+    """Worst circuit state of each plugin across processes (open > half_open > closed)"""
+    severity = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+    states = {}
+    for snapshot in snapshots:
+        for plugin_name, state in snapshot.get('circuits', {}).items():
+            if severity.get(state, 0) >= severity.get(states.get(plugin_name), 0):
+                states[plugin_name] = state
+    return states
+
+
+def sum_gauges(snapshots):
+    """Gauges summed across processes (each process holds its own share of the state)"""
+    totals = {}
+    for snapshot in snapshots:
+        for name, value in snapshot.get('gauges', {}).items():
+            totals[name] = totals.get(name, 0) + value
+    return dict(sorted(totals.items()))
+
+
+def summarize(snapshots):
+    """Merge snapshots and compute per-series rates and percentiles"""
+    merged = {}
+    for snapshot in snapshots:
+        for series in snapshot['series']:
+            key = (series['plugin'], series['event_type'])
+            totals = merged.get(key)
+            if totals is None:
+                totals = merged[key] = {
+                    'invocations': 0, 'errors': 0, 'timeouts': 0, 'latency': LatencyHistogram()
+                }
+            totals['invocations'] += series['invocations']
+            totals['errors'] += series['errors']
+            totals['timeouts'] += series['timeouts']
+            totals['latency'].merge(LatencyHistogram(
+                list(series['latency_counts']), series['latency_total_ms'], series['latency_max_ms']
+            ))
+
+    rows = []
+    for (plugin_name, event_type), totals in sorted(merged.items()):
+        latency = totals['latency']
+        rows.append({
+            'plugin': plugin_name,
+            'event_type': event_type,
+            'invocations': totals['invocations'],
+            'errors': totals['errors'],
+            'timeouts': totals['timeouts'],
+            'latency_ms': {
+                'mean': round(latency.total_ms / latency.count, 3) if latency.count else 0.0,
+                'p50': round(latency.percentile(50), 3),
+                'p95': round(latency.percentile(95), 3),
+                'p99': round(latency.percentile(99), 3),
+                'max': round(latency.max_ms, 3),
+            },
+        })
+    return rows
+
+
+# Singleton instance
+plugin_metrics = PluginMetrics()
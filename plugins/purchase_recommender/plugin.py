@@ -48,15 +48,10 @@ class PurchaseRecommenderPlugin(BasePlugin):
         """Handle item added event and generate recommendations"""
         logger.info(f"[RECOMMENDER] handle_event called with event_type: {event_type}")
         
-        # Check if plugin is enabled
-        from plugins.models import PluginConfiguration
-        try:
-            plugin_config = PluginConfiguration.objects.get(name=self.name)
-            if not plugin_config.enabled:
-                logger.info(f"[RECOMMENDER] Plugin disabled, skipping event {event_type}")
-                return
-        except PluginConfiguration.DoesNotExist:
-            logger.warning(f"[RECOMMENDER] Plugin configuration not found, skipping event {event_type}")
+        # Check if plugin is enabled (cached registry snapshot, no query)
+        from plugins.registry import plugin_registry
+        if not plugin_registry.is_enabled(self.name):
+            logger.info(f"[RECOMMENDER] Plugin disabled, skipping event {event_type}")
             return
             
         if event_type == "item.added":
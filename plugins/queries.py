@@ -2,6 +2,7 @@ import strawberry
 from typing import List
 from .models import PluginConfiguration
 from .types import Plugin
+from .metrics import circuit_states, load_snapshots
 from .registry import plugin_registry
 import json
 
@@ -16,6 +17,10 @@ class PluginQueries:
         plugin_configs = PluginConfiguration.objects.all()
         config_dict = {config.name: config for config in plugin_configs}
         
+        # Circuit breakers live in the consumer processes, which export their state
+        # (plus this process's own), keeping the worst state of each plugin
+        circuits = circuit_states(load_snapshots() + [{'circuits': plugin_registry.get_circuit_states()}])
+        
         # Get all registered plugins
         for plugin_name, plugin_class in plugin_registry._plugins.items():
             config = config_dict.get(plugin_name)
@@ -35,7 +40,8 @@ class PluginQueries:
                 enabled=config.enabled if config else False,
                 description=config.description if config else getattr(plugin_class, 'description', ''),
                 config=json.dumps(config.config) if config and config.config else '{}',
-                supported_events=supported_events
+                supported_events=supported_events,
+                circuit_state=circuits.get(plugin_name, 'closed')
             ))
         
         return plugins
\ No newline at end of file
@@ -1,10 +1,29 @@
+from .base import AsyncBasePlugin
+from .circuit_breaker import CircuitBreaker
+from .dedup import event_key, get_dedup_store
+from .deferred import DeferredEvents
+from .metrics import plugin_metrics
 from .models import PluginConfiguration
+from asgiref.sync import async_to_sync, sync_to_async
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from django.conf import settings
+from django.db import close_old_connections
+from events.producer import partition_key
+import asyncio
+import json
 import logging
+import threading
 import time
-from collections import defaultdict
+from collections import Counter, defaultdict, namedtuple
 
 logger = logging.getLogger(__name__)
 
+# Control event published on KAFKA_CONTROL_TOPIC when any PluginConfiguration
+# changes, so every process drops its cached plugin snapshot
+PLUGIN_CONFIG_CHANGED = 'PLUGIN_CONFIG_CHANGED'
+
+PluginSnapshot = namedtuple('PluginSnapshot', ['version', 'plugins', 'enabled_names', 'handlers', 'source'])
+
 
 class PluginRegistry:
     _instance = None
@@ -13,94 +32,456 @@ class PluginRegistry:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._instance._processed_events = defaultdict(set)
-            cls._instance._cleanup_interval = 300  # 5 minutes
-            cls._instance._last_cleanup = time.time()
+            cls._instance._dedup = get_dedup_store()
+            cls._instance._snapshot = None
+            cls._instance._checked_at = 0.0
+            cls._instance._version = 0
+            cls._instance._snapshot_lock = threading.Lock()
+            cls._instance._dispatch_counts = Counter()
+            cls._instance._executor = None
+            cls._instance._breakers = {}  # plugin name -> CircuitBreaker
+            cls._instance._deferred = {}  # plugin name -> DeferredEvents
+            cls._instance._busy = {}  # plugin name -> future of a timed-out call still running
+            plugin_metrics.register_gauges('deferred', cls._instance._deferred_gauges)
         return cls._instance
     
     def register(self, plugin_class):
         """Register a plugin"""
         self._plugins[plugin_class.name] = plugin_class
+        self.invalidate()
         logger.info(f"Registered plugin: {plugin_class.name}")
     
-    def get_enabled_plugins(self):
-        """Get all enabled plugins with their configurations"""
-        enabled_configs = PluginConfiguration.objects.filter(enabled=True)
-        enabled_plugins = []
+    def invalidate(self):
+        """Drop the cached plugin snapshot; the next lookup rebuilds it"""
+        with self._snapshot_lock:
+            self._version += 1
+            replaced, self._snapshot = self._snapshot, None
+        self._close_plugins(replaced)
+    
+    def _close_plugins(self, snapshot):
+        """Release the resources of a snapshot's plugin instances once it is replaced"""
+        if snapshot is None:
+            return
+        for plugin in snapshot.plugins:
+            try:
+                plugin.close()
+            except Exception as e:
+                logger.error(f"Plugin {plugin.name} failed to close: {e}")
+    
+    def _fresh_snapshot(self):
+        """The cached snapshot if checked within PLUGIN_SNAPSHOT_MAX_AGE_SECONDS, else None"""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at <= settings.PLUGIN_SNAPSHOT_MAX_AGE_SECONDS:
+            return snapshot
+        return None
+    
+    def _get_snapshot(self):
+        """Return the enabled-plugin snapshot, loading it on first use.
         
+        A snapshot older than PLUGIN_SNAPSHOT_MAX_AGE_SECONDS is checked
+        against the database, so changes that sent no signal or control
+        event (``QuerySet.update``, a missed broadcast) still take effect;
+        plugins are only rebuilt if the enabled configurations differ.
+        """
+        fresh = self._fresh_snapshot()
+        if fresh is not None:
+            return fresh
+        
+        snapshot = self._snapshot
+        version = self._version
+        checked_at = time.monotonic()
+        enabled_configs = list(PluginConfiguration.objects.filter(enabled=True).order_by('id'))
+        source = tuple((config.name, json.dumps(config.config, sort_keys=True)) for config in enabled_configs)
+        if snapshot is not None and snapshot.source == source:
+            with self._snapshot_lock:
+                if self._version == version:
+                    self._checked_at = checked_at
+            return snapshot
+        
+        plugins = []
+        handlers = defaultdict(list)
         for config in enabled_configs:
             plugin_class = self._plugins.get(config.name)
             if plugin_class:
-                plugin_instance = plugin_class(config=config.config)
-                enabled_plugins.append(plugin_instance)
+                plugin = plugin_class(config=config.config)
+                plugins.append(plugin)
+                for event_type in plugin.get_supported_events():
+                    handlers[event_type].append(plugin)
         
-        return enabled_plugins
+        snapshot = PluginSnapshot(
+            version=version,
+            plugins=tuple(plugins),
+            enabled_names=frozenset(config.name for config in enabled_configs),
+            handlers={event_type: tuple(handled_by) for event_type, handled_by in handlers.items()},
+            source=source
+        )
+        replaced = None
+        with self._snapshot_lock:
+            # Only publish if no invalidation raced with the load
+            if self._version == version:
+                replaced, self._snapshot = self._snapshot, snapshot
+                self._checked_at = checked_at
+            elif self._snapshot is not None:
+                # A newer snapshot was published meanwhile; use it and drop ours
+                replaced, snapshot = snapshot, self._snapshot
+        self._close_plugins(replaced)
+        logger.info(f"Loaded plugin snapshot v{version}: {sorted(snapshot.enabled_names)}")
+        return snapshot
+    
+    def get_enabled_plugins(self):
+        """Get all enabled plugins with their configurations"""
+        return list(self._get_snapshot().plugins)
+    
+    def is_enabled(self, plugin_name):
+        """Check whether a plugin is enabled, using the cached snapshot"""
+        return plugin_name in self._get_snapshot().enabled_names
+    
+    def _accept(self, event_type, key):
+        """Drop duplicates; return False if the event stops here"""
+        return self._first_delivery(event_type, self._dedup.seen(key))
+    
+    async def _aaccept(self, event_type, key):
+        """Coroutine counterpart of _accept; a networked dedup store is queried off the event loop"""
+        if self._dedup.blocking:
+            seen = await asyncio.get_running_loop().run_in_executor(None, self._dedup.seen, key)
+        else:
+            seen = self._dedup.seen(key)
+        return self._first_delivery(event_type, seen)
+    
+    def _handled(self, results):
+        """True if every plugin handled the event (or shed it on purpose), so it can be marked.
+        
+        Events are only marked once handled: one whose handler failed, timed
+        out or was deferred, or whose consumer crashed first, must not be
+        dropped as a duplicate when Kafka delivers it again.
+        """
+        return bool(results) and all(outcome in ('ok', 'skipped') for outcome in results.values())
+    
+    def _mark(self, event_type, key):
+        try:
+            self._dedup.mark(key)
+        except Exception as e:
+            logger.error(f"Could not record {event_type} as handled for deduplication: {e}")
+    
+    def _first_delivery(self, event_type, seen):
+        # Skip events already processed recently (redelivery after rebalance/retry)
+        if seen:
+            logger.info(f"Skipping duplicate event: {event_type}")
+            return False
+        return True
+    
+    def _handlers_for(self, snapshot, event_type):
+        # Single lookup in the event_type -> plugins table built with the snapshot
+        handlers = snapshot.handlers.get(event_type, ())
+        logger.debug(f"Routing {event_type} to {len(handlers)} plugins")
+        
+        for plugin in handlers:
+            self._dispatch_counts[plugin.name] += 1
+        return handlers
     
     def route_event(self, event_type, event_data):
-        """Route event to all enabled plugins that can handle it"""
-        # Create event signature for deduplication
-        event_signature = self._create_event_signature(event_type, event_data)
+        """Route event to all enabled plugins that can handle it.
+        
+        Returns a dict of plugin name -> 'ok', 'error' or 'timeout', or
+        'skipped'/'deferred' for plugins whose circuit breaker is open or
+        whose previous timed-out call is still running.
+        """
+        key = event_key(event_type, event_data)
+        if not self._accept(event_type, key):
+            return {}
+        
+        handlers = self._handlers_for(self._get_snapshot(), event_type)
+        results = {}
+        handlers = self._shed_open_circuits(handlers, event_type, event_data, results)
+        
+        # Plugins run on the executor, concurrently, each within its own time
+        # budget; a lone handler too, so a hung plugin cannot stall the consumer
+        started = time.monotonic()
+        executor = self._get_executor()
+        futures = [
+            (plugin, executor.submit(self._run_pooled, plugin, event_type, event_data))
+            for plugin in handlers
+        ]
+        for plugin, future in futures:
+            remaining = self._timeout_for(plugin) - (time.monotonic() - started)
+            try:
+                results[plugin.name] = future.result(timeout=max(remaining, 0))
+            except FutureTimeoutError:
+                results[plugin.name] = 'timeout'
+                plugin_metrics.record_timeout(plugin.name, event_type)
+                logger.warning(f"Plugin {plugin.name} timed out on {event_type} after {self._timeout_for(plugin)}s")
+                self._mark_busy(plugin, future)
+            self._record_outcome(plugin, results[plugin.name])
+        if self._handled(results):
+            self._mark(event_type, key)
+        return results
+    
+    async def aroute_event(self, event_type, event_data):
+        """Asyncio variant of route_event.
+        
+        Async plugins are awaited directly and sync plugins run in the plugin
+        executor; all handlers of the event run concurrently, each within its
+        time budget.
+        """
+        key = event_key(event_type, event_data)
+        if not await self._aaccept(event_type, key):
+            return {}
+        
+        # The database is only queried, off the event loop, when the snapshot is missing or stale
+        snapshot = self._fresh_snapshot()
+        if snapshot is None:
+            snapshot = await sync_to_async(self._get_snapshot)()
+        handlers = self._handlers_for(snapshot, event_type)
+        results = {}
+        handlers = self._shed_open_circuits(handlers, event_type, event_data, results)
+        
+        loop = asyncio.get_running_loop()
         
-        # Check if we've already processed this exact event recently
-        if event_signature in self._processed_events[event_type]:
-            logger.info(f"Skipping duplicate event: {event_type} - {event_signature[:16]}...")
+        async def run(plugin):
+            future = None
+            if isinstance(plugin, AsyncBasePlugin) and self._no_deferred(plugin):
+                # Cancelled on timeout, so nothing is left running
+                call = self._arun_plugin(plugin, event_type, event_data)
+            else:
+                future = self._get_executor().submit(self._run_pooled, plugin, event_type, event_data)
+                call = asyncio.wrap_future(future, loop=loop)
+            try:
+                return await asyncio.wait_for(call, timeout=self._timeout_for(plugin))
+            except asyncio.TimeoutError:
+                logger.warning(f"Plugin {plugin.name} timed out on {event_type} after {self._timeout_for(plugin)}s")
+                plugin_metrics.record_timeout(plugin.name, event_type)
+                if future is not None:
+                    self._mark_busy(plugin, future)
+                return 'timeout'
+        
+        outcomes = await asyncio.gather(*(run(plugin) for plugin in handlers))
+        for plugin, outcome in zip(handlers, outcomes):
+            results[plugin.name] = outcome
+            self._record_outcome(plugin, outcome)
+        if self._handled(results):
+            if self._dedup.blocking:
+                await loop.run_in_executor(None, self._mark, event_type, key)
+            else:
+                self._mark(event_type, key)
+        return results
+    
+    def _breaker_for(self, plugin):
+        """The plugin's circuit breaker, kept across snapshot reloads"""
+        breaker = self._breakers.get(plugin.name)
+        if breaker is None:
+            breaker = self._breakers.setdefault(
+                plugin.name, CircuitBreaker(plugin.name, on_change=plugin_metrics.set_circuit_state)
+            )
+        breaker.configure(
+            plugin.config.get('circuit_failure_threshold', settings.PLUGIN_CIRCUIT_FAILURE_THRESHOLD),
+            plugin.config.get('circuit_recovery_seconds', settings.PLUGIN_CIRCUIT_RECOVERY_SECONDS)
+        )
+        return breaker
+    
+    def _mark_busy(self, plugin, future):
+        """Remember a timed-out call that is still running on the executor"""
+        def release(done):
+            if self._busy.get(plugin.name) is done:
+                self._busy.pop(plugin.name, None)
+        
+        self._busy[plugin.name] = future
+        future.add_done_callback(release)
+    
+    def _is_busy(self, plugin):
+        future = self._busy.get(plugin.name)
+        return future is not None and not future.done()
+    
+    def _shed_open_circuits(self, handlers, event_type, event_data, results):
+        """Drop plugins whose circuit is open, skipping or deferring their event.
+        
+        A plugin whose timed-out call is still running is shed the same way
+        and charged a failure: a second call could overtake the first for
+        the same basket, and each stuck call holds an executor thread.
+        """
+        allowed = []
+        for plugin in handlers:
+            breaker = self._breaker_for(plugin)
+            if self._is_busy(plugin):
+                breaker.record_failure()
+                logger.warning(f"Plugin {plugin.name} is still running a timed-out call, shedding {event_type}")
+            elif breaker.allow():
+                allowed.append(plugin)
+                continue
+            if plugin.config.get('circuit_open_action') == 'defer':
+                self._deferred_for(plugin).add(self._deferred_key(event_data), event_type, event_data)
+                results[plugin.name] = 'deferred'
+            else:
+                results[plugin.name] = 'skipped'
+        return allowed
+    
+    def _deferred_for(self, plugin):
+        deferred = self._deferred.get(plugin.name)
+        if deferred is None:
+            deferred = self._deferred.setdefault(
+                plugin.name, DeferredEvents(plugin.name, settings.PLUGIN_DEFERRED_MAX_EVENTS)
+            )
+        return deferred
+    
+    def _deferred_key(self, event_data):
+        # Same ordering key as the consumer's worker routing
+        return event_data.get('basket_id') or partition_key(event_data) or ''
+    
+    def _no_deferred(self, plugin):
+        deferred = self._deferred.get(plugin.name)
+        return deferred is None or deferred.idle()
+    
+    def has_deferred(self):
+        """True while any plugin holds deferred events; their offsets must not be committed yet"""
+        return any(not deferred.idle() for deferred in list(self._deferred.values()))
+    
+    def _deferred_gauges(self):
+        gauges = {}
+        for name, deferred in list(self._deferred.items()):
+            gauges[f'{name}.queued'] = len(deferred)
+            gauges[f'{name}.dropped'] = deferred.dropped
+        return gauges
+    
+    def _record_outcome(self, plugin, outcome):
+        if outcome == 'deferred':
             return
+        breaker = self._breakers[plugin.name]
+        if outcome == 'ok':
+            if breaker.record_success() and not self._no_deferred(plugin):
+                self._get_executor().submit(self._replay_deferred, plugin)
+        else:
+            breaker.record_failure()
+    
+    def _run_in_order(self, plugin, event_type, event_data):
+        """Run the plugin on an event, first replaying the events of its key deferred earlier.
         
-        # Add to processed events
-        self._processed_events[event_type].add(event_signature)
-        
-        # Cleanup old events periodically
-        self._cleanup_old_events()
-        
-        enabled_plugins = self.get_enabled_plugins()
-        logger.info(f"Routing {event_type} to {len(enabled_plugins)} enabled plugins")
-        
-        for plugin in enabled_plugins:
-            logger.info(f"Checking plugin {plugin.name} for {event_type} - can_handle: {plugin.can_handle(event_type)}")
-            if plugin.can_handle(event_type):
-                try:
-                    plugin.handle_event(event_type, event_data)
-                    logger.info(f"Plugin {plugin.name} handled event {event_type}")
-                except Exception as e:
-                    logger.error(f"Plugin {plugin.name} failed to handle event: {e}")
-    
-    def _create_event_signature(self, event_type, event_data):
-        """Create a unique signature for event deduplication"""
-        import hashlib
-        import json
-        
-        # Create signature from event type and key data fields
-        signature_data = {
-            'event_type': event_type,
-            'timestamp': event_data.get('timestamp'),
-            'basket_id': event_data.get('basket_id'),
-            'employee_id': event_data.get('employee_id'),
-            'terminal_id': event_data.get('terminal_id')
-        }
-        
-        # Add event-specific fields for better deduplication
-        if event_type == 'age.verified':
-            signature_data.update({
-                'customer_age': event_data.get('customer_age'),
-                'verifier_employee_id': event_data.get('verifier_employee_id')
-            })
-        elif event_type == 'item.added':
-            signature_data.update({
-                'product_id': event_data.get('product_id'),
-                'quantity': event_data.get('quantity')
-            })
-        
-        signature_str = json.dumps(signature_data, sort_keys=True)
-        return hashlib.md5(signature_str.encode()).hexdigest()
-    
-    def _cleanup_old_events(self):
-        """Clean up old processed events to prevent memory leaks"""
-        current_time = time.time()
-        if current_time - self._last_cleanup > self._cleanup_interval:
-            # Clear all processed events older than cleanup interval
-            self._processed_events.clear()
-            self._last_cleanup = current_time
-            logger.info("Cleaned up old processed events")
+        If the circuit opens again during the replay, the rest of the key's
+        events and this one are deferred again, in order.
+        """
+        if self._no_deferred(plugin):
+            return self._run_plugin(plugin, event_type, event_data)
+        
+        deferred = self._deferred_for(plugin)
+        key = self._deferred_key(event_data)
+        pending = deferred.claim(key)
+        if pending is None:
+            return self._run_plugin(plugin, event_type, event_data)
+        
+        pending.append((event_type, event_data))
+        return self._replay_claimed(plugin, deferred, key, pending, allowed=True)
+    
+    def _replay_claimed(self, plugin, deferred, key, pending, allowed=False):
+        """Run a claimed key's events in order while the circuit allows; returns the last outcome"""
+        breaker = self._breakers[plugin.name]
+        outcome = 'deferred'
+        try:
+            while pending:
+                if outcome != 'deferred':
+                    self._record_outcome(plugin, outcome)
+                if not allowed and not breaker.allow():
+                    outcome = 'deferred'
+                    break
+                allowed = False
+                outcome = self._run_plugin(plugin, *pending.popleft())
+        finally:
+            deferred.release(key, pending)
+        return outcome
+    
+    def _replay_deferred(self, plugin):
+        """Hand events deferred while the circuit was open back to the recovered plugin, key by key"""
+        close_old_connections()
+        deferred = self._deferred_for(plugin)
+        replayed = 0
+        for key in deferred.keys():
+            pending = deferred.claim(key)
+            if pending is None:
+                continue
+            count = len(pending)
+            outcome = self._replay_claimed(plugin, deferred, key, pending)
+            self._record_outcome(plugin, outcome)
+            replayed += count - len(pending)
+            if outcome == 'deferred':
+                break
+        logger.info(f"Replayed {replayed} deferred events to plugin {plugin.name}")
+    
+    def _run_plugin(self, plugin, event_type, event_data):
+        """Run one plugin, record its latency and report 'ok' or 'error'"""
+        started = time.perf_counter()
+        outcome = 'ok'
+        try:
+            if isinstance(plugin, AsyncBasePlugin):
+                async_to_sync(plugin.handle_event)(event_type, event_data)
+            else:
+                plugin.handle_event(event_type, event_data)
+        except Exception as e:
+            logger.error(f"Plugin {plugin.name} failed to handle event: {e}")
+            outcome = 'error'
+        plugin_metrics.record(
+            plugin.name, event_type, (time.perf_counter() - started) * 1000, error=outcome == 'error'
+        )
+        return outcome
+    
+    async def _arun_plugin(self, plugin, event_type, event_data):
+        """Coroutine counterpart of _run_plugin for async plugins"""
+        started = time.perf_counter()
+        outcome = 'ok'
+        try:
+            await plugin.handle_event(event_type, event_data)
+        except Exception as e:
+            logger.error(f"Plugin {plugin.name} failed to handle event: {e}")
+            outcome = 'error'
+        plugin_metrics.record(
+            plugin.name, event_type, (time.perf_counter() - started) * 1000, error=outcome == 'error'
+        )
+        return outcome
+    
+    def _run_pooled(self, plugin, event_type, event_data):
+        close_old_connections()
+        return self._run_in_order(plugin, event_type, event_data)
+    
+    def _timeout_for(self, plugin):
+        """Per-plugin time budget from PluginConfiguration.config"""
+        return plugin.config.get('handler_timeout_seconds', settings.PLUGIN_HANDLER_TIMEOUT_SECONDS)
+    
+    def _get_executor(self):
+        if self._executor is None:
+            with self._snapshot_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=settings.PLUGIN_EXECUTOR_WORKERS,
+                        thread_name_prefix='plugin'
+                    )
+        return self._executor
+    
+    def get_handlers(self, event_type):
+        """Return the enabled plugins that handle an event type"""
+        return list(self._get_snapshot().handlers.get(event_type, ()))
+    
+    def flush(self):
+        """Flush buffered work of every enabled plugin; returns False if any plugin failed"""
+        flushed = True
+        for plugin in self.get_enabled_plugins():
+            try:
+                plugin.flush()
+            except Exception as e:
+                logger.error(f"Plugin {plugin.name} failed to flush: {e}")
+                flushed = False
+        return flushed
+    
+    def partitions_assigned(self):
+        """Let every enabled plugin drop per-basket caches after a consumer rebalance"""
+        for plugin in self.get_enabled_plugins():
+            try:
+                plugin.on_partitions_assigned()
+            except Exception as e:
+                logger.error(f"Plugin {plugin.name} failed to handle a rebalance: {e}")
+    
+    def get_circuit_states(self):
+        """Return the circuit breaker state of each plugin that has handled events"""
+        return {name: breaker.state for name, breaker in self._breakers.items()}
+    
+    def get_dispatch_counts(self):
+        """Return how many events each plugin has been given"""
+        return dict(self._dispatch_counts)
 
 
 # Singleton instance
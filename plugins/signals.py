@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from events.control import control_listener
+from events.outbox import enqueue_event
+from .models import PluginConfiguration
+from .registry import plugin_registry, PLUGIN_CONFIG_CHANGED
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=PluginConfiguration)
+@receiver(post_delete, sender=PluginConfiguration)
+def plugin_configuration_changed(sender, instance, **kwargs):
+    """Refresh this process's plugin snapshot and tell every other process"""
+    plugin_registry.invalidate()
+    enqueue_event(settings.KAFKA_CONTROL_TOPIC, {
+        'event_type': PLUGIN_CONFIG_CHANGED,
+        'timestamp': timezone.now().isoformat(),
+        'plugin': instance.name,
+        'enabled': instance.enabled
+    })
+
+
+def plugin_configuration_changed_elsewhere(event_data):
+    plugin_registry.invalidate()
+    logger.info(f"Plugin configuration changed ({event_data.get('plugin')}), snapshot invalidated")
+
+
+control_listener.register(PLUGIN_CONFIG_CHANGED, plugin_configuration_changed_elsewhere)
@@ -1,3 +1,451 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from unittest.mock import patch
+import asyncio
+import shutil
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from events.control import control_listener
+from events.models import OutboxEvent
+from plugins.base import AsyncBasePlugin, BasePlugin
+from plugins.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from plugins.dedup import InMemoryDedupStore, event_key
+from plugins.deferred import DeferredEvents
+from plugins.metrics import LatencyHistogram, PluginMetrics, plugin_metrics, summarize
+from plugins.models import PluginConfiguration
+from plugins.registry import PluginRegistry, PLUGIN_CONFIG_CHANGED
+
+
+class RecordingPlugin(BasePlugin):
+    name = "recording"
+    description = "Records handled events"
+    handled = []
+
+    def get_supported_events(self):
+        return ["item.added"]
+
+    def handle_event(self, event_type, event_data):
+        self.handled.append((event_type, event_data.get('basket_id')))
+
+
+class SlowPlugin(BasePlugin):
+    name = "slow"
+    description = "Blocks longer than its time budget"
+
+    def get_supported_events(self):
+        return ["item.added"]
+
+    def handle_event(self, event_type, event_data):
+        time.sleep(0.5)
+
+
+class FailingPlugin(BasePlugin):
+    name = "failing"
+    description = "Always raises"
+
+    def get_supported_events(self):
+        return ["item.added"]
+
+    def handle_event(self, event_type, event_data):
+        raise RuntimeError('boom')
+
+
+class AsyncRecordingPlugin(AsyncBasePlugin):
+    name = "async_recording"
+    description = "Records handled events from a coroutine"
+    handled = []
+
+    def get_supported_events(self):
+        return ["item.added"]
+
+    async def handle_event(self, event_type, event_data):
+        await asyncio.sleep(0)
+        self.handled.append((event_type, event_data.get('basket_id')))
+
+
+class PluginRegistryTest(TestCase):
+
+    def setUp(self):
+        """Set up test data"""
+        self.plugin_config = PluginConfiguration.objects.create(
+            name='recording',
+            enabled=True,
+            config={}
+        )
+        self.registry = PluginRegistry()
+        self.registry.register(RecordingPlugin)
+        self.addCleanup(self.registry.invalidate)
+        self.addCleanup(self.registry._plugins.pop, 'recording', None)
+        self.addCleanup(self.registry._busy.clear)
+        self.addCleanup(self.registry._breakers.clear)
+        RecordingPlugin.handled = []
+
+    def test_routing_uses_cached_snapshot(self):
+        """Test warm routing runs no configuration queries"""
+        self.registry.get_enabled_plugins()
+
+        with self.assertNumQueries(0):
+            self.registry.route_event('item.added', {'basket_id': 'BASKET-1', 'timestamp': 't1'})
+
+        self.assertEqual(RecordingPlugin.handled, [('item.added', 'BASKET-1')])
+
+    def test_dispatch_table_routes_by_event_type(self):
+        """Test only plugins supporting the event type are dispatched to"""
+        self.assertEqual([p.name for p in self.registry.get_handlers('item.added')], ['recording'])
+        self.assertEqual(self.registry.get_handlers('EMPLOYEE_LOGIN'), [])
+
+        before = self.registry.get_dispatch_counts().get('recording', 0)
+        self.registry.route_event('EMPLOYEE_LOGIN', {'employee_id': 1, 'timestamp': 't3'})
+        self.registry.route_event('item.added', {'basket_id': 'BASKET-2', 'timestamp': 't3'})
+
+        self.assertEqual(RecordingPlugin.handled, [('item.added', 'BASKET-2')])
+        self.assertEqual(self.registry.get_dispatch_counts()['recording'], before + 1)
+
+    def test_plugins_run_concurrently_with_timeouts(self):
+        """Test a slow or failing plugin is reported without blocking the others"""
+        PluginConfiguration.objects.create(name='slow', enabled=True, config={'handler_timeout_seconds': 0.1})
+        PluginConfiguration.objects.create(name='failing', enabled=True, config={})
+        for plugin_class in (SlowPlugin, FailingPlugin):
+            self.registry.register(plugin_class)
+            self.addCleanup(self.registry._plugins.pop, plugin_class.name, None)
+
+        started = time.monotonic()
+        results = self.registry.route_event('item.added', {'basket_id': 'BASKET-3', 'timestamp': 't4'})
+
+        self.assertLess(time.monotonic() - started, 0.45)
+        self.assertEqual(results, {'recording': 'ok', 'slow': 'timeout', 'failing': 'error'})
+        self.assertEqual(RecordingPlugin.handled, [('item.added', 'BASKET-3')])
+
+    def test_lone_handler_runs_within_its_time_budget(self):
+        """Test an event with a single handler still times out instead of stalling the caller"""
+        self.plugin_config.enabled = False
+        self.plugin_config.save()
+        PluginConfiguration.objects.create(name='slow', enabled=True, config={'handler_timeout_seconds': 0.1})
+        self.registry.register(SlowPlugin)
+        self.addCleanup(self.registry._plugins.pop, 'slow', None)
+
+        started = time.monotonic()
+        results = self.registry.route_event('item.added', {'basket_id': 'BASKET-3', 'timestamp': 't5'})
+
+        self.assertLess(time.monotonic() - started, 0.45)
+        self.assertEqual(results, {'slow': 'timeout'})
+
+    def test_timed_out_plugin_is_not_called_again_until_it_returns(self):
+        """Test a plugin still running a timed-out call is shed and charged a failure"""
+        PluginConfiguration.objects.create(name='slow', enabled=True, config={'handler_timeout_seconds': 0.1})
+        self.registry.register(SlowPlugin)
+        self.addCleanup(self.registry._plugins.pop, 'slow', None)
+
+        first = self.registry.route_event('item.added', {'basket_id': 'BASKET-4', 'timestamp': 't1'})
+        second = self.registry.route_event('item.added', {'basket_id': 'BASKET-4', 'timestamp': 't2'})
+
+        self.assertEqual((first['slow'], second['slow']), ('timeout', 'skipped'))
+        self.assertEqual(second['recording'], 'ok')
+        self.assertEqual(self.registry._breakers['slow'].consecutive_failures, 2)
+
+        time.sleep(0.5)
+        third = self.registry.route_event('item.added', {'basket_id': 'BASKET-4', 'timestamp': 't3'})
+        self.assertEqual(third['slow'], 'timeout')
+
+    def test_aroute_event_runs_async_and_sync_plugins(self):
+        """Test the asyncio path awaits async plugins and runs sync plugins alongside"""
+        PluginConfiguration.objects.create(name='async_recording', enabled=True, config={})
+        self.registry.register(AsyncRecordingPlugin)
+        self.addCleanup(self.registry._plugins.pop, 'async_recording', None)
+        AsyncRecordingPlugin.handled = []
+        self.registry.get_enabled_plugins()
+
+        results = async_to_sync(self.registry.aroute_event)('item.added', {'basket_id': 'BASKET-5', 'timestamp': 't5'})
+
+        self.assertEqual(results, {'recording': 'ok', 'async_recording': 'ok'})
+        self.assertEqual(RecordingPlugin.handled, [('item.added', 'BASKET-5')])
+        self.assertEqual(AsyncRecordingPlugin.handled, [('item.added', 'BASKET-5')])
+
+    def test_only_handled_events_are_deduplicated(self):
+        """Test an event is dropped as a duplicate only after its plugins handled it"""
+        PluginConfiguration.objects.create(name='failing', enabled=True, config={'circuit_failure_threshold': 5})
+        self.registry.register(FailingPlugin)
+        self.addCleanup(self.registry._plugins.pop, 'failing', None)
+        self.addCleanup(self.registry._dedup.clear)
+        event = {'basket_id': 'BASKET-10', 'timestamp': 't1'}
+
+        # Redelivered after a failure: handled again
+        self.assertEqual(self.registry.route_event('item.added', event), {'recording': 'ok', 'failing': 'error'})
+        self.assertEqual(self.registry.route_event('item.added', event), {'recording': 'ok', 'failing': 'error'})
+
+        # Redelivered after success: dropped
+        PluginConfiguration.objects.filter(name='failing').delete()
+        self.registry.invalidate()
+        self.assertEqual(self.registry.route_event('item.added', event), {'recording': 'ok'})
+        self.assertEqual(self.registry.route_event('item.added', event), {})
+        self.assertEqual(len(RecordingPlugin.handled), 3)
+
+    def test_aroute_event_queries_blocking_dedup_store_off_the_loop(self):
+        """Test a networked dedup store is not called on the event loop thread"""
+        loop_threads, store_threads = [], []
+
+        class NetworkDedupStore:
+            blocking = True
+
+            def seen(self, key):
+                store_threads.append(threading.get_ident())
+                return False
+
+            def mark(self, key):
+                store_threads.append(threading.get_ident())
+
+        async def route():
+            loop_threads.append(threading.get_ident())
+            return await self.registry.aroute_event('item.added', {'basket_id': 'BASKET-5', 'timestamp': 't9'})
+
+        self.registry.get_enabled_plugins()
+        with patch.object(self.registry, '_dedup', NetworkDedupStore()):
+            results = async_to_sync(route)()
+
+        self.assertEqual(results, {'recording': 'ok'})
+        self.assertEqual(len(store_threads), 2)
+        self.assertNotIn(loop_threads[0], store_threads)
+
+    def test_route_event_drives_async_plugin(self):
+        """Test the synchronous path still runs an async plugin"""
+        PluginConfiguration.objects.create(name='async_recording', enabled=True, config={})
+        self.registry.register(AsyncRecordingPlugin)
+        self.addCleanup(self.registry._plugins.pop, 'async_recording', None)
+        AsyncRecordingPlugin.handled = []
+
+        results = self.registry.route_event('item.added', {'basket_id': 'BASKET-6', 'timestamp': 't6'})
+
+        self.assertEqual(results['async_recording'], 'ok')
+        self.assertEqual(AsyncRecordingPlugin.handled, [('item.added', 'BASKET-6')])
+
+    def test_route_event_records_plugin_metrics(self):
+        """Test invocations, errors and latency are recorded per plugin and event type"""
+        PluginConfiguration.objects.create(name='failing', enabled=True, config={})
+        self.registry.register(FailingPlugin)
+        self.addCleanup(self.registry._plugins.pop, 'failing', None)
+        plugin_metrics.reset()
+        self.addCleanup(plugin_metrics.reset)
+
+        self.registry.route_event('item.added', {'basket_id': 'BASKET-7', 'timestamp': 't7'})
+        self.registry.route_event('item.added', {'basket_id': 'BASKET-7', 'timestamp': 't8'})
+
+        rows = {row['plugin']: row for row in summarize([plugin_metrics.snapshot()])}
+        self.assertEqual(rows['recording']['invocations'], 2)
+        self.assertEqual(rows['recording']['errors'], 0)
+        self.assertEqual(rows['failing']['errors'], 2)
+        self.assertEqual(rows['failing']['event_type'], 'item.added')
+
+    def test_metrics_endpoint_merges_exported_snapshots(self):
+        """Test the endpoint reports snapshots exported by consumer processes"""
+        metrics = PluginMetrics()
+        metrics.record('recording', 'item.added', 3.0)
+        metrics.record('recording', 'item.added', 7.0, error=True)
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        metrics.enable_export(metrics_dir)
+        metrics.export()
+
+        with override_settings(PLUGIN_METRICS_DIR=metrics_dir):
+            response = self.client.get('/plugins/metrics/')
+
+        self.assertEqual(response.status_code, 200)
+        row = response.json()['plugins'][0]
+        self.assertEqual((row['plugin'], row['invocations'], row['errors']), ('recording', 2, 1))
+        self.assertEqual(row['latency_ms']['max'], 7.0)
+
+    def test_failing_plugin_circuit_opens_and_sheds_events(self):
+        """Test repeated failures open the circuit and later events skip the plugin"""
+        PluginConfiguration.objects.create(name='failing', enabled=True, config={'circuit_failure_threshold': 2})
+        self.registry.register(FailingPlugin)
+        self.addCleanup(self.registry._plugins.pop, 'failing', None)
+        self.addCleanup(self.registry._breakers.pop, 'failing', None)
+
+        outcomes = [
+            self.registry.route_event('item.added', {'basket_id': 'BASKET-8', 'timestamp': f't{i}'})['failing']
+            for i in range(3)
+        ]
+
+        self.assertEqual(outcomes, ['error', 'error', 'skipped'])
+        self.assertEqual(self.registry.get_circuit_states()['failing'], OPEN)
+        self.assertEqual(len(RecordingPlugin.handled), 3)
+
+    def test_open_circuit_defers_events_until_recovery(self):
+        """Test deferred events are replayed in order before later events of their basket"""
+        self.plugin_config.config = {
+            'circuit_open_action': 'defer', 'circuit_failure_threshold': 1, 'circuit_recovery_seconds': 0.05
+        }
+        self.plugin_config.save()
+        self.addCleanup(self.registry._breakers.pop, 'recording', None)
+        self.addCleanup(self.registry._deferred.pop, 'recording', None)
+        breaker = self.registry._breaker_for(self.registry.get_handlers('item.added')[0])
+        breaker.record_failure()
+        record_timestamp = lambda plugin, event_type, event_data: plugin.handled.append(event_data['timestamp'])
+        self.enterContext(patch.object(RecordingPlugin, 'handle_event', autospec=True, side_effect=record_timestamp))
+
+        result = self.registry.route_event('item.added', {'basket_id': 'BASKET-9', 'timestamp': 't9'})
+        self.assertEqual(result, {'recording': 'deferred'})
+        self.registry.route_event('item.added', {'basket_id': 'BASKET-8', 'timestamp': 't8'})
+        self.assertEqual(RecordingPlugin.handled, [])
+        self.assertTrue(self.registry.has_deferred())
+
+        time.sleep(0.06)
+        result = self.registry.route_event('item.added', {'basket_id': 'BASKET-9', 'timestamp': 't10'})
+        self.assertEqual(result, {'recording': 'ok'})
+        self.assertEqual(breaker.state, CLOSED)
+
+        # Other baskets are replayed alongside on the plugin executor
+        self.registry._get_executor().shutdown(wait=True)
+        self.registry._executor = None
+
+        self.assertEqual(sorted(RecordingPlugin.handled), ['t10', 't8', 't9'])
+        self.assertLess(RecordingPlugin.handled.index('t9'), RecordingPlugin.handled.index('t10'))
+        self.assertFalse(self.registry.has_deferred())
+
+    def test_config_save_refreshes_snapshot(self):
+        """Test saving a configuration invalidates the snapshot"""
+        self.assertTrue(self.registry.is_enabled('recording'))
+
+        self.plugin_config.enabled = False
+        self.plugin_config.save()
+
+        self.assertFalse(self.registry.is_enabled('recording'))
+        self.assertTrue(OutboxEvent.objects.filter(
+            event_type=PLUGIN_CONFIG_CHANGED, topic=settings.KAFKA_CONTROL_TOPIC
+        ).exists())
+
+    def test_control_event_invalidates_snapshot(self):
+        """Test the control event from another process forces a reload"""
+        self.assertTrue(self.registry.is_enabled('recording'))
+        PluginConfiguration.objects.filter(name='recording').update(enabled=False)
+        self.assertTrue(self.registry.is_enabled('recording'))
+
+        control_listener.dispatch({'event_type': PLUGIN_CONFIG_CHANGED, 'plugin': 'recording'})
+
+        self.assertFalse(self.registry.is_enabled('recording'))
+
+    def test_aroute_event_rechecks_stale_snapshot(self):
+        """Test the asyncio path picks up changes that sent no signal once the snapshot is stale"""
+        self.registry.get_enabled_plugins()
+        PluginConfiguration.objects.filter(name='recording').update(enabled=False)
+        event = {'basket_id': 'BASKET-11', 'timestamp': 't1'}
+
+        self.assertEqual(async_to_sync(self.registry.aroute_event)('item.added', event), {'recording': 'ok'})
+
+        with override_settings(PLUGIN_SNAPSHOT_MAX_AGE_SECONDS=0):
+            event = {'basket_id': 'BASKET-11', 'timestamp': 't2'}
+            self.assertEqual(async_to_sync(self.registry.aroute_event)('item.added', event), {})
+
+    def test_replaced_plugin_instances_are_closed(self):
+        """Test a reload closes the previous snapshot's instances but not the current ones"""
+        old = self.registry.get_enabled_plugins()[0]
+
+        with patch.object(RecordingPlugin, 'close', autospec=True) as mock_close:
+            self.plugin_config.config = {'handler_timeout_seconds': 2}
+            self.plugin_config.save()
+            new = self.registry.get_enabled_plugins()[0]
+
+        self.assertIsNot(new, old)
+        mock_close.assert_called_once_with(old)
+
+
+class DeferredEventsTest(SimpleTestCase):
+
+    def test_events_of_a_key_come_back_in_order(self):
+        """Test unhandled events are re-queued ahead of events added during the replay"""
+        deferred = DeferredEvents('recording')
+        deferred.add('BASKET-1', 'item.added', {'timestamp': 't1'})
+        deferred.add('BASKET-1', 'item.added', {'timestamp': 't2'})
+
+        pending = deferred.claim('BASKET-1')
+        pending.popleft()
+        deferred.add('BASKET-1', 'item.added', {'timestamp': 't3'})
+        self.assertFalse(deferred.idle())
+        deferred.release('BASKET-1', pending)
+
+        self.assertEqual(
+            [event_data['timestamp'] for _, event_data in deferred.claim('BASKET-1')], ['t2', 't3']
+        )
+
+    def test_overflow_drops_oldest_and_counts(self):
+        """Test the oldest event is dropped once the cap is reached"""
+        deferred = DeferredEvents('recording', max_events=2)
+        for i in range(3):
+            deferred.add(f'BASKET-{i}', 'item.added', {'timestamp': f't{i}'})
+
+        self.assertEqual(len(deferred), 2)
+        self.assertEqual(deferred.dropped, 1)
+        self.assertEqual(deferred.keys(), ['BASKET-1', 'BASKET-2'])
+
+
+class InMemoryDedupStoreTest(SimpleTestCase):
+
+    def test_duplicate_detected_until_expiry(self):
+        """Test keys are reported as seen only once marked and while within the TTL"""
+        store = InMemoryDedupStore(ttl_seconds=10)
+        key = event_key('item.added', {'basket_id': 'B1', 'product_id': 'P1', 'timestamp': 't'})
+
+        with patch('plugins.dedup.time.monotonic', return_value=100.0):
+            self.assertFalse(store.seen(key))
+            self.assertFalse(store.seen(key))
+            store.mark(key)
+            self.assertTrue(store.seen(key))
+
+        with patch('plugins.dedup.time.monotonic', return_value=111.0):
+            self.assertFalse(store.seen(key))
+
+    def test_memory_cap_evicts_oldest(self):
+        """Test the store never holds more than max_entries keys"""
+        store = InMemoryDedupStore(ttl_seconds=300, max_entries=3)
+        for i in range(5):
+            store.mark(event_key('item.added', {'basket_id': f'B{i}'}))
+
+        self.assertEqual(len(store), 3)
+        self.assertFalse(store.seen(event_key('item.added', {'basket_id': 'B0'})))
+        self.assertTrue(store.seen(event_key('item.added', {'basket_id': 'B4'})))
+
+    def test_event_key_is_fixed_size_and_field_sensitive(self):
+        """Test keys are 16 bytes and differ on event-specific fields"""
+        first = event_key('item.added', {'basket_id': 'B1', 'product_id': 'P1'})
+        second = event_key('item.added', {'basket_id': 'B1', 'product_id': 'P2'})
+
+        self.assertEqual(len(first), 16)
+        self.assertNotEqual(first, second)
+
+
+class LatencyHistogramTest(SimpleTestCase):
+
+    def test_percentiles_within_bucket_resolution(self):
+        """Test percentiles land within one bucket (25%) of the true value"""
+        histogram = LatencyHistogram()
+        for latency in range(1, 101):
+            histogram.record(float(latency))
+
+        self.assertEqual(histogram.count, 100)
+        self.assertTrue(50 <= histogram.percentile(50) <= 62.5)
+        self.assertTrue(99 <= histogram.percentile(99) <= 100)
+        self.assertEqual(histogram.percentile(100), 100.0)
+
+
+class CircuitBreakerTest(SimpleTestCase):
+
+    def test_half_open_probe_closes_or_reopens(self):
+        """Test one probe is allowed after the recovery time and decides the state"""
+        breaker = CircuitBreaker('plugin', failure_threshold=2, recovery_seconds=10)
+        breaker.record_failure(now=0)
+        self.assertTrue(breaker.allow(now=1))
+        breaker.record_failure(now=1)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow(now=5))
+
+        self.assertTrue(breaker.allow(now=11))
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertFalse(breaker.allow(now=11))
+        breaker.record_failure(now=12)
+        self.assertEqual(breaker.state, OPEN)
+
+        self.assertTrue(breaker.allow(now=22))
+        self.assertTrue(breaker.record_success())
+        self.assertEqual(breaker.state, CLOSED)
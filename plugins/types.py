@@ -9,4 +9,5 @@ class Plugin:
     enabled: bool
     description: str
     config: str
-    supported_events: List[str]
\ No newline at end of file
+    supported_events: List[str]
+    circuit_state: str = 'closed'
@@ -0,0 +1,6 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('metrics/', views.plugin_metrics_view, name='plugin_metrics'),
+]
@@ -1,3 +1,20 @@
-from django.shortcuts import render
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from plugins.metrics import circuit_states, load_snapshots, plugin_metrics, sum_gauges, summarize
 
-# Create your views here.
+
+@require_GET
+def plugin_metrics_view(request):
+    """Per-plugin, per-event-type counters and latency percentiles as JSON"""
+    snapshots = load_snapshots()
+    # Include plugins run inside this process (e.g. a dev server consuming in-process)
+    local = plugin_metrics.snapshot()
+    if local['series'] and all(s['pid'] != local['pid'] for s in snapshots):
+        snapshots.append(local)
+    
+    return JsonResponse({
+        'processes': len(snapshots),
+        'plugins': summarize(snapshots),
+        'circuits': circuit_states(snapshots),
+        'gauges': sum_gauges(snapshots)
+    })
@@ -0,0 +1,72 @@
+from collections import namedtuple
+from django.conf import settings
+from .models import Product
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Control event published on KAFKA_CONTROL_TOPIC when a Product's age
+# restriction changes, so every process reloads its catalogue index
+PRODUCTS_CHANGED = 'PRODUCTS_CHANGED'
+
+RestrictedProduct = namedtuple('RestrictedProduct', ['product_id', 'name', 'minimum_age', 'category', 'price'])
+
+
+class RestrictedProductIndex:
+    """Age-restricted products held in memory, keyed by product_id.
+    
+    Loaded with one query on first use and dropped by ``invalidate`` when a
+    product's age restriction is saved or a restricted product deleted (or
+    the PRODUCTS_CHANGED control event arrives), so checking whether a
+    scanned product is restricted is a single dict lookup. Writes that send
+    no signal (``QuerySet.update``, bulk loads) and name or price edits are
+    picked up by reloading once the index is older than
+    RESTRICTED_PRODUCTS_MAX_AGE_SECONDS.
+    """
+    
+    def __init__(self):
+        self._products = None
+        self._loaded_at = 0.0
+        self._version = 0
+        self._lock = threading.Lock()
+    
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._products = None
+    
+    def get(self, product_id):
+        """The RestrictedProduct for product_id, or None if it is not age restricted"""
+        products = self._products
+        if products is None or time.monotonic() - self._loaded_at > settings.RESTRICTED_PRODUCTS_MAX_AGE_SECONDS:
+            products = self._load()
+        return products.get(product_id)
+    
+    def is_restricted(self, product_id):
+        return self.get(product_id) is not None
+    
+    def _load(self):
+        version = self._version
+        loaded_at = time.monotonic()
+        products = {
+            product_id: RestrictedProduct(
+                product_id, name, minimum_age, age_restriction_category or category, float(price)
+            )
+            for product_id, name, minimum_age, age_restriction_category, category, price
+            in Product.objects.filter(age_restricted=True).values_list(
+                'product_id', 'name', 'minimum_age', 'age_restriction_category', 'category', 'price'
+            )
+        }
+        with self._lock:
+            # Only publish if no invalidation raced with the load
+            if self._version == version:
+                self._products = products
+                self._loaded_at = loaded_at
+        logger.info(f"Loaded restricted product index: {len(products)} products")
+        return products
+
+
+# Global restricted product index instance
+restricted_products = RestrictedProductIndex()
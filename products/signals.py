@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from events.control import control_listener
+from events.outbox import enqueue_event
+from .catalogue import restricted_products, PRODUCTS_CHANGED
+from .models import Product
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Fields that decide whether and how a product is age restricted
+RESTRICTION_FIELDS = ('age_restricted', 'minimum_age', 'age_restriction_category')
+
+
+def _restriction(product):
+    return tuple(getattr(product, field) for field in RESTRICTION_FIELDS)
+
+
+@receiver(pre_save, sender=Product)
+def remember_restriction(sender, instance, **kwargs):
+    """Keep the stored restriction fields so post_save can tell whether they changed"""
+    instance._stored_restriction = None
+    if instance.pk is not None:
+        instance._stored_restriction = (
+            Product.objects.filter(pk=instance.pk).values_list(*RESTRICTION_FIELDS).first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, **kwargs):
+    if created:
+        changed = instance.age_restricted
+    else:
+        changed = getattr(instance, '_stored_restriction', None) != _restriction(instance)
+    if changed:
+        restrictions_changed(instance)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    if instance.age_restricted:
+        restrictions_changed(instance)
+
+
+def restrictions_changed(product):
+    """Reload this process's restricted product index and tell every other process.
+
+    Only restriction changes are broadcast; name and price edits of a
+    restricted product reach the index with its periodic reload.
+    """
+    restricted_products.invalidate()
+    enqueue_event(settings.KAFKA_CONTROL_TOPIC, {
+        'event_type': PRODUCTS_CHANGED,
+        'timestamp': timezone.now().isoformat(),
+        'product_id': product.product_id
+    })
+
+
+def product_changed_elsewhere(event_data):
+    restricted_products.invalidate()
+    logger.info(f"Product {event_data.get('product_id')} changed, restricted product index invalidated")
+
+
+control_listener.register(PRODUCTS_CHANGED, product_changed_elsewhere)
@@ -26,6 +26,8 @@ sleep 15
 echo ""
 echo "Creating Kafka topic: pos-events"
 docker exec -it $(docker ps -q -f name=kafka) kafka-topics --create --topic pos-events --bootstrap-server localhost:9092 --partitions 1 --replication-factor 1 2>/dev/null || echo "Topic already exists"
+echo "Creating Kafka topic: pos-control"
+docker exec -it $(docker ps -q -f name=kafka) kafka-topics --create --topic pos-control --bootstrap-server localhost:9092 --partitions 1 --replication-factor 1 2>/dev/null || echo "Topic already exists"
 
 # Run migrations
 echo ""
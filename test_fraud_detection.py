@@ -53,6 +53,7 @@ def test_multiple_terminals():
         plugin.handle_event(event['event_type'], event)
     
     # Check if alert was created
+    plugin.flush()
     alerts = FraudAlert.objects.filter(rule__rule_id='multiple_terminals').count()
     print(f"Alerts created: {alerts}")
 
@@ -83,6 +84,7 @@ def test_rapid_items():
             'timestamp': datetime.now().isoformat()
         })
     
+    plugin.flush()
     alerts = FraudAlert.objects.filter(rule__rule_id='rapid_items').count()
     print(f"Alerts created: {alerts}")
 
@@ -111,6 +113,7 @@ def test_high_value_payment():
         'timestamp': datetime.now().isoformat()
     })
     
+    plugin.flush()
     alerts = FraudAlert.objects.filter(rule__rule_id='high_value_payment').count()
     print(f"Alerts created: {alerts}")
 